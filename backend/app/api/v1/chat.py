@@ -1,15 +1,23 @@
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from typing import Optional
 import json
+import logging
+import time
 
 from app.db.session import get_db
 from app.models.user import User
 from app.models.chat import ChatSession, ChatMessage
 from app.core.security import get_current_active_user
 from app.core.rag_service import rag_service
+from app.core.answer_cache import answer_cache
+from app.core.corpus import corpus_generation
+from app.core.admission import AdmissionRejected, AdmissionSlot, llm_admission
+from app.core import metrics
+from app.core.log import verbose
 
 from app.schemas.chat import (
     ChatSessionResponse,
@@ -23,6 +31,45 @@ from app.schemas.document import ChunkSearchResult
 from app.config import settings
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+def _answer_cache_namespace(request: ChatRequest, top_k: int, owner_id: Optional[int]) -> tuple:
+    """同一检索范围和参数下的问题才共享缓存的回答"""
+    return (
+        owner_id,
+        tuple(sorted(request.document_ids)) if request.document_ids else None,
+        top_k,
+        request.hybrid,
+        request.mmr,
+        request.mmr_lambda,
+        request.mmr_candidates,
+        request.neighbours,
+        request.parents,
+    )
+
+
+async def _cached_answer(request: ChatRequest, user_message: str, namespace: tuple):
+    """查找语义答案缓存，返回 (命中的回答, 查询向量)"""
+    if not request.use_cache or not answer_cache.maxsize:
+        return None, None
+    # 语料版本变化（包括其他进程的修改）时清空缓存
+    await corpus_generation()
+    # 查询向量有进程内缓存，随后的检索不会重复请求 Embedding API
+    query_embedding = await rag_service.aembed_query(user_message)
+    return answer_cache.lookup(namespace, query_embedding), query_embedding
+
+
+async def _admit(user_id: int) -> AdmissionSlot:
+    """获取 LLM 生成名额，未获准入时返回 429 / 503"""
+    try:
+        return await llm_admission.acquire(user_id)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)},
+        )
 
 
 @router.post("/sessions", response_model=ChatSessionResponse)
@@ -175,12 +222,50 @@ async def chat(
     if not user_message:
         raise HTTPException(status_code=400, detail="没有用户消息")
 
-    contexts = await rag_service.search_similar(db, user_message, request.top_k)
-    context_texts = [c["content"] for c in contexts]
+    owner_id = current_user.id if settings.SEARCH_OWN_DOCUMENTS_ONLY else None
+    cache_namespace = _answer_cache_namespace(request, request.top_k, owner_id)
+    cached, query_embedding = await _cached_answer(request, user_message, cache_namespace)
+    generation = answer_cache.generation
 
-    answer = await rag_service.generate_answer(
-        user_message, context_texts, stream=False
-    )
+    (metrics.CHAT_REQUESTS_CHAT_CACHED if cached else metrics.CHAT_REQUESTS_CHAT_UNCACHED).inc()
+    if cached:
+        contexts, answer = cached.sources, cached.answer
+    else:
+        try:
+            contexts = await rag_service.search_similar(
+                db,
+                user_message,
+                request.top_k,
+                ef_search=request.ef_search,
+                probes=request.probes,
+                hybrid=request.hybrid,
+                mmr=request.mmr,
+                mmr_lambda=request.mmr_lambda,
+                mmr_candidates=request.mmr_candidates,
+                owner_id=owner_id,
+                document_ids=request.document_ids,
+                neighbours=request.neighbours,
+                parents=request.parents,
+            )
+            # 结束检索用的事务、把连接归还连接池（保存消息时会话重新取连接），
+            # 排队和生成期间只占用生成名额，不占用数据库连接
+            await db.commit()
+            slot = await _admit(current_user.id)
+            try:
+                answer = await rag_service.generate_answer(
+                    user_message, contexts, stream=False
+                )
+            finally:
+                slot.release()
+        except HTTPException:
+            raise
+        except Exception:
+            metrics.CHAT_ERRORS_CHAT.inc()
+            raise
+        if query_embedding is not None and isinstance(answer, str):
+            answer_cache.store(
+                cache_namespace, query_embedding, answer, contexts, generation=generation
+            )
 
     if session_id:
         user_msg = ChatMessage(
@@ -232,7 +317,7 @@ async def chat_stream(
     """聊天问答（流式）"""
     session_id = request.session_id
 
-    print(f"🔍 [STREAM] 收到请求，session_id={session_id}")
+    logger.debug("流式对话请求，session_id=%s", session_id)
 
     # 获取用户消息
     user_message = None
@@ -244,41 +329,105 @@ async def chat_stream(
     if not user_message:
         raise HTTPException(status_code=400, detail="没有用户消息")
 
-    # ⚠️ 向量搜索
-    contexts = await rag_service.search_similar(
-        db, user_message, settings.DEFAULT_TOP_K
-    )
+    owner_id = current_user.id if settings.SEARCH_OWN_DOCUMENTS_ONLY else None
+    cache_namespace = _answer_cache_namespace(request, settings.DEFAULT_TOP_K, owner_id)
+    cached, query_embedding = await _cached_answer(request, user_message, cache_namespace)
+    generation = answer_cache.generation
+
+    (metrics.CHAT_REQUESTS_STREAM_CACHED if cached else metrics.CHAT_REQUESTS_STREAM_UNCACHED).inc()
+    if cached:
+        logger.debug("命中答案缓存（相似度 %.3f），不再调用 LLM", cached.similarity)
+        contexts = cached.sources
+    else:
+        # ⚠️ 向量搜索
+        contexts = await rag_service.search_similar(
+            db,
+            user_message,
+            settings.DEFAULT_TOP_K,
+            ef_search=request.ef_search,
+            probes=request.probes,
+            hybrid=request.hybrid,
+            mmr=request.mmr,
+            mmr_lambda=request.mmr_lambda,
+            mmr_candidates=request.mmr_candidates,
+            owner_id=owner_id,
+            document_ids=request.document_ids,
+            neighbours=request.neighbours,
+            parents=request.parents,
+        )
+
+    if verbose(logger):
+        logger.debug(
+            "检索结果明细",
+            extra={
+                "hits": [
+                    {"id": c.get("id"), "document_id": c.get("document_id"), "score": round(c.get("score", 0), 3)}
+                    for c in contexts
+                ]
+            },
+        )
 
-    # ⚠️ 日志输出
-    print(f"🔍 [STREAM] 检索到 {len(contexts)} 条内容")
-    print(f"🔍 [STREAM] contexts 类型：{type(contexts)}")
-    if contexts:
-        print(f"🔍 [STREAM] 第一个元素类型：{type(contexts[0])}")
-        for i, c in enumerate(contexts[:3]):
-            if isinstance(c, dict):
-                print(f"   [{i}] 相似度：{c.get('score', 0):.3f}")
+    # 需要调用 LLM 时先获取生成名额（排队或直接返回 429 / 503）
+    # 结束检索用的事务、把连接归还连接池（保存消息时会话重新取连接），
+    # 排队和流式输出期间只占用生成名额，不占用数据库连接
+    await db.commit()
+    slot = None if cached else await _admit(current_user.id)
 
     # 收集完整回答
     full_answer = ""
 
+    async def replay(chunks):
+        for chunk in chunks:
+            yield chunk
+
     async def generate():
         nonlocal full_answer
 
         try:
-            print("🔄 [STREAM] 开始生成回答...")
-
             # ⚠️ 传递 contexts 给 rag_service
-            async for chunk in rag_service.chat_stream(user_message, contexts):
+            chunks = []
+            stream = (
+                replay(cached.chunks)
+                if cached
+                else rag_service.chat_stream(user_message, contexts)
+            )
+            started = time.perf_counter()
+            async for chunk in stream:
                 full_answer += chunk
+                chunks.append(chunk)
                 yield f" {json.dumps({'content': chunk}, ensure_ascii=False)}\n\n"
-
-            print(f"✅ [STREAM] 生成完成，完整回答：{repr(full_answer)}")
+            generation_seconds = time.perf_counter() - started
+
+            # 生成结束即释放名额，不等保存消息
+            if slot is not None:
+                slot.release()
+            logger.info(
+                "流式回答完成",
+                extra={
+                    "session_id": session_id,
+                    "cached": bool(cached),
+                    "contexts": len(contexts),
+                    "answer_chars": len(full_answer),
+                },
+            )
+            if verbose(logger):
+                logger.debug("完整回答：%r", full_answer)
             yield " [DONE]\n\n"
 
+            if not cached:
+                rag_service.record_generation_rate(full_answer, generation_seconds)
+            if not cached and query_embedding is not None:
+                answer_cache.store(
+                    cache_namespace,
+                    query_embedding,
+                    full_answer,
+                    contexts,
+                    chunks=chunks,
+                    generation=generation,
+                )
+
             # 保存到数据库
             if session_id and full_answer:
-                print(f"💾 [STREAM] 保存消息到会话 {session_id}...")
-
                 try:
                     user_msg = ChatMessage(
                         session_id=session_id,
@@ -309,24 +458,29 @@ async def chat_stream(
                         session.updated_at = func.now()
 
                     await db.commit()
-                    print(f"✅ [STREAM] 消息保存成功！")
+                    logger.debug("消息已保存到会话 %s", session_id)
 
                 except Exception as save_error:
-                    print(f"❌ [STREAM] 保存失败：{save_error}")
+                    logger.error("保存消息失败：%s", save_error)
                     await db.rollback()
                     raise
 
         except Exception as e:
-            print(f"❌ [STREAM] 生成异常：{e}")
-            import traceback
-
-            traceback.print_exc()
+            metrics.CHAT_ERRORS_STREAM.inc()
+            logger.exception("流式生成异常")
             await db.rollback()
             yield f" {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
 
+        finally:
+            # 客户端断开、生成异常时同样释放
+            if slot is not None:
+                slot.release()
+
     return StreamingResponse(
         generate(),
         media_type="text/event-stream",
+        # 响应未开始迭代就结束（如客户端提前断开）时由后台任务兜底释放
+        background=BackgroundTask(slot.release) if slot is not None else None,
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
@@ -1,21 +1,28 @@
 import os
 import uuid
-from typing import List
+import asyncio
+import hashlib
+from typing import BinaryIO, List, Tuple
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, func, text
 
 from app.db.session import get_db, async_session_maker
-from app.models.document import Document, DocumentChunk
+from app.models.document import Document, DocumentChunk, DocumentSection, IngestionJob
 from app.schemas.document import (
     DocumentUploadResponse,
     DocumentListResponse,
     DocumentDetailResponse,
+    IngestionJobResponse,
 )
+from app.core import metrics
+from app.core.ingestion import enqueue_document, ingestion_pool, job_metrics
 from app.core.rag_service import rag_service
+from app.core.corpus import bump_corpus_generation
 from app.models.user import User
 from app.core.deps import get_current_active_user
+from app.config import settings
 
 router = APIRouter()
 
@@ -26,6 +33,84 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 # 允许的文件类型
 ALLOWED_EXTENSIONS = {"pdf", "txt", "md", "docx"}
 
+# 上传文件的 advisory lock 命名空间（与文件名的 hashtext 组成两段式键）
+FILE_LOCK_NAMESPACE = 7_305_012
+
+
+def _write_chunk(buffer: BinaryIO, hasher, chunk: bytes) -> None:
+    """写入一块数据并更新哈希（在线程中执行）"""
+    buffer.write(chunk)
+    hasher.update(chunk)
+
+
+async def _lock_file(db: AsyncSession, file_path: str) -> None:
+    """锁定上传文件直到事务结束
+
+    相同内容的上传共用同一个文件：保存文件并写入引用它的文档记录、确认没有引用后删除文件，
+    这两类操作对同一文件依次进行。
+    """
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(:namespace, hashtext(:name))"),
+        {"namespace": FILE_LOCK_NAMESPACE, "name": os.path.basename(file_path)},
+    )
+
+
+async def _remove_unreferenced_file(db: AsyncSession, file_path: str) -> None:
+    """文件没有文档引用时删除（在删除引用的事务提交之后调用）"""
+    await _lock_file(db, file_path)
+    result = await db.execute(
+        select(func.count(Document.id)).where(Document.file_path == file_path)
+    )
+    if not result.scalar() and os.path.exists(file_path):
+        await asyncio.to_thread(os.remove, file_path)
+    await db.commit()
+
+
+async def _save_upload(
+    db: AsyncSession, file: UploadFile, ext: str
+) -> Tuple[str, int, str]:
+    """分块流式写入磁盘，同时计算字节数和 SHA-256；文件超过 MAX_FILE_SIZE 时中止
+
+    UploadFile 在 multipart 解析时已完整接收，这里只做精确的文件大小检查；
+    请求体大小由 BodySizeLimitMiddleware 在接收时限制。
+
+    文件按内容寻址保存为 {sha256}.{ext}，相同内容的上传共用同一个文件。保存前锁定该文件，
+    调用方在同一事务中写入引用它的文档记录，提交前其他请求不会删除这个文件。
+    返回 (文件路径, 字节数, 内容哈希)。
+    """
+    tmp_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}.part")
+    hasher = hashlib.sha256()
+    size = 0
+
+    buffer = await asyncio.to_thread(open, tmp_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > settings.MAX_FILE_SIZE:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"文件大小超过限制：{settings.MAX_FILE_SIZE} 字节",
+                )
+            await asyncio.to_thread(_write_chunk, buffer, hasher, chunk)
+    except BaseException:
+        await asyncio.to_thread(buffer.close)
+        await asyncio.to_thread(os.remove, tmp_path)
+        raise
+
+    await asyncio.to_thread(buffer.close)
+    content_hash = hasher.hexdigest()
+    file_path = os.path.join(UPLOAD_DIR, f"{content_hash}.{ext}")
+    try:
+        await _lock_file(db, file_path)
+    except BaseException:
+        await asyncio.to_thread(os.remove, tmp_path)
+        raise
+    await asyncio.to_thread(os.replace, tmp_path, file_path)
+    return file_path, size, content_hash
+
 
 @router.post("/upload", response_model=DocumentUploadResponse)
 async def upload_document(
@@ -41,66 +126,214 @@ async def upload_document(
     if ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail=f"不支持的文件类型：{ext}")
 
-    # 生成唯一文件名
-    file_id = str(uuid.uuid4())
-    safe_filename = f"{file_id}.{ext}"
-    file_path = os.path.join(UPLOAD_DIR, safe_filename)
+    # 已知大小时提前拒绝
+    if file.size is not None and file.size > settings.MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"文件大小超过限制：{settings.MAX_FILE_SIZE} 字节",
+        )
 
     # 保存文件
     try:
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        file_path, file_size, content_hash = await _save_upload(db, file, ext)
+    except HTTPException:
+        raise
     except Exception as e:
+        metrics.DOCUMENT_UPLOADS_ERROR.inc()
         raise HTTPException(status_code=500, detail=f"文件保存失败：{str(e)}")
 
     # 创建数据库记录
     document = Document(
         filename=file.filename,
         file_path=file_path,
-        file_size=len(content),
+        file_size=file_size,
         file_type=ext,
-        status="processing",
+        content_hash=content_hash,
+        status="pending",
         owner_id=current_user.id,
     )
     db.add(document)
+    await db.flush()
+
+    # 内容和类型相同且已处理完成的文档：直接复用片段和向量，不再解析和调用 Embedding
+    # （类型决定解析方式；启用父级段落时，没有段落的旧文档需要重新处理）
+    reusable = select(Document).where(
+        Document.content_hash == content_hash,
+        Document.file_type == ext,
+        Document.status == "completed",
+        Document.id != document.id,
+    )
+    if settings.PARENT_SECTIONS_ENABLED:
+        reusable = reusable.where(
+            select(DocumentSection.id)
+            .where(DocumentSection.document_id == Document.id)
+            .exists()
+        )
+    result = await db.execute(reusable.order_by(Document.id).limit(1))
+    existing = result.scalar_one_or_none()
+    if existing:
+        chunk_count = await rag_service.copy_chunks(db, existing.id, document.id)
+        document.status = "completed"
+        await db.commit()
+        await bump_corpus_generation()
+        metrics.DOCUMENT_UPLOADS_DUPLICATE.inc()
+        metrics.INGESTION_CHUNKS_COPIED.inc(chunk_count)
+
+        return DocumentUploadResponse(
+            id=document.id,
+            filename=document.filename,
+            file_size=document.file_size,
+            file_type=document.file_type,
+            status=document.status,
+            message=f"检测到相同文档，已复用 {chunk_count} 个片段",
+        )
+
+    # 加入后台处理队列，立即返回任务 ID
+    job = await enqueue_document(db, document)
     await db.commit()
-    await db.refresh(document)
+    ingestion_pool.notify()
+    metrics.DOCUMENT_UPLOADS_QUEUED.inc()
 
-    # 异步处理文档（简化版：同步处理）
-    try:
-        # 加载文档
-        documents = rag_service.load_document(file_path, ext)
+    return DocumentUploadResponse(
+        id=document.id,
+        filename=document.filename,
+        file_size=document.file_size,
+        file_type=document.file_type,
+        status=document.status,
+        message="文档已加入处理队列",
+        job_id=job.id,
+    )
 
-        # 分割文档
-        chunks = rag_service.split_documents(documents)
-        chunk_texts = [chunk.page_content for chunk in chunks]
 
-        # 生成向量
-        if chunk_texts:
-            embeddings = rag_service.embed_texts(chunk_texts)
+@router.put("/{document_id}", response_model=DocumentUploadResponse)
+async def replace_document(
+    document_id: int,
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """替换文档内容（增量重建索引，只处理变化的片段）"""
+    # 锁定文档行直到提交：并发的替换请求在这里排队，不会都通过下面的任务检查
+    result = await db.execute(
+        select(Document)
+        .where(Document.id == document_id, Document.owner_id == current_user.id)
+        .with_for_update()
+    )
+    document = result.scalar_one_or_none()
 
-            # 存储到数据库
-            await rag_service.store_chunks(db, document.id, chunk_texts, embeddings)
+    if not document:
+        raise HTTPException(status_code=404, detail="文档不存在")
 
-        # 更新状态
-        document.status = "completed"
-        await db.commit()
+    # 同一文档同时只允许一个处理任务
+    active_result = await db.execute(
+        select(func.count(IngestionJob.id)).where(
+            IngestionJob.document_id == document_id,
+            IngestionJob.status.in_(["pending", "running"]),
+        )
+    )
+    if active_result.scalar():
+        raise HTTPException(status_code=409, detail="文档正在处理中，请稍后再试")
+
+    # 验证文件类型
+    if not file.filename or "." not in file.filename:
+        raise HTTPException(status_code=400, detail="文件名无效或缺少扩展名")
+    ext = file.filename.split(".")[-1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"不支持的文件类型：{ext}")
 
+    if file.size is not None and file.size > settings.MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"文件大小超过限制：{settings.MAX_FILE_SIZE} 字节",
+        )
+
+    try:
+        file_path, file_size, content_hash = await _save_upload(db, file, ext)
+    except HTTPException:
+        raise
+    except Exception as e:
+        metrics.DOCUMENT_UPLOADS_ERROR.inc()
+        raise HTTPException(status_code=500, detail=f"文件保存失败：{str(e)}")
+
+    if content_hash == document.content_hash and document.status == "completed":
+        # 内容相同但扩展名不同时，新保存的文件没有文档引用
+        if file_path != document.file_path:
+            await _remove_unreferenced_file(db, file_path)
+        metrics.DOCUMENT_UPLOADS_UNCHANGED.inc()
         return DocumentUploadResponse(
             id=document.id,
             filename=document.filename,
             file_size=document.file_size,
             file_type=document.file_type,
             status=document.status,
-            message=f"文档处理完成，共 {len(chunks)} 个片段",
+            message="文档内容未变化",
         )
-    except Exception as e:
-        document.status = "failed"
-        document.error_message = str(e)
-        await db.commit()
 
-        raise HTTPException(status_code=500, detail=f"文档处理失败：{str(e)}")
+    old_file_path = document.file_path
+    document.filename = file.filename
+    document.file_path = file_path
+    document.file_size = file_size
+    document.file_type = ext
+    document.content_hash = content_hash
+    document.status = "pending"
+    document.error_message = None
+
+    job = await enqueue_document(db, document, kind="reindex")
+    await db.commit()
+    ingestion_pool.notify()
+    metrics.DOCUMENT_UPLOADS_REINDEX.inc()
+
+    # 旧文件没有其他引用时删除
+    if old_file_path != file_path:
+        await _remove_unreferenced_file(db, old_file_path)
+
+    return DocumentUploadResponse(
+        id=document.id,
+        filename=document.filename,
+        file_size=document.file_size,
+        file_type=document.file_type,
+        status=document.status,
+        message="文档已加入重新索引队列",
+        job_id=job.id,
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=IngestionJobResponse)
+async def get_ingestion_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    """查询文档处理任务进度"""
+    result = await db.execute(
+        select(IngestionJob)
+        .join(Document, Document.id == IngestionJob.document_id)
+        .where(IngestionJob.id == job_id, Document.owner_id == current_user.id)
+    )
+    job = result.scalar_one_or_none()
+
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    progress, elapsed, throughput = job_metrics(job)
+
+    return IngestionJobResponse(
+        id=job.id,
+        document_id=job.document_id,
+        status=job.status,
+        stage=job.stage,
+        total_chunks=job.total_chunks,
+        processed_chunks=job.processed_chunks,
+        progress=progress,
+        elapsed_seconds=elapsed,
+        chunks_per_second=throughput,
+        attempts=job.attempts,
+        error_message=job.error_message,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        next_attempt_at=job.next_attempt_at if job.status == "pending" else None,
+    )
 
 
 @router.get("/list", response_model=List[DocumentListResponse])
@@ -152,12 +385,14 @@ async def delete_document(document_id: int, db: AsyncSession = Depends(get_db)):
     if not document:
         raise HTTPException(status_code=404, detail="文档不存在")
 
-    # 删除文件
-    if os.path.exists(document.file_path):
-        os.remove(document.file_path)
-
     # 删除数据库记录
+    file_path = document.file_path
     await db.delete(document)
     await db.commit()
+    await rag_service.vector_store.delete_documents([document_id])
+    await bump_corpus_generation()
+
+    # 删除文件（内容相同的文档共用同一个文件，提交后仅在没有其他引用时删除）
+    await _remove_unreferenced_file(db, file_path)
 
     return {"message": "文档已删除"}
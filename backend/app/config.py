@@ -1,24 +1,85 @@
+import logging
+import os
+from dotenv import dotenv_values
+from pydantic import AliasChoices, Field
 from pydantic_settings import BaseSettings
 from functools import lru_cache
 from typing import Optional
 
+logger = logging.getLogger(__name__)
+
+# 已改名的配置项：旧名称 -> 新名称（旧名称通过 validation_alias 继续生效）
+DEPRECATED_SETTINGS = {
+    "MAX_CONTEXT_LENGTH": "MAX_CONTEXT_TOKENS（单位由字符改为 token）",
+}
+
 
 class Settings(BaseSettings):
     """应用配置"""
 
     DATABASE_URL: str
     ENVIRONMENT: str = "development"
+    # 日志：级别、格式（text / json）、详细日志（检索结果明细等，DEBUG 级别）按请求采样的比例、写出队列长度
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "text"
+    LOG_SAMPLE_RATE: float = 0.1
+    LOG_QUEUE_SIZE: int = 10000
+    # 输出执行的 SQL（sqlalchemy.engine 的 INFO 日志）；不设置时仅开发环境开启
+    LOG_SQL: Optional[bool] = None
 
     # AI model config - QWen
     DASHSCOPE_API_KEY: str
     QWEN_MODEL: str = "qwen-plus"
+    # 同时进行的 LLM 流式生成上限（线程池大小）；每个流最多预读的分片数（客户端读得慢时生成暂停）
+    LLM_MAX_CONCURRENCY: int = 32
+    LLM_STREAM_BUFFER_SIZE: int = 64
+    # 生成准入：超出并发上限的请求排队（总长度 / 最长等待秒数 / 每个用户的排队上限）
+    LLM_QUEUE_SIZE: int = 100
+    LLM_QUEUE_TIMEOUT: float = 30.0
+    LLM_MAX_QUEUED_PER_USER: int = 2
     QWEN_EMBEDDING_MODEL: str = "text-embedding-v2"
+    # 同时进行的 Embedding 请求上限（线程池大小）
+    EMBEDDING_MAX_CONCURRENCY: int = 16
+    # 入库时的批量 Embedding（批大小不超过服务端单次上限，并发和批大小按延迟 / 限流自适应）
+    EMBEDDING_BATCH_SIZE: int = 25
+    EMBEDDING_MIN_BATCH_SIZE: int = 5
+    EMBEDDING_BATCH_CONCURRENCY: int = 8
+    EMBEDDING_TARGET_LATENCY: float = 2.0
+    EMBEDDING_MAX_RETRIES: int = 5
+    # 片段向量持久化缓存（按模型 + 文本哈希）
+    EMBEDDING_CACHE_ENABLED: bool = True
+    # 查询向量进程内缓存（LRU + TTL，SIZE=0 关闭）
+    QUERY_EMBEDDING_CACHE_SIZE: int = 2048
+    QUERY_EMBEDDING_CACHE_TTL: int = 3600
+    # 语义答案缓存：与已缓存问题的余弦距离不超过 MAX_DISTANCE 时直接返回缓存的回答
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_SIZE: int = 1000
+    ANSWER_CACHE_TTL: int = 3600
+    ANSWER_CACHE_MAX_DISTANCE: float = 0.05
+    # 检索结果缓存（按查询 + 检索参数 + 语料版本，SIZE=0 关闭）
+    RETRIEVAL_CACHE_SIZE: int = 2048
+    RETRIEVAL_CACHE_TTL: int = 600
+    # 各进程重新读取语料版本的间隔（秒），其他进程的修改最迟在此间隔后生效
+    CORPUS_GENERATION_REFRESH_INTERVAL: float = 2.0
 
     # upload config
     MAX_FILE_SIZE: int = 10485760  # 10MB
+    UPLOAD_CHUNK_SIZE: int = 1048576  # 上传分块写入大小 1MB
     UPLOAD_FOLDER: str = "uploads"
     ALLOWED_EXTENSIONS: str = "pdf,txt,md,docx"
 
+    # 文档处理队列配置（INGESTION_WORKERS=0 时不在 API 进程内启动工作协程）
+    INGESTION_WORKERS: int = 2
+    INGESTION_POLL_INTERVAL: float = 2.0
+    INGESTION_JOB_TIMEOUT: int = 600  # 心跳超时（秒），超时的任务会被重新领取
+    INGESTION_HEARTBEAT_INTERVAL: float = 30.0  # 处理期间刷新心跳的间隔（秒），应远小于 INGESTION_JOB_TIMEOUT
+    INGESTION_MAX_ATTEMPTS: int = 3
+    INGESTION_RETRY_BACKOFF: float = 10.0  # 处理失败后重试的等待时间（秒），每次失败翻倍
+    INGESTION_EMBED_BATCH_SIZE: int = 500  # 每处理多少片段更新一次进度
+    # 独立运行的文档处理进程提供 /metrics 的端口（0 为不开启；进程内的工作协程通过 API 的 /metrics 暴露）
+    INGESTION_METRICS_PORT: int = 0
+    CHUNK_INSERT_BATCH_SIZE: int = 1000  # 片段 COPY 写入每批行数（每批提交一次）
+
     # JWT 配置
     SECRET_KEY: str = "your-secret-key-change-in-production"
     ALGORITHM: str = "HS256"
@@ -26,9 +87,52 @@ class Settings(BaseSettings):
 
  
     SIMILARITY_THRESHOLD: float = 0.5
-    MAX_CONTEXT_LENGTH: int = 4000
+    # Prompt 中参考内容的 token 预算（MAX_CONTEXT_LENGTH 为已弃用的旧名称）
+    MAX_CONTEXT_TOKENS: int = Field(
+        2000, validation_alias=AliasChoices("MAX_CONTEXT_TOKENS", "MAX_CONTEXT_LENGTH")
+    )
+    NEIGHBOUR_CHUNKS: int = 0  # 检索结果前后各扩展的相邻片段数（合并为连续段落），0 关闭
+    # 父级段落：小片段用于匹配，返回其所属的大段落作为上下文（需重新处理文档）
+    PARENT_SECTIONS_ENABLED: bool = False
+    SECTION_SIZE: int = 2000  # 父级段落最大字符数
     DEFAULT_TOP_K: int = 5
+    # 问答只检索当前用户上传的文档
+    SEARCH_OWN_DOCUMENTS_ONLY: bool = True
+
+    # 向量索引配置（hnsw / ivfflat / none）
+    VECTOR_INDEX_TYPE: str = "hnsw"
+    HNSW_M: int = 16
+    HNSW_EF_CONSTRUCTION: int = 64
+    HNSW_EF_SEARCH: int = 40
+    # IVFFlat：lists=0 时按行数自动确定；行数不足 IVFFLAT_MIN_ROWS 时不建索引
+    IVFFLAT_LISTS: int = 0
+    IVFFLAT_PROBES: int = 1
+    IVFFLAT_MIN_ROWS: int = 10000
+    # 文档处理完成后检查 IVFFlat lists 是否仍适合数据量的最小间隔（秒）
+    IVFFLAT_CHECK_INTERVAL: int = 600
+    # 向量存储方式（full / halfvec / binary），压缩方式下先用压缩向量取候选再精确重排
+    VECTOR_STORAGE_MODE: str = "full"
+    QUANTIZED_RERANK_CANDIDATES: int = 200
+    # PCA 降维索引（python -m app.core.projection 生成），启用后先在降维索引上取候选再精确重排
+    PROJECTION_ENABLED: bool = False
+    PROJECTION_DIM: int = 256
+    PROJECTION_SAMPLE_SIZE: int = 20000
+    PROJECTION_RERANK_CANDIDATES: int = 200
+    PROJECTION_REFRESH_INTERVAL: int = 60  # 各进程重新加载当前投影的间隔（秒）
+    # 向量检索后端（pgvector / numpy）；numpy 为单节点内存映射存储，需单个 API 进程且文档处理在进程内执行
+    VECTOR_STORE_BACKEND: str = "pgvector"
+    NUMPY_STORE_PATH: str = "./vector_store"
 
+    # 混合检索：向量 + 关键词，RRF 融合排序
+    HYBRID_SEARCH_ENABLED: bool = True
+    HYBRID_CANDIDATES: int = 20  # 每一路检索的候选数量
+    LEXICAL_MAX_MATCHES: int = 1000  # 关键词检索最多对多少个匹配片段计算相关度后排序
+    RRF_K: int = 60
+
+    # MMR 多样性重排：先取 MMR_CANDIDATES 个候选，再选出 top_k 个
+    MMR_ENABLED: bool = False
+    MMR_LAMBDA: float = 0.5  # 1 只看相关度，0 只看多样性
+    MMR_CANDIDATES: int = 50
 
     RAG_PROMPT_WITH_CONTEXT: Optional[str] = None
     RAG_PROMPT_WITHOUT_CONTEXT: Optional[str] = None
@@ -39,8 +143,17 @@ class Settings(BaseSettings):
         extra = "ignore"
 
 
+def _warn_deprecated_settings() -> None:
+    """使用已改名的配置项时提示"""
+    configured = {**dotenv_values(Settings.model_config.get("env_file")), **os.environ}
+    for old_name, new_name in DEPRECATED_SETTINGS.items():
+        if old_name in configured:
+            logger.warning("配置项 %s 已弃用，请改用 %s", old_name, new_name)
+
+
 @lru_cache()
 def get_settings() -> Settings:
+    _warn_deprecated_settings()
     return Settings()  # type: ignore[call-arg]
 
 
@@ -0,0 +1,171 @@
+"""
+LLM 生成准入控制
+
+同时进行的生成数不超过 LLM_MAX_CONCURRENCY，超出的请求进入有界等待队列：
+- 每个用户排队数超过 LLM_MAX_QUEUED_PER_USER：429（该用户请求过多）
+- 等待队列已满（LLM_QUEUE_SIZE）或等待超过 LLM_QUEUE_TIMEOUT 秒：503（服务繁忙）
+- 名额释放时按用户轮转分配，单个用户的大量请求不会挤占其他用户
+
+所有状态只在事件循环线程中读写，不需要加锁。
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Hashable
+
+import numpy as np
+
+from app.config import settings
+from app.core import metrics
+
+# 统计等待时间分位数的样本数
+WAIT_SAMPLE_SIZE = 1000
+# 拒绝时建议客户端重试的间隔（秒）
+RETRY_AFTER_SECONDS = 5
+
+
+class AdmissionRejected(Exception):
+    """请求未获准入"""
+
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = RETRY_AFTER_SECONDS
+
+
+class AdmissionSlot:
+    """生成名额，release() 可重复调用"""
+
+    def __init__(self, controller: "AdmissionController") -> None:
+        self._controller = controller
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release()
+
+
+class AdmissionController:
+    """并发上限 + 按用户轮转的有界等待队列"""
+
+    def __init__(
+        self,
+        limit: int,
+        max_queue: int,
+        max_wait: float,
+        max_queued_per_user: int,
+    ) -> None:
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_queued_per_user = max_queued_per_user
+        self.active = 0
+        self.queued = 0
+        # 用户 -> 等待中的请求，按轮转顺序排列
+        self._waiters: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"user_queue_full": 0, "queue_full": 0, "timeout": 0}
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._recent_waits: Deque[float] = deque(maxlen=WAIT_SAMPLE_SIZE)
+
+    def _admit(self, waited: float) -> AdmissionSlot:
+        self.admitted += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        self._recent_waits.append(waited)
+        metrics.LLM_QUEUE_WAIT_SECONDS.observe(waited)
+        return AdmissionSlot(self)
+
+    def _reject(self, reason: str, status_code: int, detail: str) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        return AdmissionRejected(status_code, detail)
+
+    async def acquire(self, user_id: Hashable) -> AdmissionSlot:
+        """获取生成名额，必要时排队等待；未获准入时抛出 AdmissionRejected"""
+        if self.active < self.limit and not self.queued:
+            self.active += 1
+            return self._admit(0.0)
+
+        waiters = self._waiters.get(user_id)
+        if waiters is not None and len(waiters) >= self.max_queued_per_user:
+            raise self._reject("user_queue_full", 429, "请求过多，请等待之前的回答完成")
+        if self.queued >= self.max_queue:
+            raise self._reject("queue_full", 503, "服务繁忙，请稍后再试")
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user_id, deque()).append(future)
+        self.queued += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 名额已转交过来但请求已退出，交还名额
+                self._release()
+            else:
+                self._remove_waiter(user_id, future)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject("timeout", 503, "服务繁忙，排队超时，请稍后再试")
+            raise
+        return self._admit(time.monotonic() - start)
+
+    @asynccontextmanager
+    async def slot(self, user_id: Hashable) -> AsyncIterator[AdmissionSlot]:
+        """async with controller.slot(user_id): ..."""
+        slot = await self.acquire(user_id)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def _remove_waiter(self, user_id: Hashable, future: asyncio.Future) -> None:
+        waiters = self._waiters.get(user_id)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            self.queued -= 1
+            if not waiters:
+                del self._waiters[user_id]
+
+    def _release(self) -> None:
+        """释放名额：按用户轮转直接转交给下一个等待者，没有等待者时归还"""
+        while self._waiters:
+            user_id, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            self.queued -= 1
+            if waiters:
+                self._waiters.move_to_end(user_id)
+            else:
+                del self._waiters[user_id]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        """准入统计（当前进程）"""
+        waits = np.asarray(self._recent_waits) if self._recent_waits else np.zeros(1)
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.queued,
+            "queued_users": len(self._waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "wait_seconds_avg": self.wait_seconds_total / self.admitted if self.admitted else 0.0,
+            "wait_seconds_p95": float(np.percentile(waits, 95)),
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+
+# 单例
+llm_admission = AdmissionController(
+    limit=settings.LLM_MAX_CONCURRENCY,
+    max_queue=settings.LLM_QUEUE_SIZE,
+    max_wait=settings.LLM_QUEUE_TIMEOUT,
+    max_queued_per_user=settings.LLM_MAX_QUEUED_PER_USER,
+)
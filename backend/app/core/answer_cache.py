@@ -0,0 +1,145 @@
+"""
+语义答案缓存
+
+用户常用略有不同的措辞问同一个问题，生成回答是最慢、最贵的一步。按查询向量缓存回答
+和引用片段：新问题与同一检索范围内某个已缓存问题的余弦距离不超过
+ANSWER_CACHE_MAX_DISTANCE 时，直接返回（或重新流式输出）缓存的回答，不再检索和调用 LLM。
+
+全部向量放在一个预分配的矩阵中，查找是一次矩阵乘法；容量有界，满了淘汰最久未使用的条目。
+语料版本（app.core.corpus）变化时清空缓存；生成期间语料发生变化的回答不会写入。
+"""
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+from app.config import settings
+
+
+@dataclass
+class CachedAnswer:
+    """缓存的回答"""
+
+    answer: str
+    sources: List[dict]
+    chunks: List[str] = field(default_factory=list)  # 流式输出的分片，重放时按原样输出
+    similarity: float = 1.0  # 命中时与缓存问题的余弦相似度
+
+
+class SemanticAnswerCache:
+    """按查询向量近似匹配的答案缓存（LRU + TTL，在事件循环线程中使用）"""
+
+    def __init__(self, maxsize: int, ttl: float, max_distance: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_distance = max_distance
+        # 缓存版本，invalidate() 时递增
+        self.generation = 0
+        self._corpus_generation: Optional[int] = None
+        self._vectors: Optional[np.ndarray] = None  # (maxsize, dim)，已归一化
+        self._namespaces = np.full(maxsize, -1, dtype=np.int64)  # -1 表示空槽
+        self._expires_at = np.zeros(maxsize)
+        self._last_used = np.zeros(maxsize)
+        self._entries: Dict[int, CachedAnswer] = {}
+        self._namespace_ids: Dict[Hashable, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, namespace: Hashable, embedding: Sequence[float]) -> Optional[CachedAnswer]:
+        """查找同一命名空间（检索范围 + 参数）中最相似的已缓存问题"""
+        namespace_id = self._namespace_ids.get(namespace)
+        if namespace_id is None or self._vectors is None:
+            self.misses += 1
+            return None
+
+        now = time.monotonic()
+        valid = (self._namespaces == namespace_id) & (self._expires_at >= now)
+        if not valid.any():
+            self.misses += 1
+            return None
+
+        similarities = self._vectors @ self._normalize(embedding)
+        similarities[~valid] = -np.inf
+        slot = int(np.argmax(similarities))
+        similarity = float(similarities[slot])
+        if 1 - similarity > self.max_distance:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._last_used[slot] = now
+        entry = self._entries[slot]
+        return CachedAnswer(entry.answer, entry.sources, entry.chunks, similarity)
+
+    def store(
+        self,
+        namespace: Hashable,
+        embedding: Sequence[float],
+        answer: str,
+        sources: List[dict],
+        chunks: Optional[List[str]] = None,
+        generation: Optional[int] = None,
+    ) -> None:
+        """写入缓存；generation 与当前缓存版本不一致（生成期间语料有变化）时不写入"""
+        if self.maxsize <= 0 or not answer:
+            return
+        if generation is not None and generation != self.generation:
+            return
+
+        vector = self._normalize(embedding)
+        if self._vectors is None:
+            self._vectors = np.zeros((self.maxsize, len(vector)), dtype=np.float32)
+
+        now = time.monotonic()
+        empty = np.flatnonzero((self._namespaces < 0) | (self._expires_at < now))
+        slot = int(empty[0]) if len(empty) else int(np.argmin(self._last_used))
+
+        self._vectors[slot] = vector
+        self._namespaces[slot] = self._namespace_ids.setdefault(namespace, len(self._namespace_ids))
+        self._expires_at[slot] = now + self.ttl
+        self._last_used[slot] = now
+        self._entries[slot] = CachedAnswer(answer, sources, list(chunks or [answer]))
+
+    def invalidate(self) -> None:
+        """语料变化：清空全部缓存"""
+        self.generation += 1
+        self._namespaces[:] = -1
+        self._entries.clear()
+        self._namespace_ids.clear()
+
+    def sync_generation(self, corpus_generation: int) -> None:
+        """语料版本变化时清空缓存"""
+        if self._corpus_generation is not None and corpus_generation != self._corpus_generation:
+            self.invalidate()
+        self._corpus_generation = corpus_generation
+
+    def stats(self) -> dict:
+        """命中统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "max_distance": self.max_distance,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# 单例
+answer_cache = SemanticAnswerCache(
+    maxsize=settings.ANSWER_CACHE_SIZE if settings.ANSWER_CACHE_ENABLED else 0,
+    ttl=settings.ANSWER_CACHE_TTL,
+    max_distance=settings.ANSWER_CACHE_MAX_DISTANCE,
+)
@@ -0,0 +1,87 @@
+"""
+请求体大小限制
+
+UploadFile 的大小检查发生在 Starlette 的 multipart 解析之后，此时整个请求体已经被接收并
+写入临时文件。BodySizeLimitMiddleware 在接收请求体时计数：
+- Content-Length 超过上限时不读取请求体，直接返回 413
+- 分块传输（没有 Content-Length）时，累计字节数超过上限立即停止接收并返回 413
+"""
+import json
+
+# multipart 边界和各部分头部的额外开销
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class _BodyTooLarge(Exception):
+    """请求体超过上限"""
+
+
+class BodySizeLimitMiddleware:
+    """限制 HTTP 请求体大小（ASGI 中间件）"""
+
+    def __init__(self, app, max_body_size: int) -> None:
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def _reject(self, send) -> None:
+        body = json.dumps(
+            {"detail": f"请求体超过限制：{self.max_body_size} 字节"}, ensure_ascii=False
+        ).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"connection", b"close"),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                if value.isdigit() and int(value) > self.max_body_size:
+                    await self._reject(send)
+                    return
+                break
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                raise _BodyTooLarge()
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message) -> None:
+            nonlocal response_started
+            if exceeded:
+                # 应用对读取失败生成的响应（如解析错误 400）由 413 代替
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # 解析请求体的代码可能把 _BodyTooLarge 包装成其他异常
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            await self._reject(send)
@@ -0,0 +1,123 @@
+"""
+进程内缓存
+
+TTLCache：有界 LRU + 过期时间，适用于查询向量等热点数据。所有读写都在事件循环线程中
+同步完成（中间没有 await），并发的协程不会看到不一致的状态；同一个键的并发未命中
+只会触发一次加载，其余协程等待同一个结果。加载的协程被取消（如客户端断开）时，
+等待中的协程不会随之失败，而是重新加载。
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+_MISSING = object()
+
+
+class _LoadCancelled(Exception):
+    """加载的协程被取消，等待者需要重新加载"""
+
+
+class TTLCache:
+    """LRU + TTL 缓存（asyncio 并发安全）"""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0  # 含等待进行中加载的次数（coalesced）
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _lookup(self, key: Hashable) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return _MISSING
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """读取缓存（计入命中统计）"""
+        value = self._lookup(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """删除单个条目"""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._data.clear()
+
+    async def get_or_load(
+        self, key: Hashable, loader: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """命中直接返回；未命中时调用 loader，同一个键的并发请求只加载一次"""
+        value = self._lookup(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        self.misses += 1
+
+        while True:
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except _LoadCancelled:
+                # 加载方被取消：结果可能已由其他等待者重新加载，否则由本协程加载
+                value = self._lookup(key)
+                if value is not _MISSING:
+                    return value
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            # 不取消共享的 future：等待者没有被取消，只是需要重新加载
+            future.set_exception(_LoadCancelled() if isinstance(e, asyncio.CancelledError) else e)
+            future.exception()  # 没有等待者时避免 "exception was never retrieved"
+            raise
+        else:
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        """命中统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
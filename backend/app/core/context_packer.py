@@ -0,0 +1,151 @@
+"""
+上下文打包
+
+按 token 预算组装 Prompt 中的参考内容：
+- token 数由 Qwen 分词器计算（dashscope 自带词表，需要安装 tiktoken），未安装时按字符类别估算；
+  分词器只加载一次，片段的 token 数按内容缓存
+- 同一文档相邻片段之间由文本分割器产生的重叠部分（chunk_overlap）只保留一份
+- 按相似度从高到低贪心放入完整片段，放不下的片段跳过，不会截断在句子中间
+- 输出时同一文档的片段按原文顺序排列
+"""
+import logging
+import math
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 判定为分割重叠的最短长度（字符），避免偶然相同的短字符串被删除
+MIN_OVERLAP = 10
+# 片段之间的分隔符
+SEPARATOR = "\n\n"
+
+_ESTIMATE_PATTERN = re.compile(r"[㐀-鿿豈-﫿]|[A-Za-z0-9]+|\S")
+
+
+@lru_cache(maxsize=1)
+def _tokenizer():
+    """Qwen 分词器，不可用时返回 None"""
+    try:
+        from dashscope import get_tokenizer
+
+        return get_tokenizer("qwen-plus")
+    except Exception as e:
+        logger.warning("Qwen 分词器不可用（%s），按字符估算 token 数", e)
+        return None
+
+
+def _estimate_tokens(text: str) -> int:
+    """估算 token 数：汉字每字 1 个，英文 / 数字约每 4 个字符 1 个，其他符号每个 1 个（偏保守）"""
+    total = 0
+    for match in _ESTIMATE_PATTERN.finditer(text):
+        token = match.group()
+        total += math.ceil(len(token) / 4) if token[0].isascii() and token[0].isalnum() else 1
+    return total
+
+
+def token_length(text: str) -> int:
+    """文本的 token 数（不缓存，用于只计算一次的文本，如生成的回答）"""
+    tokenizer = _tokenizer()
+    if tokenizer is None:
+        return _estimate_tokens(text)
+    return len(tokenizer.encode(text))
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """文本的 token 数（按内容缓存）"""
+    return token_length(text)
+
+
+def overlap_length(previous: str, following: str) -> int:
+    """previous 末尾与 following 开头相同部分的长度（不足 MIN_OVERLAP 视为无重叠）"""
+    for length in range(min(len(previous), len(following) - 1), MIN_OVERLAP - 1, -1):
+        if previous.endswith(following[:length]):
+            return length
+    return 0
+
+
+@dataclass
+class PackedContext:
+    """打包结果"""
+
+    text: str
+    chunks: List[dict] = field(default_factory=list)  # 放入的片段（输出顺序）
+    tokens: int = 0
+    skipped: int = 0  # 超出预算未放入的片段数
+    overlap_chars: int = 0  # 去掉的重叠字符数
+
+
+def _position(context: dict) -> Optional[Tuple[int, int]]:
+    document_id = context.get("document_id")
+    chunk_index = context.get("chunk_index")
+    if document_id is None or chunk_index is None:
+        return None
+    return document_id, chunk_index
+
+
+def pack_contexts(contexts: List[dict], max_tokens: int) -> PackedContext:
+    """按相似度贪心放入完整片段，总 token 数不超过 max_tokens"""
+    separator_tokens = count_tokens(SEPARATOR)
+    selected: Dict[int, str] = {}  # 候选下标 -> 去掉重叠后的内容
+    by_position: Dict[Tuple[int, int], int] = {}
+    used = 0
+    skipped = 0
+    overlap_chars = 0
+
+    order = sorted(range(len(contexts)), key=lambda i: contexts[i].get("score", 0), reverse=True)
+    for i in order:
+        content = contexts[i].get("content", "")
+        position = _position(contexts[i])
+        if position in by_position:
+            # 重复的片段
+            continue
+
+        # 与已放入的前一个片段重叠：去掉本片段开头；与后一个片段重叠：去掉本片段结尾
+        start, end = 0, len(content)
+        if position is not None:
+            document_id, chunk_index = position
+            previous = by_position.get((document_id, chunk_index - 1))
+            if previous is not None:
+                start = overlap_length(contexts[previous].get("content", ""), content)
+            following = by_position.get((document_id, chunk_index + 1))
+            if following is not None:
+                end = len(content) - overlap_length(
+                    content, contexts[following].get("content", "")
+                )
+        trimmed = content[start:max(start, end)]
+        if not trimmed.strip():
+            continue
+
+        cost = count_tokens(trimmed) + (separator_tokens if selected else 0)
+        if used + cost > max_tokens:
+            skipped += 1
+            continue
+
+        selected[i] = trimmed
+        if position is not None:
+            by_position[position] = i
+        used += cost
+        overlap_chars += len(content) - len(trimmed)
+
+    # 输出顺序：文档按其最相关片段排序，文档内按原文顺序
+    best_rank: Dict[object, int] = {}
+    for rank, i in enumerate(i for i in order if i in selected):
+        key = contexts[i].get("document_id", ("chunk", i))
+        best_rank.setdefault(key, rank)
+
+    def output_key(i: int):
+        document_id = contexts[i].get("document_id", ("chunk", i))
+        return best_rank[document_id], contexts[i].get("chunk_index") or 0
+
+    output = sorted(selected, key=output_key)
+    return PackedContext(
+        text=SEPARATOR.join(selected[i] for i in output),
+        chunks=[contexts[i] for i in output],
+        tokens=used,
+        skipped=skipped,
+        overlap_chars=overlap_chars,
+    )
@@ -0,0 +1,51 @@
+"""
+语料版本
+
+corpus_state.generation 在片段发生变化（文档处理完成 / 失败、复用片段、删除文档）后
+递增。检索缓存和答案缓存的条目带有写入时的版本，版本变化后不再命中。
+
+各进程缓存当前版本 CORPUS_GENERATION_REFRESH_INTERVAL 秒，热点查询不必访问数据库；
+本进程递增时立即更新，其他进程（如独立运行的文档处理进程）的修改最迟在一个刷新间隔后生效。
+"""
+from sqlalchemy import text
+
+from app.config import settings
+from app.core.answer_cache import answer_cache
+from app.core.cache import TTLCache
+from app.db.session import async_session_maker
+
+_generation_cache = TTLCache(maxsize=1, ttl=settings.CORPUS_GENERATION_REFRESH_INTERVAL)
+
+
+async def corpus_generation() -> int:
+    """当前语料版本（进程内缓存）"""
+
+    async def load() -> int:
+        async with async_session_maker() as db:
+            result = await db.execute(text("SELECT generation FROM corpus_state WHERE id = 1"))
+            return result.scalar() or 0
+
+    generation = await _generation_cache.get_or_load("generation", load)
+    answer_cache.sync_generation(generation)
+    return generation
+
+
+async def bump_corpus_generation() -> int:
+    """片段变化并已提交后调用：递增语料版本"""
+    async with async_session_maker() as db:
+        result = await db.execute(
+            text(
+                """
+                UPDATE corpus_state
+                SET generation = generation + 1, updated_at = now()
+                WHERE id = 1
+                RETURNING generation
+                """
+            )
+        )
+        generation = result.scalar()
+        await db.commit()
+
+    _generation_cache.set("generation", generation)
+    answer_cache.sync_generation(generation)
+    return generation
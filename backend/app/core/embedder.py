@@ -0,0 +1,130 @@
+"""
+自适应并发批量 Embedding
+
+DashScopeEmbeddings.embed_documents 会按服务端批大小依次串行请求。这里把文本切成
+不超过服务端上限的批次，在并发上限内同时请求，并根据延迟和限流响应自适应调整：
+- 成功且延迟低于目标：并发 +1，批大小逐步恢复到上限（加性增）
+- 延迟过高：批大小减半
+- 被限流：并发和批大小减半，指数退避后重试该批（乘性减）
+结果按输入顺序返回。
+
+限流只按响应的 HTTP 状态码 429 判断，因此 embed_batch 不能在内部重试限流错误
+（DashScopeEmbeddings 需设置 max_retries=1）。
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+def is_throttled(error: Exception) -> bool:
+    """是否为限流错误（响应状态码为 429）"""
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+class AdaptiveBatchEmbedder:
+    """自适应并发批量 Embedding"""
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]],
+        max_batch_size: int,
+        min_batch_size: int,
+        max_concurrency: int,
+        target_latency: float,
+        max_retries: int,
+    ) -> None:
+        self.embed_batch = embed_batch
+        self.max_batch_size = max(max_batch_size, 1)
+        self.min_batch_size = max(min(min_batch_size, self.max_batch_size), 1)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+
+        # 自适应状态在多次调用间保留
+        self.batch_size = self.max_batch_size
+        self.concurrency = max(self.max_concurrency // 2, 1)
+
+        self.requests = 0
+        self.throttled = 0
+        self.total_latency = 0.0
+
+    def _on_success(self, latency: float) -> None:
+        self.requests += 1
+        self.total_latency += latency
+        if latency > self.target_latency:
+            self.batch_size = max(self.batch_size // 2, self.min_batch_size)
+        else:
+            self.concurrency = min(self.concurrency + 1, self.max_concurrency)
+            self.batch_size = min(self.batch_size + self.min_batch_size, self.max_batch_size)
+
+    def _on_throttle(self) -> None:
+        self.throttled += 1
+        self.concurrency = max(self.concurrency // 2, 1)
+        self.batch_size = max(self.batch_size // 2, self.min_batch_size)
+
+    async def _timed_call(self, texts: List[str]) -> Tuple[List[List[float]], float]:
+        started = time.perf_counter()
+        vectors = await self.embed_batch(texts)
+        return vectors, time.perf_counter() - started
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """批量生成向量，结果顺序与输入一致"""
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        retry_queue: Deque[Tuple[int, int, int]] = deque()  # (start, end, attempt)
+        in_flight: Dict[asyncio.Future, Tuple[int, int, int]] = {}
+        cursor = 0
+
+        try:
+            while cursor < len(texts) or retry_queue or in_flight:
+                # 在当前并发上限内发出请求，重试的批次优先
+                while len(in_flight) < self.concurrency and (retry_queue or cursor < len(texts)):
+                    if retry_queue:
+                        start, end, attempt = retry_queue.popleft()
+                    else:
+                        start, end, attempt = cursor, min(cursor + self.batch_size, len(texts)), 0
+                        cursor = end
+                    task = asyncio.ensure_future(self._timed_call(texts[start:end]))
+                    in_flight[task] = (start, end, attempt)
+
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+
+                backoff = 0.0
+                for task in done:
+                    start, end, attempt = in_flight.pop(task)
+                    try:
+                        vectors, latency = task.result()
+                    except Exception as e:
+                        if not is_throttled(e) or attempt >= self.max_retries:
+                            raise
+                        self._on_throttle()
+                        retry_queue.append((start, end, attempt + 1))
+                        backoff = max(backoff, min(0.5 * 2 ** attempt, 10.0))
+                        continue
+
+                    if len(vectors) != end - start:
+                        raise ValueError(f"Embedding 返回数量不符：期望 {end - start}，实际 {len(vectors)}")
+                    results[start:end] = vectors
+                    self._on_success(latency)
+
+                if backoff:
+                    logger.warning("触发限流，并发降为 %d，%.1fs 后重试", self.concurrency, backoff)
+                    await asyncio.sleep(backoff)
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+        return results  # type: ignore[return-value]
+
+    def stats(self) -> dict:
+        """当前自适应状态"""
+        return {
+            "batch_size": self.batch_size,
+            "concurrency": self.concurrency,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "avg_latency": self.total_latency / self.requests if self.requests else 0.0,
+        }
@@ -0,0 +1,97 @@
+"""
+片段向量持久化缓存
+
+以 (Embedding 模型, sha256(文本)) 为键保存在 embedding_cache 表中。重复上传、
+局部修改的文档和多个文件共有的段落只需调用一次 Embedding API。
+"""
+import hashlib
+from typing import Awaitable, Callable, Dict, List
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.cache import EmbeddingCacheEntry
+
+# 单条 IN 查询的最大键数量
+LOOKUP_BATCH_SIZE = 500
+
+
+def text_hash(text: str) -> str:
+    """文本 SHA-256"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """片段向量缓存"""
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+
+    async def get_many(self, db: AsyncSession, hashes: List[str]) -> Dict[str, List[float]]:
+        """批量读取缓存"""
+        found: Dict[str, List[float]] = {}
+        for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+            batch = hashes[start:start + LOOKUP_BATCH_SIZE]
+            result = await db.execute(
+                select(EmbeddingCacheEntry.text_hash, EmbeddingCacheEntry.embedding).where(
+                    EmbeddingCacheEntry.model == self.model,
+                    EmbeddingCacheEntry.text_hash.in_(batch),
+                )
+            )
+            for row in result:
+                found[row.text_hash] = list(map(float, row.embedding))
+        return found
+
+    async def put_many(self, db: AsyncSession, items: Dict[str, List[float]]) -> None:
+        """批量写入缓存（由调用方提交事务）"""
+        if not items:
+            return
+        stmt = insert(EmbeddingCacheEntry).values(
+            [
+                {"model": self.model, "text_hash": key, "embedding": embedding}
+                for key, embedding in items.items()
+            ]
+        )
+        await db.execute(stmt.on_conflict_do_nothing())
+
+    async def embed(
+        self,
+        db: AsyncSession,
+        texts: List[str],
+        embed_fn: Callable[[List[str]], Awaitable[List[List[float]]]],
+    ) -> List[List[float]]:
+        """只对未命中的文本调用 embed_fn，结果按输入顺序返回"""
+        hashes = [text_hash(t) for t in texts]
+        unique_hashes = list(dict.fromkeys(hashes))
+        cached = await self.get_many(db, unique_hashes)
+
+        # 未命中的文本去重后一次性请求
+        missing: Dict[str, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+
+        hits = sum(1 for h in hashes if h in cached)
+        self.hits += hits
+        self.misses += len(hashes) - hits
+
+        if missing:
+            new_embeddings = await embed_fn(list(missing.values()))
+            fresh = dict(zip(missing.keys(), new_embeddings))
+            await self.put_many(db, fresh)
+            cached.update(fresh)
+
+        return [cached[h] for h in hashes]
+
+    def stats(self) -> dict:
+        """命中统计"""
+        total = self.hits + self.misses
+        return {
+            "model": self.model,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,487 @@
+"""
+文档处理任务队列
+
+上传接口只负责保存文件并创建 IngestionJob，后台工作协程从数据库中领取任务并完成
+加载 → 分割 → 向量化 → 入库。工作协程默认运行在 API 进程内（INGESTION_WORKERS > 0），
+也可以设置 INGESTION_WORKERS=0 后单独启动：python -m app.core.ingestion
+
+租约：领取任务时写入 worker_id，处理期间由后台协程按 INGESTION_HEARTBEAT_INTERVAL 刷新心跳；
+心跳超过 INGESTION_JOB_TIMEOUT 的任务会被其他工作协程重新领取。任务和文档的每次更新都以
+worker_id 为条件，条件不成立（已被重新领取）时中止处理并回滚，不会有两个工作协程同时写入
+同一个文档的片段。
+失败重试：处理失败的任务放回队列，按 INGESTION_RETRY_BACKOFF 指数退避，达到
+INGESTION_MAX_ATTEMPTS 次后标记为失败。片段、段落和任务状态在同一个事务中提交，
+失败时不会留下部分片段；重建索引失败时检索继续使用上一版本的片段。
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.core import metrics
+from app.core.corpus import bump_corpus_generation
+from app.core.log import setup_logging
+from app.core.rag_service import rag_service
+from app.db.session import async_session_maker, engine
+from app.db.vector_index import ensure_vector_index
+from app.models.document import Document, IngestionJob
+
+logger = logging.getLogger(__name__)
+
+
+async def enqueue_document(
+    db: AsyncSession, document: Document, kind: str = "ingest"
+) -> IngestionJob:
+    """为文档创建处理任务（由调用方提交事务）"""
+    job = IngestionJob(document_id=document.id, kind=kind, status="pending", stage="queued")
+    db.add(job)
+    await db.flush()
+    return job
+
+
+class LeaseLost(Exception):
+    """任务已被其他工作协程重新领取"""
+
+
+@dataclass
+class JobLease:
+    """工作协程对任务的租约"""
+
+    job_id: int
+    document_id: int
+    worker_id: str
+    lost: bool = False
+    released: bool = False  # 已提交任务的最终状态，心跳不再更新
+
+
+async def _update_job(db: AsyncSession, lease: JobLease, assignments: str, **params) -> None:
+    """按租约更新任务（同时刷新心跳），租约失效时抛出 LeaseLost（由调用方提交事务）"""
+    result = await db.execute(
+        text(
+            f"""
+            UPDATE ingestion_jobs
+            SET heartbeat_at = now(), {assignments}
+            WHERE id = :job_id AND worker_id = :worker_id AND status = 'running'
+            """
+        ),
+        {"job_id": lease.job_id, "worker_id": lease.worker_id, **params},
+    )
+    if result.rowcount == 0:
+        lease.lost = True
+        raise LeaseLost(f"任务 {lease.job_id} 已被其他工作协程领取")
+
+
+async def _update_document(
+    db: AsyncSession, lease: JobLease, status: str, error_message: Optional[str] = None
+) -> None:
+    """按租约更新文档状态（在同一事务中先于 _update_job 调用）"""
+    result = await db.execute(
+        text(
+            """
+            UPDATE documents
+            SET status = :status, error_message = :error_message, updated_at = now()
+            WHERE id = :document_id
+              AND EXISTS (
+                  SELECT 1 FROM ingestion_jobs
+                  WHERE id = :job_id AND worker_id = :worker_id AND status = 'running'
+              )
+            """
+        ),
+        {
+            "status": status,
+            "error_message": error_message,
+            "document_id": lease.document_id,
+            "job_id": lease.job_id,
+            "worker_id": lease.worker_id,
+        },
+    )
+    if result.rowcount == 0:
+        lease.lost = True
+        raise LeaseLost(f"任务 {lease.job_id} 已被其他工作协程领取")
+
+
+class IngestionWorkerPool:
+    """文档处理工作协程池"""
+
+    def __init__(self, concurrency: int, poll_interval: float) -> None:
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._index_task: Optional[asyncio.Task] = None
+        self._index_checked_at = time.monotonic()
+
+    def start(self) -> None:
+        """启动工作协程"""
+        self._stopping = False
+        for i in range(self.concurrency):
+            worker_id = f"{self._worker_prefix}:{i}"
+            self._tasks.append(asyncio.create_task(self._run_worker(worker_id)))
+        logger.info("已启动 %d 个文档处理工作协程", self.concurrency)
+
+    async def stop(self) -> None:
+        """停止工作协程（未完成的任务会在心跳超时后被重新领取）"""
+        self._stopping = True
+        self._wakeup.set()
+        tasks = list(self._tasks)
+        if self._index_task is not None:
+            tasks.append(self._index_task)
+            self._index_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def notify(self) -> None:
+        """有新任务入队，唤醒空闲的工作协程"""
+        self._wakeup.set()
+
+    async def _run_worker(self, worker_id: str) -> None:
+        while not self._stopping:
+            try:
+                claimed = await self._claim_job(worker_id)
+            except Exception as e:
+                logger.warning("领取任务失败：%s", e)
+                claimed = None
+
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            job_id, document_id = claimed
+            lease = JobLease(job_id, document_id, worker_id)
+            work = asyncio.create_task(self._process(lease))
+            heartbeat = asyncio.create_task(self._keep_alive(lease, work))
+            try:
+                await work
+            except (LeaseLost, asyncio.CancelledError):
+                if not lease.lost or self._stopping:
+                    raise
+                logger.warning("任务 %d 已被其他工作协程领取，放弃本次处理", job_id)
+            except Exception:
+                # 数据库异常等：任务保持 running，心跳超时后会被重新领取
+                logger.exception("任务 %s 异常中断", job_id)
+            finally:
+                heartbeat.cancel()
+
+    async def _keep_alive(self, lease: JobLease, work: asyncio.Task) -> None:
+        """处理期间定期刷新心跳；任务已被其他工作协程领取时中止处理"""
+        while True:
+            await asyncio.sleep(settings.INGESTION_HEARTBEAT_INTERVAL)
+            try:
+                async with async_session_maker() as db:
+                    result = await db.execute(
+                        text(
+                            """
+                            UPDATE ingestion_jobs SET heartbeat_at = now()
+                            WHERE id = :job_id AND worker_id = :worker_id AND status = 'running'
+                            """
+                        ),
+                        {"job_id": lease.job_id, "worker_id": lease.worker_id},
+                    )
+                    await db.commit()
+            except Exception as e:
+                logger.warning("任务 %d 刷新心跳失败：%s", lease.job_id, e)
+                continue
+            if result.rowcount == 0 and not lease.released:
+                lease.lost = True
+                work.cancel()
+                return
+
+    def _schedule_index_check(self) -> None:
+        """数据量变化后检查 IVFFlat 索引（未建或 lists 不再合适时在后台构建）"""
+        if settings.VECTOR_INDEX_TYPE.lower() != "ivfflat":
+            return
+        if self._index_task is not None and not self._index_task.done():
+            return
+        now = time.monotonic()
+        if now - self._index_checked_at < settings.IVFFLAT_CHECK_INTERVAL:
+            return
+        self._index_checked_at = now
+        self._index_task = asyncio.create_task(self._check_index())
+
+    async def _check_index(self) -> None:
+        try:
+            await ensure_vector_index(engine)
+        except Exception:
+            logger.exception("向量索引维护失败")
+
+    async def _claim_job(self, worker_id: str) -> Optional[Tuple[int, int]]:
+        """领取一个待处理（或心跳超时）的任务"""
+        async with async_session_maker() as db:
+            # 多次重试仍超时的任务直接标记失败
+            await db.execute(
+                text(
+                    """
+                    WITH expired AS (
+                        UPDATE ingestion_jobs
+                        SET status = 'failed', finished_at = now(),
+                            error_message = '任务多次超时，已放弃'
+                        WHERE status = 'running'
+                          AND heartbeat_at < now() - make_interval(secs => :timeout)
+                          AND attempts >= :max_attempts
+                        RETURNING document_id
+                    )
+                    UPDATE documents
+                    SET status = 'failed', error_message = '处理多次超时，已放弃', updated_at = now()
+                    WHERE id IN (SELECT document_id FROM expired)
+                    """
+                ),
+                {
+                    "timeout": settings.INGESTION_JOB_TIMEOUT,
+                    "max_attempts": settings.INGESTION_MAX_ATTEMPTS,
+                },
+            )
+
+            result = await db.execute(
+                text(
+                    """
+                    UPDATE ingestion_jobs
+                    SET status = 'running', stage = 'loading',
+                        attempts = attempts + 1, worker_id = :worker_id,
+                        started_at = now(), heartbeat_at = now(),
+                        processed_chunks = 0, next_attempt_at = NULL
+                    WHERE id = (
+                        SELECT id FROM ingestion_jobs
+                        WHERE (status = 'pending'
+                               AND (next_attempt_at IS NULL OR next_attempt_at <= now()))
+                           OR (status = 'running'
+                               AND heartbeat_at < now() - make_interval(secs => :timeout))
+                        ORDER BY id
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, document_id
+                    """
+                ),
+                {"worker_id": worker_id, "timeout": settings.INGESTION_JOB_TIMEOUT},
+            )
+            row = result.first()
+            await db.commit()
+
+        if row is None:
+            return None
+        return row.id, row.document_id
+
+    async def _set_stage(self, db: AsyncSession, lease: JobLease, stage: str) -> None:
+        """更新任务阶段和文档状态（同时刷新心跳）"""
+        await _update_document(db, lease, stage)
+        await _update_job(db, lease, "stage = :stage", stage=stage)
+        await db.commit()
+
+    async def _process(self, lease: JobLease) -> None:
+        """处理单个任务：加载 → 分割 → 向量化 → 入库"""
+        async with async_session_maker() as db:
+            job = await db.get(IngestionJob, lease.job_id)
+            document = await db.get(Document, lease.document_id)
+            if job is None or document is None:
+                # 文档在处理前被删除
+                return
+            # 回滚会使已加载的对象过期，失败处理中用到的字段先取出
+            kind, attempts = job.kind, job.attempts
+
+            try:
+                await self._set_stage(db, lease, "loading")
+                started = time.perf_counter()
+                documents = await asyncio.to_thread(
+                    rag_service.load_document, document.file_path, document.file_type
+                )
+                _observe_stage(metrics.INGESTION_STAGE_LOAD, started)
+
+                await self._set_stage(db, lease, "splitting")
+                started = time.perf_counter()
+                if settings.PARENT_SECTIONS_ENABLED:
+                    sections, chunks = await asyncio.to_thread(rag_service.split_sections, documents)
+                else:
+                    sections = []
+                    chunks = await asyncio.to_thread(rag_service.split_documents, documents)
+                chunk_texts = [chunk.page_content for chunk in chunks]
+
+                # 与已入库片段对比：新文档全部是新增，重建索引时只处理变化的部分
+                plan = await rag_service.plan_chunk_sync(db, document.id, chunk_texts)
+                await _update_job(
+                    db,
+                    lease,
+                    "total_chunks = :total, processed_chunks = :processed",
+                    total=len(chunk_texts),
+                    processed=plan.reused,
+                )
+                _observe_stage(metrics.INGESTION_STAGE_SPLIT, started)
+
+                await self._set_stage(db, lease, "embedding")
+                started = time.perf_counter()
+                new_texts = [chunk_texts[i] for i in plan.new_indexes]
+                embeddings: List[List[float]] = []
+                batch_size = settings.INGESTION_EMBED_BATCH_SIZE
+                for start in range(0, len(new_texts), batch_size):
+                    batch = new_texts[start:start + batch_size]
+                    embeddings.extend(await rag_service.aembed_documents(db, batch))
+                    await _update_job(
+                        db,
+                        lease,
+                        "processed_chunks = :processed",
+                        processed=plan.reused + len(embeddings),
+                    )
+                    await db.commit()
+                _observe_stage(metrics.INGESTION_STAGE_EMBED, started)
+
+                await self._set_stage(db, lease, "storing")
+                started = time.perf_counter()
+                await rag_service.apply_chunk_sync(
+                    db, document.id, plan, chunk_texts, embeddings, owner_id=document.owner_id
+                )
+                await rag_service.store_sections(
+                    db,
+                    document.id,
+                    sections,
+                    [chunk.metadata.get("section_index", 0) for chunk in chunks],
+                )
+                _observe_stage(metrics.INGESTION_STAGE_STORE, started)
+
+                # 片段、段落和任务状态一起提交：重建索引时检索结果从旧片段集合整体切换到新集合；
+                # 租约已失效时在这里抛出 LeaseLost，整个事务回滚
+                await _update_document(db, lease, "completed")
+                await _update_job(
+                    db, lease, "status = 'completed', stage = 'completed', finished_at = now()"
+                )
+                lease.released = True
+                await db.commit()
+                await rag_service.vector_store.delete(plan.delete_ids)
+                await bump_corpus_generation()
+                metrics.INGESTION_JOBS_COMPLETED.inc()
+                metrics.INGESTION_CHUNKS_NEW.inc(len(plan.new_indexes))
+                metrics.INGESTION_CHUNKS_REUSED.inc(plan.reused)
+                metrics.INGESTION_CHUNKS_DELETED.inc(len(plan.delete_ids))
+                logger.info(
+                    "文档 %d 处理完成，共 %d 个片段（新增 %d，复用 %d，删除 %d）",
+                    document.id,
+                    len(chunk_texts),
+                    len(plan.new_indexes),
+                    plan.reused,
+                    len(plan.delete_ids),
+                )
+                self._schedule_index_check()
+
+            except LeaseLost:
+                raise
+            except Exception as e:
+                await db.rollback()
+                await self._release_failed(db, lease, kind, attempts, e)
+
+    async def _release_failed(
+        self, db: AsyncSession, lease: JobLease, kind: str, attempts: int, error: Exception
+    ) -> None:
+        """处理失败：未达到 INGESTION_MAX_ATTEMPTS 时放回队列等待重试，否则标记为失败
+
+        失败的事务已回滚，数据库中没有本次写入的片段，不需要清理。
+        """
+        message = str(error)
+        if attempts < settings.INGESTION_MAX_ATTEMPTS:
+            delay = settings.INGESTION_RETRY_BACKOFF * 2 ** (attempts - 1)
+            logger.warning(
+                "文档 %d 第 %d 次处理失败，%.0f 秒后重试",
+                lease.document_id,
+                attempts,
+                delay,
+                exc_info=error,
+            )
+            await _update_document(db, lease, "pending", message)
+            await _update_job(
+                db,
+                lease,
+                "status = 'pending', stage = 'queued', worker_id = NULL, error_message = :error, "
+                "next_attempt_at = now() + make_interval(secs => :delay)",
+                error=message,
+                delay=delay,
+            )
+            lease.released = True
+            await db.commit()
+            metrics.INGESTION_JOBS_RETRIED.inc()
+            return
+
+        logger.error("文档 %d 处理失败（已尝试 %d 次）", lease.document_id, attempts, exc_info=error)
+        if kind == "reindex":
+            # 重建索引的写入已回滚，检索继续使用上一版本的片段
+            message = f"重新索引失败，仍使用上一版本的索引：{message}"
+        await _update_document(db, lease, "failed", message)
+        await _update_job(
+            db,
+            lease,
+            "status = 'failed', error_message = :error, finished_at = now()",
+            error=message,
+        )
+        lease.released = True
+        await db.commit()
+        metrics.INGESTION_JOBS_FAILED.inc()
+
+
+def _observe_stage(histogram, started: float) -> None:
+    """记录处理阶段耗时（histogram 为 metrics.INGESTION_STAGE_* 子指标）"""
+    histogram.observe(time.perf_counter() - started)
+
+
+def job_metrics(job: IngestionJob) -> Tuple[float, Optional[float], Optional[float]]:
+    """计算任务进度、耗时（秒）和吞吐量（片段/秒）"""
+    if job.status == "completed":
+        progress = 1.0
+    elif job.total_chunks:
+        progress = job.processed_chunks / job.total_chunks
+    else:
+        progress = 0.0
+
+    if job.started_at is None:
+        return progress, None, None
+
+    end = job.finished_at or datetime.now(timezone.utc)
+    elapsed = max((end - job.started_at).total_seconds(), 0.0)
+    throughput = job.processed_chunks / elapsed if elapsed > 0 else None
+    return progress, elapsed, throughput
+
+
+# 单例
+ingestion_pool = IngestionWorkerPool(
+    concurrency=settings.INGESTION_WORKERS,
+    poll_interval=settings.INGESTION_POLL_INTERVAL,
+)
+
+
+async def main() -> None:
+    """独立进程运行文档处理工作协程"""
+    pool = IngestionWorkerPool(
+        concurrency=max(settings.INGESTION_WORKERS, 1),
+        poll_interval=settings.INGESTION_POLL_INTERVAL,
+    )
+    server = None
+    if settings.INGESTION_METRICS_PORT:
+        server = await metrics.start_http_server(settings.INGESTION_METRICS_PORT)
+        logger.info("指标已在端口 %d 的 /metrics 提供", settings.INGESTION_METRICS_PORT)
+    pool.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await pool.stop()
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("文档处理进程退出")
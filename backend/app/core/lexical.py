@@ -0,0 +1,108 @@
+"""
+关键词检索分词
+
+PostgreSQL 自带的全文检索配置不会切分中文，这里在 Python 中完成分词：
+- 中日韩文字：相邻两字组成二元词（单字成段时保留单字）
+- 字母数字：小写后整体保留（如产品编号 ab-0003、错误码 e1001），含连字符等时再拆出各部分
+分词结果以 tsvector 文本格式（'词':位置）写入 document_chunks.lexical_terms，
+数据库中由生成列直接转换为 tsvector，不再经过数据库端的分词器。
+
+查询端只保留有区分度的词：去掉虚词组成的二元词，中文连续两个二元词以短语（<->，即原文中
+连续三个字）匹配。单个常见二元词几乎出现在所有片段中，OR 连接会让检索对整张表打分。
+"""
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+_CJK = "぀-ヿ㐀-䶿一-鿿豈-﫿가-힯"
+_TOKEN_RE = re.compile(rf"([{_CJK}]+)|((?:(?![{_CJK}])[^\W_])+(?:[-_.](?:(?![{_CJK}])[^\W_])+)*)")
+_SPLIT_RE = re.compile(r"[-_.]")
+
+# 过长的字母数字串（哈希、Base64 等）没有检索价值
+MAX_TOKEN_LENGTH = 64
+# 查询最多使用的词数
+MAX_QUERY_TERMS = 64
+
+# 虚词 / 疑问词 / 代词用字（很少出现在实词中）：含有这些字的二元词（什么、如何、是否、我们，
+# 以及跨词的“成是”“何退”等）不参与检索
+_STOP_CHARS = set("的了吗呢吧啊么呀嘛什怎哪谁何这那们请是在和与或及被把给我你他她它也就而些否")
+_STOP_WORDS = {
+    "a", "an", "and", "are", "be", "can", "do", "does", "for", "how", "in", "is", "it", "of",
+    "on", "or", "that", "the", "this", "to", "what", "when", "where", "which", "who", "why",
+    "with",
+}
+
+
+def tokenize(content: str) -> List[str]:
+    """分词，按出现顺序返回（可重复）"""
+    terms: List[str] = []
+    normalized = unicodedata.normalize("NFKC", content).lower()
+    for match in _TOKEN_RE.finditer(normalized):
+        cjk, word = match.groups()
+        if cjk:
+            if len(cjk) == 1:
+                terms.append(cjk)
+            else:
+                terms.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        elif len(word) <= MAX_TOKEN_LENGTH:
+            terms.append(word)
+            parts = [p for p in _SPLIT_RE.split(word) if p]
+            if len(parts) > 1:
+                terms.extend(parts)
+    return terms
+
+
+def _quote(term: str) -> str:
+    return "'" + term.replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def to_tsvector_text(content: str) -> str:
+    """生成 tsvector 文本格式：'词':位置1,位置2 ..."""
+    positions: Dict[str, List[int]] = defaultdict(list)
+    for position, term in enumerate(tokenize(content), start=1):
+        positions[term].append(position)
+    return " ".join(
+        f"{_quote(term)}:{','.join(map(str, pos))}" for term, pos in positions.items()
+    )
+
+
+def _cjk_units(segment: str) -> List[str]:
+    """中文片段的查询单元：相邻的两个有效二元词组成短语，孤立的有效二元词单独使用"""
+    bigrams: List[Optional[str]] = [
+        None if _STOP_CHARS.intersection(segment[i:i + 2]) else segment[i:i + 2]
+        for i in range(len(segment) - 1)
+    ]
+    units = []
+    for i, term in enumerate(bigrams):
+        if term is None:
+            continue
+        following = bigrams[i + 1] if i + 1 < len(bigrams) else None
+        previous = bigrams[i - 1] if i > 0 else None
+        if following is not None:
+            units.append(f"{_quote(term)} <-> {_quote(following)}")
+        elif previous is None:
+            units.append(_quote(term))
+    return units
+
+
+def to_tsquery_text(query: str) -> str:
+    """生成 tsquery 文本格式（各查询单元 OR 连接），没有可检索的词时返回空字符串"""
+    units: List[str] = []
+    # 单个汉字 / 数字区分度很低，只在没有其他查询单元时使用
+    singles: List[str] = []
+    normalized = unicodedata.normalize("NFKC", query).lower()
+    for match in _TOKEN_RE.finditer(normalized):
+        cjk, word = match.groups()
+        if cjk:
+            if len(cjk) > 1:
+                units.extend(_cjk_units(cjk))
+            elif cjk not in _STOP_CHARS:
+                singles.append(_quote(cjk))
+        elif len(word) <= MAX_TOKEN_LENGTH and word not in _STOP_WORDS:
+            if len(word) > 1:
+                units.append(_quote(word))
+            elif word.isdigit():
+                singles.append(_quote(word))
+    units = list(dict.fromkeys(units or singles))[:MAX_QUERY_TERMS]
+    return " | ".join(f"({unit})" if " " in unit else unit for unit in units)
@@ -0,0 +1,200 @@
+"""
+日志
+
+替代 print 输出：
+- 分级：请求路径上的明细日志为 DEBUG 级别，默认不输出，关闭时只有一次级别判断的开销
+- 结构化：LOG_FORMAT=json 时每条日志输出一行 JSON，extra 中的字段原样写出
+- 请求 ID：RequestContextMiddleware 从 X-Request-ID 取得或生成，存于 contextvar，
+  同一请求（包括流式响应和后台任务）的日志都带上，并在响应头中返回
+- 采样：检索结果明细等详细日志按请求以 LOG_SAMPLE_RATE 采样，同一请求要么全部输出要么全部不输出
+- 非阻塞：记录日志只把 LogRecord 放入有界队列，由后台线程格式化并写出；队列满时丢弃并计数，
+  不会阻塞事件循环
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.config import settings
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+_sampled_var: ContextVar[Optional[bool]] = ContextVar("log_sampled", default=None)
+
+_REQUEST_ID_PATTERN = re.compile(r"^[\w.\-]{1,64}$")
+# LogRecord 自带的属性，其余属性视为 extra 字段
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["NonBlockingQueueHandler"] = None
+
+
+def sampled() -> bool:
+    """当前请求是否输出详细日志（请求之外每次单独采样）"""
+    decision = _sampled_var.get()
+    if decision is None:
+        return random.random() < settings.LOG_SAMPLE_RATE
+    return decision
+
+
+def verbose(logger: logging.Logger) -> bool:
+    """是否输出详细日志：DEBUG 已开启且当前请求被采样"""
+    return logger.isEnabledFor(logging.DEBUG) and sampled()
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {
+        key: value
+        for key, value in vars(record).items()
+        if key not in _RECORD_ATTRIBUTES and not key.startswith("_")
+    }
+
+
+class RequestContextFilter(logging.Filter):
+    """为日志记录加上当前请求 ID（在记录日志的协程中执行）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """放入有界队列，队列满时丢弃"""
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 只合并消息参数、展开异常，格式化和序列化在写出线程中完成
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+            **_extra_fields(record),
+        }
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """可读格式，extra 字段以 key=value 附在消息后"""
+
+    def __init__(self) -> None:
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "request_id"):
+            record.request_id = "-"
+        text = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+def setup_logging() -> None:
+    """配置根日志：队列 + 后台写出线程（重复调用无效果）"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(
+        JsonFormatter() if settings.LOG_FORMAT.lower() == "json" else TextFormatter()
+    )
+    log_queue: queue.Queue = queue.Queue(settings.LOG_QUEUE_SIZE)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(settings.LOG_LEVEL.upper())
+
+    # SQL 日志经由同一个队列输出（不使用 create_engine(echo=True)，它会另加一个同步的 stdout handler）
+    log_sql = settings.LOG_SQL
+    if log_sql is None:
+        log_sql = settings.ENVIRONMENT == "development"
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO if log_sql else logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """写出队列中剩余的日志并停止后台线程"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_records() -> int:
+    """队列满被丢弃的日志条数"""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+class RequestContextMiddleware:
+    """为每个 HTTP 请求设置请求 ID 和采样决定（ASGI 中间件，不缓冲响应）"""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = ""
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        if not _REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        header = (b"x-request-id", request_id.encode())
+
+        async def send_with_request_id(message) -> None:
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), header]}
+            await send(message)
+
+        request_token = request_id_var.set(request_id)
+        sampled_token = _sampled_var.set(random.random() < settings.LOG_SAMPLE_RATE)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(request_token)
+            _sampled_var.reset(sampled_token)
@@ -0,0 +1,267 @@
+"""
+Prometheus 指标
+
+/metrics 以 Prometheus 文本格式（0.0.4）输出当前进程的指标，不依赖 prometheus_client：
+- Counter / Histogram 只在事件循环线程中更新，一次更新是几次整数 / 浮点加法和一次二分查找，
+  不加锁、不分配对象；标签值固定的子指标在模块加载时绑定为常量（如 SEARCH_SECONDS_VECTOR），
+  请求路径上直接使用，不经过 labels() 查找
+- 缓存命中、生成准入等已有统计由 CallbackMetric 在抓取时读取，请求路径上没有额外开销
+多进程部署时每个进程各自暴露指标，由 Prometheus 按实例聚合：API 进程通过 /metrics，
+独立运行的文档处理进程（python -m app.core.ingestion）在 INGESTION_METRICS_PORT 上由
+start_http_server 提供 /metrics。
+"""
+import asyncio
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 请求阶段耗时的桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 文档处理阶段耗时的桶（秒）
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+# 生成速度的桶（token/秒）
+RATE_BUCKETS = (1.0, 5.0, 10.0, 20.0, 30.0, 50.0, 75.0, 100.0, 150.0, 200.0)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    text = ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs)
+    return "{" + text + "}" if text else ""
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        _registry.append(self)
+
+    def samples(self) -> Iterable[Tuple[str, Sequence[Tuple[str, str]], float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class _LabelledMetric(_Metric):
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation)
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """按标签值取子指标（值的顺序与 labelnames 一致）"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _labelled_children(self):
+        for values, child in list(self._children.items()):
+            yield tuple(zip(self.labelnames, values)), child
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(_LabelledMetric):
+    """只增计数"""
+
+    type = "counter"
+
+    def _new_child(self) -> _CounterValue:
+        return _CounterValue()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.value += amount
+
+    def samples(self):
+        for labels, child in self._labelled_children():
+            yield f"{self.name}_total", labels, child.value
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_LabelledMetric):
+    """分桶统计（桶上界包含边界值）"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def samples(self):
+        for labels, child in self._labelled_children():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), child.counts):
+                cumulative += count
+                yield f"{self.name}_bucket", (*labels, ("le", _format_value(bound))), cumulative
+            yield f"{self.name}_sum", labels, child.sum
+            yield f"{self.name}_count", labels, cumulative
+
+
+class CallbackMetric(_Metric):
+    """抓取时调用 callback 读取数值，callback 返回 [(标签字典, 数值)]"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        type: str,
+        callback: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+    ) -> None:
+        super().__init__(name, documentation)
+        self.type = type
+        self.callback = callback
+
+    def samples(self):
+        name = f"{self.name}_total" if self.type == "counter" else self.name
+        for labels, value in self.callback():
+            yield name, tuple(labels.items()), value
+
+
+def render() -> str:
+    """全部指标的 Prometheus 文本格式"""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # 读完请求头
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if line in (b"\r\n", b"\n", b""):
+                break
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+            status, content_type, body = "200 OK", CONTENT_TYPE, render().encode()
+        else:
+            status, content_type, body = "404 Not Found", "text/plain", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_http_server(port: int, host: str = "0.0.0.0") -> asyncio.AbstractServer:
+    """在没有 FastAPI 应用的进程中提供 GET /metrics（由调用方关闭返回的 server）"""
+    return await asyncio.start_server(_handle_scrape, host, port)
+
+
+# 检索与生成
+EMBED_QUERY_SECONDS = Histogram("rag_embed_query_seconds", "查询向量生成耗时（含缓存命中）")
+SEARCH_SECONDS = Histogram("rag_search_seconds", "检索耗时（不含查询向量生成）", ["mode"])
+SEARCH_SECONDS_VECTOR = SEARCH_SECONDS.labels("vector")
+SEARCH_SECONDS_LEXICAL = SEARCH_SECONDS.labels("lexical")
+PROMPT_BUILD_SECONDS = Histogram("rag_prompt_build_seconds", "Prompt 构建耗时（过滤、打包上下文）")
+FIRST_TOKEN_SECONDS = Histogram("rag_generation_first_token_seconds", "调用 LLM 到收到第一个分片的耗时")
+GENERATION_SECONDS = Histogram("rag_generation_seconds", "LLM 生成总耗时", ["mode"])
+GENERATION_SECONDS_STREAM = GENERATION_SECONDS.labels("stream")
+GENERATION_SECONDS_INVOKE = GENERATION_SECONDS.labels("invoke")
+GENERATION_TOKENS_PER_SECOND = Histogram(
+    "rag_generation_tokens_per_second", "生成速度（回答 token 数 / 生成总耗时）", buckets=RATE_BUCKETS
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "rag_llm_queue_wait_seconds", "获准生成前排队等待的时间（无需排队为 0）"
+)
+GENERATION_ERRORS = Counter("rag_generation_errors", "LLM 生成失败次数", ["mode"])
+GENERATION_ERRORS_STREAM = GENERATION_ERRORS.labels("stream")
+GENERATION_ERRORS_INVOKE = GENERATION_ERRORS.labels("invoke")
+
+# 对话接口
+CHAT_REQUESTS = Counter("rag_chat_requests", "对话请求数", ["endpoint", "cached"])
+CHAT_REQUESTS_CHAT_CACHED = CHAT_REQUESTS.labels("chat", "true")
+CHAT_REQUESTS_CHAT_UNCACHED = CHAT_REQUESTS.labels("chat", "false")
+CHAT_REQUESTS_STREAM_CACHED = CHAT_REQUESTS.labels("stream", "true")
+CHAT_REQUESTS_STREAM_UNCACHED = CHAT_REQUESTS.labels("stream", "false")
+CHAT_ERRORS = Counter("rag_chat_errors", "对话请求失败次数", ["endpoint"])
+CHAT_ERRORS_CHAT = CHAT_ERRORS.labels("chat")
+CHAT_ERRORS_STREAM = CHAT_ERRORS.labels("stream")
+
+# 文档
+DOCUMENT_UPLOADS = Counter("rag_document_uploads", "文档上传 / 更新数", ["result"])
+DOCUMENT_UPLOADS_QUEUED = DOCUMENT_UPLOADS.labels("queued")
+DOCUMENT_UPLOADS_DUPLICATE = DOCUMENT_UPLOADS.labels("duplicate")
+DOCUMENT_UPLOADS_REINDEX = DOCUMENT_UPLOADS.labels("reindex")
+DOCUMENT_UPLOADS_UNCHANGED = DOCUMENT_UPLOADS.labels("unchanged")
+DOCUMENT_UPLOADS_ERROR = DOCUMENT_UPLOADS.labels("error")
+INGESTION_STAGE_SECONDS = Histogram(
+    "rag_ingestion_stage_seconds", "文档处理各阶段耗时", ["stage"], buckets=STAGE_BUCKETS
+)
+INGESTION_STAGE_LOAD = INGESTION_STAGE_SECONDS.labels("load")
+INGESTION_STAGE_SPLIT = INGESTION_STAGE_SECONDS.labels("split")
+INGESTION_STAGE_EMBED = INGESTION_STAGE_SECONDS.labels("embed")
+INGESTION_STAGE_STORE = INGESTION_STAGE_SECONDS.labels("store")
+INGESTION_JOBS = Counter("rag_ingestion_jobs", "文档处理任务数", ["status"])
+INGESTION_JOBS_COMPLETED = INGESTION_JOBS.labels("completed")
+INGESTION_JOBS_FAILED = INGESTION_JOBS.labels("failed")
+INGESTION_JOBS_RETRIED = INGESTION_JOBS.labels("retried")
+INGESTION_CHUNKS = Counter("rag_ingestion_chunks", "处理的片段数", ["kind"])
+INGESTION_CHUNKS_NEW = INGESTION_CHUNKS.labels("new")
+INGESTION_CHUNKS_REUSED = INGESTION_CHUNKS.labels("reused")
+INGESTION_CHUNKS_DELETED = INGESTION_CHUNKS.labels("deleted")
+INGESTION_CHUNKS_COPIED = INGESTION_CHUNKS.labels("copied")
@@ -0,0 +1,49 @@
+"""
+MMR（Maximal Marginal Relevance）多样性重排
+
+相邻片段有重叠、文档内容重复时，检索结果常出现多个几乎相同的片段。MMR 每次选出
+λ·相关度 − (1−λ)·与已选片段的最大相似度 最高的候选，兼顾相关性和多样性。
+相似度矩阵一次性用矩阵乘法算出，贪心选择只循环 k 次，每次都是向量运算。
+"""
+from typing import List, Sequence
+
+import numpy as np
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def mmr_select(
+    query_embedding: Sequence[float],
+    candidate_embeddings: Sequence[Sequence[float]],
+    k: int,
+    lambda_mult: float = 0.5,
+) -> List[int]:
+    """从候选中选出 k 个，返回按选中顺序排列的候选下标"""
+    n = len(candidate_embeddings)
+    k = min(k, n)
+    if k <= 0:
+        return []
+
+    candidates = _normalize(np.asarray(candidate_embeddings, dtype=np.float32))
+    query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+
+    relevance = candidates @ query  # (n,)
+    similarity = candidates @ candidates.T  # (n, n)
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+
+    for _ in range(k - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+
+    return selected
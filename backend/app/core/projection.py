@@ -0,0 +1,355 @@
+"""
+向量降维投影
+
+text-embedding-v2 的 1536 维向量中，语料的大部分方差集中在少数方向上。维护任务在
+document_chunks.embedding 的随机样本上拟合 PCA 投影，保存到 vector_projections，
+并为全部片段生成降维向量列和 HNSW 索引。启用 PROJECTION_ENABLED 后，检索先在降维
+索引上取 PROJECTION_RERANK_CANDIDATES 个候选，再用原始向量精确重排。
+
+运行：python -m app.core.projection [--dim 256] [--sample 20000]
+
+每次运行生成新版本的列（embedding_reduced_<id>），全部写完、建好索引并评估召回率后
+才切换为当前版本；旧版本的列在下次运行时删除，正在使用旧版本的进程不受影响。
+"""
+import argparse
+import asyncio
+import json
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.core.cache import TTLCache
+from app.core.log import setup_logging
+from app.db.session import async_session_maker, engine
+from app.models.projection import VectorProjection
+
+logger = logging.getLogger(__name__)
+
+# 回填降维向量时每批处理的片段数
+BACKFILL_BATCH_SIZE = 1000
+
+
+@dataclass
+class Projection:
+    """已加载的投影"""
+
+    id: int
+    dim: int
+    column: str
+    mean: np.ndarray  # (source_dim,)
+    components: np.ndarray  # (dim, source_dim)
+
+    @classmethod
+    def from_model(cls, model: VectorProjection) -> "Projection":
+        return cls(
+            id=model.id,
+            dim=model.dim,
+            column=model.column,
+            mean=np.frombuffer(model.mean, dtype=np.float32),
+            components=np.frombuffer(model.components, dtype=np.float32).reshape(
+                model.dim, model.source_dim
+            ),
+        )
+
+    def project(self, vectors) -> np.ndarray:
+        """投影到低维空间，支持单个向量或多个向量"""
+        return (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components.T
+
+
+_active_cache = TTLCache(maxsize=1, ttl=settings.PROJECTION_REFRESH_INTERVAL)
+
+
+async def active_projection() -> Optional[Projection]:
+    """当前生效的投影（进程内缓存，PROJECTION_REFRESH_INTERVAL 秒后重新加载）"""
+
+    async def load() -> Optional[Projection]:
+        async with async_session_maker() as db:
+            result = await db.execute(
+                select(VectorProjection).where(VectorProjection.is_active.is_(True))
+            )
+            model = result.scalars().first()
+        return Projection.from_model(model) if model else None
+
+    return await _active_cache.get_or_load("active", load)
+
+
+def fit_pca(samples: np.ndarray, dim: int):
+    """在样本上拟合 PCA，返回 (均值, 投影矩阵, 保留的方差占比)"""
+    mean = samples.mean(axis=0)
+    centered = samples - mean
+    # 对协方差矩阵做特征分解，比对 n × d 的样本矩阵做 SVD 更快
+    covariance = centered.T @ centered / max(len(samples) - 1, 1)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    order = np.argsort(eigenvalues)[::-1][:dim]
+    components = eigenvectors[:, order].T
+    explained = float(eigenvalues[order].sum() / eigenvalues.sum())
+    return mean.astype(np.float32), components.astype(np.float32), explained
+
+
+async def _backfill(db: AsyncSession, projection: Projection, only_missing: bool) -> int:
+    """按 id 顺序分批计算并写入降维向量"""
+    total = 0
+    last_id = 0
+    missing = f"AND {projection.column} IS NULL" if only_missing else ""
+    while True:
+        result = await db.execute(
+            text(
+                f"""
+                SELECT id, embedding FROM document_chunks
+                WHERE id > :last_id AND embedding IS NOT NULL {missing}
+                ORDER BY id
+                LIMIT :limit
+                """
+            ).columns(embedding=Vector(1536)),
+            {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE},
+        )
+        rows = result.fetchall()
+        if not rows:
+            # 结束查询打开的事务：CREATE INDEX CONCURRENTLY 会等待所有未结束的事务
+            await db.commit()
+            break
+
+        reduced = projection.project([row.embedding for row in rows])
+        await db.execute(
+            text(
+                f"""
+                UPDATE document_chunks AS c
+                SET {projection.column} = CAST(v.vec AS vector)
+                FROM unnest(CAST(:ids AS integer[]), CAST(:vecs AS text[])) AS v(id, vec)
+                WHERE c.id = v.id
+                """
+            ),
+            {
+                "ids": [row.id for row in rows],
+                "vecs": [json.dumps(vec) for vec in reduced.tolist()],
+            },
+        )
+        await db.commit()
+        total += len(rows)
+        last_id = rows[-1].id
+    return total
+
+
+async def _create_index(projection: Projection) -> str:
+    """在降维列上建 HNSW 索引（CONCURRENTLY，建索引期间不阻塞片段写入）"""
+    index_name = f"ix_document_chunks_{projection.column}_hnsw"
+    async with engine.connect() as conn:
+        # CREATE INDEX CONCURRENTLY 不能在事务块中执行
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            await conn.execute(
+                text(
+                    f"CREATE INDEX CONCURRENTLY {index_name} ON document_chunks "
+                    f"USING hnsw ({projection.column} vector_cosine_ops) "
+                    f"WITH (m = {int(settings.HNSW_M)}, ef_construction = {int(settings.HNSW_EF_CONSTRUCTION)})"
+                )
+            )
+        except Exception:
+            # 构建失败会留下无效索引
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+            raise
+    return index_name
+
+
+async def _index_size(db: AsyncSession, name: str) -> Optional[int]:
+    result = await db.execute(
+        text("SELECT pg_relation_size(oid) FROM pg_class WHERE relname = :name AND relkind = 'i'"),
+        {"name": name},
+    )
+    return result.scalar()
+
+
+async def evaluate_recall(
+    db: AsyncSession,
+    projection: Projection,
+    k: int,
+    queries: int,
+    candidates: int,
+) -> float:
+    """以随机片段为查询，对比两阶段检索与精确检索的 recall@k（排除查询片段自身）"""
+    result = await db.execute(
+        text(
+            """
+            SELECT id, embedding FROM document_chunks
+            WHERE embedding IS NOT NULL
+            ORDER BY random()
+            LIMIT :n
+            """
+        ).columns(embedding=Vector(1536)),
+        {"n": queries},
+    )
+    samples = result.fetchall()
+    if not samples:
+        return 0.0
+
+    recalls: List[float] = []
+    for sample in samples:
+        embedding = json.dumps(list(map(float, sample.embedding)))
+        reduced = json.dumps(projection.project(sample.embedding).tolist())
+
+        # 精确结果：禁用索引扫描，按原始向量全量排序
+        await db.execute(text("SELECT set_config('enable_indexscan', 'off', true)"))
+        exact = await db.execute(
+            text(
+                """
+                SELECT id FROM document_chunks
+                WHERE embedding IS NOT NULL AND id <> :id
+                ORDER BY embedding <=> CAST(:embedding AS vector)
+                LIMIT :k
+                """
+            ),
+            {"id": sample.id, "embedding": embedding, "k": k},
+        )
+        expected = {row.id for row in exact}
+        await db.commit()
+
+        await db.execute(
+            text("SELECT set_config('hnsw.ef_search', :value, true)"),
+            {"value": str(candidates)},
+        )
+        approx = await db.execute(
+            text(
+                f"""
+                SELECT id FROM (
+                    SELECT id, embedding FROM document_chunks
+                    WHERE {projection.column} IS NOT NULL AND id <> :id
+                    ORDER BY {projection.column} <=> CAST(:reduced AS vector)
+                    LIMIT :candidates
+                ) AS candidates
+                ORDER BY embedding <=> CAST(:embedding AS vector)
+                LIMIT :k
+                """
+            ),
+            {
+                "id": sample.id,
+                "reduced": reduced,
+                "embedding": embedding,
+                "candidates": candidates,
+                "k": k,
+            },
+        )
+        found = {row.id for row in approx}
+        await db.commit()
+
+        if expected:
+            recalls.append(len(found & expected) / len(expected))
+
+    return float(np.mean(recalls)) if recalls else 0.0
+
+
+async def _drop_inactive_columns(db: AsyncSession) -> None:
+    """删除非当前版本的降维列和投影记录"""
+    result = await db.execute(
+        select(VectorProjection).where(VectorProjection.is_active.is_(False))
+    )
+    # 每列单独提交，DROP COLUMN 的排他锁不跨多列持有
+    for model in result.scalars().all():
+        await db.execute(text(f"ALTER TABLE document_chunks DROP COLUMN IF EXISTS {model.column}"))
+        await db.delete(model)
+        await db.commit()
+
+
+async def build_projection(
+    dim: int,
+    sample_size: int,
+    recall_k: int = 10,
+    recall_queries: int = 100,
+) -> VectorProjection:
+    """拟合投影、生成降维列和索引、评估召回率并切换为当前版本"""
+    async with async_session_maker() as db:
+        await _drop_inactive_columns(db)
+
+        # 1. 采样并拟合
+        result = await db.execute(
+            text(
+                """
+                SELECT embedding FROM document_chunks
+                WHERE embedding IS NOT NULL
+                ORDER BY random()
+                LIMIT :n
+                """
+            ).columns(embedding=Vector(1536)),
+            {"n": sample_size},
+        )
+        samples = np.asarray([row.embedding for row in result], dtype=np.float32)
+        if len(samples) <= dim:
+            raise ValueError(f"样本数量（{len(samples)}）需大于目标维度（{dim}）")
+
+        mean, components, explained = fit_pca(samples, dim)
+        model = VectorProjection(
+            method="pca",
+            source_dim=samples.shape[1],
+            dim=dim,
+            sample_size=len(samples),
+            explained_variance=explained,
+            mean=mean.tobytes(),
+            components=components.tobytes(),
+            is_active=False,
+        )
+        db.add(model)
+        await db.commit()
+        projection = Projection.from_model(model)
+        logger.info(
+            "PCA %d → %d 维，样本 %d，保留方差 %.1f%%", samples.shape[1], dim, len(samples), explained * 100
+        )
+
+        # 2. 降维列、回填、索引
+        await db.execute(
+            text(f"ALTER TABLE document_chunks ADD COLUMN {projection.column} vector({dim})")
+        )
+        await db.commit()
+        total = await _backfill(db, projection, only_missing=False)
+        index_name = await _create_index(projection)
+        logger.info("已写入 %d 个片段的降维向量并建立索引 %s", total, index_name)
+
+        # 3. 评估召回率
+        candidates = settings.PROJECTION_RERANK_CANDIDATES
+        recall = await evaluate_recall(db, projection, recall_k, recall_queries, candidates)
+        model.recall = recall
+        model.recall_k = recall_k
+
+        full_size = await _index_size(db, "ix_document_chunks_embedding_hnsw") or await _index_size(
+            db, "ix_document_chunks_embedding_ivfflat"
+        )
+        reduced_size = await _index_size(db, index_name)
+        logger.info("两阶段检索 recall@%d = %.3f（候选 %d）", recall_k, recall, candidates)
+        if full_size and reduced_size:
+            logger.info(
+                "索引大小：原始 %.1f MB → 降维 %.1f MB",
+                full_size / 1024 / 1024,
+                reduced_size / 1024 / 1024,
+            )
+
+        # 4. 切换为当前版本
+        await db.execute(
+            text("UPDATE vector_projections SET is_active = (id = :id)"), {"id": model.id}
+        )
+        await db.commit()
+
+        # 5. 等其他进程刷新缓存后，补齐切换期间写入的片段
+        await asyncio.sleep(settings.PROJECTION_REFRESH_INTERVAL)
+        missed = await _backfill(db, projection, only_missing=True)
+        if missed:
+            logger.info("补齐切换期间新增的 %d 个片段", missed)
+
+        await db.refresh(model)
+        return model
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="拟合向量降维投影并生成降维索引")
+    parser.add_argument("--dim", type=int, default=settings.PROJECTION_DIM)
+    parser.add_argument("--sample", type=int, default=settings.PROJECTION_SAMPLE_SIZE)
+    args = parser.parse_args()
+    await build_projection(args.dim, args.sample)
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(main())
@@ -1,10 +1,20 @@
 import os
 import json
-from typing import List, Optional
+import asyncio
+import logging
+import time
+import unicodedata
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple
+import numpy as np
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
+from pgvector.sqlalchemy import Vector
 
 from langchain_community.embeddings import DashScopeEmbeddings
+from langchain_community.embeddings.dashscope import BATCH_SIZE as DASHSCOPE_BATCH_SIZE
 
 from langchain_community.chat_models import QianfanChatEndpoint
 from langchain_core.language_models.chat_models import BaseChatModel
@@ -22,9 +32,98 @@ from langchain_community.document_loaders import (
 from app import db
 from app.config import settings
 from app.models.document import DocumentChunk
+from app.db.vector_index import compact_storage
+from app.db.bulk import copy_rows, encode_int4, encode_json, encode_text, encode_vector
 from langchain_core.documents import Document
 
 from app.core import prompts
+from app.core.embedding_cache import EmbeddingCache, text_hash
+from app.core.cache import TTLCache
+from app.core import metrics
+from app.core.context_packer import overlap_length, pack_contexts, token_length
+from app.core.corpus import corpus_generation
+from app.core.embedder import AdaptiveBatchEmbedder
+from app.core.lexical import to_tsquery_text, to_tsvector_text
+from app.core.log import verbose
+from app.core.mmr import mmr_select
+from app.core.projection import active_projection
+from app.core.streaming import stream_in_thread
+from app.core.vector_store import SearchScope, chunk_hit, create_vector_store
+
+logger = logging.getLogger(__name__)
+
+# store_chunks 通过 COPY 写入的列
+CHUNK_COPY_COLUMNS = [
+    "document_id",
+    "owner_id",
+    "content",
+    "content_hash",
+    "embedding",
+    "chunk_index",
+    "chunk_metadata",
+    "lexical_terms",
+]
+
+
+@dataclass
+class ChunkSyncPlan:
+    """片段增量更新计划"""
+
+    new_indexes: List[int]  # 需要向量化并写入的新位置
+    moves: List[Tuple[int, int]]  # (已有片段 id, 新 chunk_index)
+    delete_ids: List[int]  # 已消失的片段
+    reused: int  # 复用的片段数量（含位置移动）
+
+
+def normalize_query(query: str) -> str:
+    """查询归一化：全角转半角、小写、合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", query).lower().split())
+
+
+def cosine_similarity(a, b) -> float:
+    """余弦相似度"""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    norm = float(np.linalg.norm(a) * np.linalg.norm(b))
+    return float(a @ b) / norm if norm else 0.0
+
+
+def reciprocal_rank_fusion(rankings: Dict[str, List[dict]], k: int) -> List[dict]:
+    """RRF 融合多路排序：score = Σ 1 / (k + rank)
+
+    rankings 为 {检索路名: 按相关度排好序的结果}，每条结果记录各路名次（如 vector_rank）。
+    """
+    fused: Dict[int, dict] = {}
+    for name, hits in rankings.items():
+        for rank, hit in enumerate(hits, start=1):
+            item = fused.setdefault(hit["id"], {**hit, "rrf_score": 0.0})
+            item[f"{name}_rank"] = rank
+            item["rrf_score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda item: item["rrf_score"], reverse=True)
+
+
+def merge_chunk_ranges(hits: List[dict], window: int) -> List[Tuple[int, int, int]]:
+    """每个结果扩展为 [chunk_index - window, chunk_index + window]，同一文档中重叠或相接的范围合并
+
+    返回 (document_id, 起始 chunk_index, 结束 chunk_index)，按文档和位置排序。
+    """
+    spans: Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+    for hit in hits:
+        index = hit["chunk_index"]
+        spans[hit["document_id"]].append((max(index - window, 0), index + window))
+
+    ranges: List[Tuple[int, int, int]] = []
+    for document_id in sorted(spans):
+        low, high = None, None
+        for start, end in sorted(spans[document_id]):
+            if high is not None and start <= high + 1:
+                high = max(high, end)
+                continue
+            if high is not None:
+                ranges.append((document_id, low, high))
+            low, high = start, end
+        ranges.append((document_id, low, high))
+    return ranges
 
 
 class RAGService:
@@ -32,9 +131,45 @@ class RAGService:
 
     def __init__(self) -> None:
         # 初始化Embeddings
+        # 客户端内部不重试：限流（429）直接抛出，由 AdaptiveBatchEmbedder 降低并发和批大小后重试
         self.embeddings = DashScopeEmbeddings(
             model=settings.QWEN_EMBEDDING_MODEL,
             dashscope_api_key=settings.DASHSCOPE_API_KEY,
+            max_retries=1,
+        )
+        # DashScope Embedding 客户端是同步的，放到有界线程池中执行，避免阻塞事件循环
+        self._embedding_executor = ThreadPoolExecutor(
+            max_workers=settings.EMBEDDING_MAX_CONCURRENCY,
+            thread_name_prefix="embedding",
+        )
+        self.batch_embedder = AdaptiveBatchEmbedder(
+            self.aembed_texts,
+            # 超过服务端单次上限的批次会被客户端拆成多次串行请求
+            max_batch_size=min(
+                settings.EMBEDDING_BATCH_SIZE,
+                DASHSCOPE_BATCH_SIZE.get(settings.QWEN_EMBEDDING_MODEL, 25),
+            ),
+            min_batch_size=settings.EMBEDDING_MIN_BATCH_SIZE,
+            max_concurrency=settings.EMBEDDING_BATCH_CONCURRENCY,
+            target_latency=settings.EMBEDDING_TARGET_LATENCY,
+            max_retries=settings.EMBEDDING_MAX_RETRIES,
+        )
+        self.embedding_cache = EmbeddingCache(settings.QWEN_EMBEDDING_MODEL)
+        self.query_embedding_cache = TTLCache(
+            maxsize=settings.QUERY_EMBEDDING_CACHE_SIZE,
+            ttl=settings.QUERY_EMBEDDING_CACHE_TTL,
+        )
+        # 检索结果缓存，键中包含语料版本，语料变化后旧结果不再命中
+        self.retrieval_cache = TTLCache(
+            maxsize=settings.RETRIEVAL_CACHE_SIZE,
+            ttl=settings.RETRIEVAL_CACHE_TTL,
+        )
+        self.vector_store = create_vector_store()
+
+        # LLM 流式生成同样是同步接口，单独的线程池限制同时生成的数量
+        self._llm_executor = ThreadPoolExecutor(
+            max_workers=settings.LLM_MAX_CONCURRENCY,
+            thread_name_prefix="llm",
         )
 
         # init LLM (QWen)
@@ -54,6 +189,18 @@ class RAGService:
             chunk_overlap=50,
             length_function=len,
         )
+        # 父级段落分割器：先按标题、空行切分；子片段由段落提供上下文，不再需要重叠
+        self.section_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=settings.SECTION_SIZE,
+            chunk_overlap=0,
+            length_function=len,
+            separators=["\n# ", "\n## ", "\n### ", "\n\n", "\n", "。", " ", ""],
+        )
+        self.child_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=300,
+            chunk_overlap=0,
+            length_function=len,
+        )
 
         # upload folder
         os.makedirs(settings.UPLOAD_FOLDER, exist_ok=True)
@@ -77,7 +224,19 @@ class RAGService:
     def split_documents(self, documents: List[Document]) -> List[Document]:
         """文档分割"""
         return self.text_splitter.split_documents(documents)
-        return self.text_splitter.split_documents(documents)
+
+    def split_sections(self, documents: List[Document]) -> Tuple[List[Document], List[Document]]:
+        """两级分割：父级段落（不跨页）和段落内的子片段
+
+        子片段的 metadata["section_index"] 为所属段落在 sections 中的下标。
+        """
+        sections = self.section_splitter.split_documents(documents)
+        chunks: List[Document] = []
+        for section_index, section in enumerate(sections):
+            for chunk in self.child_splitter.split_documents([section]):
+                chunk.metadata["section_index"] = section_index
+                chunks.append(chunk)
+        return sections, chunks
 
     def embed_texts(self, texts: List[str]) -> List[List[float]]:
         """生成向量"""
@@ -87,83 +246,686 @@ class RAGService:
         """生成查询向量"""
         return self.embeddings.embed_query(query)
 
+    async def aembed_texts(self, texts: List[str]) -> List[List[float]]:
+        """生成向量（异步，不阻塞事件循环）"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._embedding_executor, self.embed_texts, texts
+        )
+
+    async def aembed_documents(
+        self, db: AsyncSession, texts: List[str]
+    ) -> List[List[float]]:
+        """生成文档片段向量，优先使用持久化缓存，未命中的文本并发批量请求 API"""
+        if not settings.EMBEDDING_CACHE_ENABLED:
+            return await self.batch_embedder.embed(texts)
+        return await self.embedding_cache.embed(db, texts, self.batch_embedder.embed)
+
+    async def aembed_query(self, query: str) -> List[float]:
+        """生成查询向量（异步，不阻塞事件循环）
+
+        按 (Embedding 模型, 归一化查询) 缓存，重复的问题不再请求 API。
+        返回的列表为缓存共享对象，调用方不要修改。
+        """
+        normalized = normalize_query(query)
+        loop = asyncio.get_running_loop()
+
+        async def load() -> List[float]:
+            return await loop.run_in_executor(
+                self._embedding_executor, self.embed_query, normalized
+            )
+
+        key = (settings.QWEN_EMBEDDING_MODEL, normalized)
+        started = time.perf_counter()
+        try:
+            return await self.query_embedding_cache.get_or_load(key, load)
+        finally:
+            metrics.EMBED_QUERY_SECONDS.observe(time.perf_counter() - started)
+
+    def shutdown(self) -> None:
+        """释放线程池"""
+        self._embedding_executor.shutdown(wait=False, cancel_futures=True)
+        self._llm_executor.shutdown(wait=False, cancel_futures=True)
+
     async def store_chunks(
         self,
         db: AsyncSession,
         document_id: int,
         chunks: List[str],
         embeddings: List[List[float]],
+        chunk_indexes: Optional[List[int]] = None,
+        owner_id: Optional[int] = None,
     ):
-        """存储文档块到数据库"""
-        for i, (content, embedding) in enumerate(zip(chunks, embeddings)):
-            if isinstance(embedding, str):
-                embedding = json.loads(embedding)
+        """存储文档块到数据库（二进制 COPY 分批写入，由调用方提交事务）
+
+        向量单独存储时在提交前写入向量存储：检索只返回 document_chunks 中存在的片段，
+        事务回滚留下的向量在下次启动时清理。
+        """
+        if chunk_indexes is None:
+            chunk_indexes = list(range(len(chunks)))
 
-            embedding = [float(x) for x in embedding]
-            chunk = DocumentChunk(
-                document_id=document_id,
-                content=content,
-                embedding=embedding,  # 直接存储为向量
-                chunk_index=i,
-                chunk_metadata={"source": f"chunk_{i}"},
+        storage = compact_storage()
+        projection = await active_projection()
+        columns = CHUNK_COPY_COLUMNS + ([storage.column] if storage else [])
+        if projection is not None:
+            columns.append(projection.column)
+        # 向量单独存储时预先分配片段 id，写入向量存储时使用
+        stores_vectors = self.vector_store.stores_vectors
+        if stores_vectors:
+            columns = ["id"] + columns
+
+        batch_size = settings.CHUNK_INSERT_BATCH_SIZE
+        for start in range(0, len(chunks), batch_size):
+            batch_embeddings = [
+                self._as_vector(e) for e in embeddings[start:start + batch_size]
+            ]
+            reduced = projection.project(batch_embeddings).tolist() if projection else None
+            chunk_ids = (
+                await self._allocate_chunk_ids(db, len(batch_embeddings))
+                if stores_vectors
+                else None
+            )
+            rows = (
+                (
+                    *([encode_int4(chunk_ids[j])] if chunk_ids is not None else []),
+                    encode_int4(document_id),
+                    encode_int4(owner_id) if owner_id is not None else None,
+                    encode_text(content),
+                    encode_text(text_hash(content)),
+                    encode_vector(embedding),
+                    encode_int4(i),
+                    encode_json({"source": f"chunk_{i}"}),
+                    encode_text(to_tsvector_text(content)),
+                    *([storage.encode(embedding)] if storage else []),
+                    *([encode_vector(reduced[j])] if reduced is not None else []),
+                )
+                for j, (i, content, embedding) in enumerate(zip(
+                    chunk_indexes[start:start + batch_size],
+                    chunks[start:start + batch_size],
+                    batch_embeddings,
+                ))
+            )
+            await copy_rows(db, "document_chunks", columns, rows)
+            if chunk_ids is not None:
+                await self.vector_store.add(chunk_ids, document_id, owner_id, batch_embeddings)
+
+    @staticmethod
+    async def _allocate_chunk_ids(db: AsyncSession, n: int) -> List[int]:
+        """从 document_chunks 的 id 序列预取 n 个 id"""
+        result = await db.execute(
+            text(
+                "SELECT nextval(pg_get_serial_sequence('document_chunks', 'id')) "
+                "FROM generate_series(1, :n)"
+            ),
+            {"n": n},
+        )
+        return list(result.scalars().all())
+
+    async def plan_chunk_sync(
+        self,
+        db: AsyncSession,
+        document_id: int,
+        chunks: List[str],
+    ) -> ChunkSyncPlan:
+        """对比新分割的片段和已入库的片段（按内容哈希 + 位置），得到增量更新计划
+
+        后台回填完成前，已有片段的 content_hash 可能为空，此时按内容现算。
+        """
+        result = await db.execute(
+            text(
+                """
+                SELECT id, chunk_index, content_hash,
+                       CASE WHEN content_hash IS NULL THEN content END AS content
+                FROM document_chunks
+                WHERE document_id = :document_id
+                ORDER BY chunk_index, id
+                """
+            ),
+            {"document_id": document_id},
+        )
+        existing = result.fetchall()
+        existing_hashes = {
+            row.id: row.content_hash or text_hash(row.content) for row in existing
+        }
+        hashes = [text_hash(c) for c in chunks]
+
+        # 1. 内容和位置都没变的片段
+        exact = {(existing_hashes[row.id], row.chunk_index): row.id for row in existing}
+        matched: Dict[int, int] = {}  # 新位置 -> 已有片段 id
+        used = set()
+        for i, h in enumerate(hashes):
+            chunk_id = exact.get((h, i))
+            if chunk_id is not None and chunk_id not in used:
+                matched[i] = chunk_id
+                used.add(chunk_id)
+
+        # 2. 内容没变但位置移动的片段，按原顺序依次配对
+        movable: Dict[str, Deque[int]] = defaultdict(deque)
+        for row in existing:
+            if row.id not in used:
+                movable[existing_hashes[row.id]].append(row.id)
+        moves: List[Tuple[int, int]] = []
+        for i, h in enumerate(hashes):
+            if i not in matched and movable.get(h):
+                chunk_id = movable[h].popleft()
+                matched[i] = chunk_id
+                used.add(chunk_id)
+                moves.append((chunk_id, i))
+
+        return ChunkSyncPlan(
+            new_indexes=[i for i in range(len(chunks)) if i not in matched],
+            moves=moves,
+            delete_ids=[row.id for row in existing if row.id not in used],
+            reused=len(matched),
+        )
+
+    async def apply_chunk_sync(
+        self,
+        db: AsyncSession,
+        document_id: int,
+        plan: ChunkSyncPlan,
+        chunks: List[str],
+        new_embeddings: List[List[float]],
+        owner_id: Optional[int] = None,
+    ) -> None:
+        """执行增量更新：写入新片段、原地调整 chunk_index、删除消失的片段
+
+        全部在调用方的事务中执行，提交前检索看到的仍是旧的片段集合，失败回滚后旧索引不受影响。
+        提交后由调用方从向量存储中删除 plan.delete_ids。
+        """
+        if plan.new_indexes:
+            await self.store_chunks(
+                db,
+                document_id,
+                [chunks[i] for i in plan.new_indexes],
+                new_embeddings,
+                chunk_indexes=plan.new_indexes,
+                owner_id=owner_id,
+            )
+
+        if plan.moves:
+            await db.execute(
+                text(
+                    """
+                    UPDATE document_chunks AS c
+                    SET chunk_index = m.chunk_index,
+                        chunk_metadata = json_build_object('source', 'chunk_' || m.chunk_index)
+                    FROM unnest(CAST(:ids AS integer[]), CAST(:indexes AS integer[]))
+                        AS m(id, chunk_index)
+                    WHERE c.id = m.id
+                    """
+                ),
+                {
+                    "ids": [chunk_id for chunk_id, _ in plan.moves],
+                    "indexes": [index for _, index in plan.moves],
+                },
+            )
+
+        if plan.delete_ids:
+            await db.execute(
+                text("DELETE FROM document_chunks WHERE id = ANY(:ids)"),
+                {"ids": plan.delete_ids},
+            )
+
+    async def store_sections(
+        self,
+        db: AsyncSession,
+        document_id: int,
+        sections: List[Document],
+        chunk_section_indexes: List[int],
+    ) -> None:
+        """重建文档的父级段落，并按 chunk_index 关联片段（sections 为空时只删除旧段落；由调用方提交事务）"""
+        await db.execute(
+            text("DELETE FROM document_sections WHERE document_id = :document_id"),
+            {"document_id": document_id},
+        )
+        if sections:
+            await db.execute(
+                text(
+                    """
+                    INSERT INTO document_sections
+                        (document_id, section_index, content, section_metadata)
+                    SELECT :document_id, s.section_index, s.content, CAST(s.metadata AS json)
+                    FROM unnest(
+                        CAST(:indexes AS integer[]),
+                        CAST(:contents AS text[]),
+                        CAST(:metadata AS text[])
+                    ) AS s(section_index, content, metadata)
+                    """
+                ),
+                {
+                    "document_id": document_id,
+                    "indexes": list(range(len(sections))),
+                    "contents": [section.page_content for section in sections],
+                    "metadata": [
+                        json.dumps({"source": f"section_{i}", "page": section.metadata.get("page")})
+                        for i, section in enumerate(sections)
+                    ],
+                },
+            )
+            await db.execute(
+                text(
+                    """
+                    UPDATE document_chunks AS c
+                    SET section_id = s.id
+                    FROM unnest(CAST(:section_indexes AS integer[]))
+                        WITH ORDINALITY AS m(section_index, position)
+                    JOIN document_sections AS s
+                      ON s.document_id = :document_id AND s.section_index = m.section_index
+                    WHERE c.document_id = :document_id
+                      AND c.chunk_index = m.position - 1
+                    """
+                ),
+                {"document_id": document_id, "section_indexes": chunk_section_indexes},
             )
-            db.add(chunk)
 
-        await db.commit()
+    @staticmethod
+    def _as_vector(embedding) -> List[float]:
+        """兼容 JSON 字符串形式的向量"""
+        if isinstance(embedding, str):
+            embedding = json.loads(embedding)
+        return embedding
+
+    async def copy_chunks(
+        self,
+        db: AsyncSession,
+        source_document_id: int,
+        target_document_id: int,
+    ) -> int:
+        """复用已有文档的片段、向量和父级段落（内容完全相同的文件），返回复制的片段数"""
+        storage = compact_storage()
+        projection = await active_projection()
+        compact = f", {storage.column}" if storage else ""
+        if projection is not None:
+            compact += f", {projection.column}"
+        returning = "RETURNING id, owner_id, embedding" if self.vector_store.stores_vectors else ""
+        await db.execute(
+            text(
+                """
+                INSERT INTO document_sections
+                    (document_id, section_index, content, section_metadata)
+                SELECT :target_id, section_index, content, section_metadata
+                FROM document_sections
+                WHERE document_id = :source_id
+                """
+            ),
+            {"source_id": source_document_id, "target_id": target_document_id},
+        )
+        result = await db.execute(
+            text(
+                f"""
+                INSERT INTO document_chunks
+                    (document_id, owner_id, section_id, content, content_hash, embedding,
+                     chunk_index, chunk_metadata, lexical_terms{compact})
+                SELECT :target_id,
+                       (SELECT owner_id FROM documents WHERE id = :target_id),
+                       target.id,
+                       c.content, c.content_hash, c.embedding, c.chunk_index,
+                       c.chunk_metadata, c.lexical_terms{compact.replace(", ", ", c.")}
+                FROM document_chunks AS c
+                LEFT JOIN document_sections AS source ON source.id = c.section_id
+                LEFT JOIN document_sections AS target
+                  ON target.document_id = :target_id
+                 AND target.section_index = source.section_index
+                WHERE c.document_id = :source_id
+                ORDER BY c.chunk_index
+                {returning}
+                """
+            ).columns(embedding=Vector(1536)),
+            {"source_id": source_document_id, "target_id": target_document_id},
+        )
+        if not self.vector_store.stores_vectors:
+            return result.rowcount
+
+        # 检索时只返回 document_chunks 中存在的片段，事务回滚留下的向量在下次启动时清理
+        rows = result.fetchall()
+        await self.vector_store.add(
+            [row.id for row in rows],
+            target_document_id,
+            rows[0].owner_id if rows else None,
+            [row.embedding for row in rows],
+        )
+        return len(rows)
 
     async def search_similar(
         self,
         db: AsyncSession,
         query: str,
         top_k: int = 5,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        hybrid: Optional[bool] = None,
+        mmr: Optional[bool] = None,
+        mmr_lambda: Optional[float] = None,
+        mmr_candidates: Optional[int] = None,
+        owner_id: Optional[int] = None,
+        document_ids: Optional[List[int]] = None,
+        neighbours: Optional[int] = None,
+        parents: Optional[bool] = None,
     ) -> List[dict]:
-        """向量相似度搜索"""
-
-        # 生成查询向量
-        query_embedding = self.embed_query(query)
-
-        # 使用余弦相似度搜索
-        query_str = """
-                    SELECT 
-                        id, content, chunk_index, chunk_metadata,
-                        1 - (embedding <=> :embedding) as score
-                    FROM document_chunks
-                    WHERE embedding IS NOT NULL
-                    ORDER BY score DESC
-                    LIMIT :top_k
-                    """
+        """相似度搜索
 
-        # 将 query_embedding 转为 JSON 字符串
-        embedding_str = json.dumps(query_embedding)
-        result = await db.execute(
-            text(query_str), {"embedding": embedding_str, "top_k": top_k}
+        混合检索时关键词检索与查询向量生成同时进行，再执行向量检索，按 RRF 融合排序；启用 MMR 时先多取
+        mmr_candidates 个候选（连同向量），再从中选出 top_k 个互不重复的片段。
+        owner_id / document_ids 限定检索范围，在 SQL 中过滤。score 始终为余弦相似度。
+        neighbours > 0 时每个结果扩展前后各 neighbours 个片段，合并为连续段落；
+        parents 为真时改为返回结果所属的父级段落（同一段落只返回一次），优先于 neighbours。
+
+        结果按 (查询, 检索参数, 语料版本) 缓存，热点查询不再访问数据库和 Embedding API；
+        查询向量由 (Embedding 模型, 归一化查询) 唯一确定，直接以此作为键。
+        """
+        scope = SearchScope(owner_id=owner_id, document_ids=document_ids)
+        if hybrid is None:
+            hybrid = settings.HYBRID_SEARCH_ENABLED
+        if mmr is None:
+            mmr = settings.MMR_ENABLED
+        if mmr_lambda is None:
+            mmr_lambda = settings.MMR_LAMBDA
+        limit = max(top_k, mmr_candidates or settings.MMR_CANDIDATES) if mmr else top_k
+        tsquery = to_tsquery_text(query) if hybrid else ""
+        if parents is None:
+            parents = settings.PARENT_SECTIONS_ENABLED
+        if neighbours is None:
+            neighbours = settings.NEIGHBOUR_CHUNKS
+        if parents:
+            neighbours = 0
+
+        async def load() -> List[dict]:
+            hits = await self._search(
+                db, query, top_k, limit, tsquery, scope, ef_search, probes, mmr, mmr_lambda
+            )
+            if parents:
+                hits = await self.resolve_sections(db, hits)
+            elif neighbours > 0:
+                hits = await self.expand_neighbours(db, hits, neighbours)
+            return hits
+
+        if self.retrieval_cache.maxsize <= 0:
+            return await load()
+
+        key = (
+            settings.QWEN_EMBEDDING_MODEL,
+            normalize_query(query),
+            tsquery,
+            top_k,
+            limit,
+            ef_search,
+            probes,
+            mmr,
+            mmr_lambda if mmr else None,
+            owner_id,
+            tuple(sorted(document_ids)) if document_ids else None,
+            neighbours,
+            parents,
+            await corpus_generation(),
         )
+        hits = await self.retrieval_cache.get_or_load(key, load)
+        # 缓存的结果为共享对象，返回副本
+        return [dict(hit) for hit in hits]
 
-        rows = result.fetchall()
-        return [
+    async def _search(
+        self,
+        db: AsyncSession,
+        query: str,
+        top_k: int,
+        limit: int,
+        tsquery: str,
+        scope: SearchScope,
+        ef_search: Optional[int],
+        probes: Optional[int],
+        mmr: bool,
+        mmr_lambda: float,
+    ) -> List[dict]:
+        """执行检索（不经过缓存）"""
+        embedding_task = asyncio.ensure_future(self.aembed_query(query))
+        try:
+            if tsquery:
+                hits = await self._hybrid_search(
+                    db,
+                    embedding_task,
+                    tsquery,
+                    max(limit, settings.HYBRID_CANDIDATES),
+                    scope,
+                    ef_search,
+                    probes,
+                    with_embeddings=mmr,
+                )
+            else:
+                query_embedding = await embedding_task
+                started = time.perf_counter()
+                hits = await self.vector_store.search(
+                    db, query_embedding, limit, scope, ef_search, probes, with_embeddings=mmr
+                )
+                metrics.SEARCH_SECONDS_VECTOR.observe(time.perf_counter() - started)
+        finally:
+            if not embedding_task.done():
+                embedding_task.cancel()
+
+        hits = hits[:limit]
+        if mmr and len(hits) > top_k:
+            order = mmr_select(
+                embedding_task.result(),
+                [hit["embedding"] for hit in hits],
+                top_k,
+                mmr_lambda,
+            )
+            hits = [hits[i] for i in order]
+
+        hits = hits[:top_k]
+        for hit in hits:
+            hit.pop("embedding", None)
+        return hits
+
+    async def expand_neighbours(
+        self, db: AsyncSession, hits: List[dict], window: int
+    ) -> List[dict]:
+        """取出每个结果前后各 window 个片段（一次查询），相邻 / 重叠的结果合并为连续段落
+
+        段落的 score 为其中最相关片段的相似度，按 score 从高到低返回。
+        """
+        ranges = merge_chunk_ranges(hits, window)
+        if not ranges:
+            return hits
+
+        result = await db.execute(
+            text(
+                """
+                SELECT c.id, c.document_id, c.chunk_index, c.content
+                FROM unnest(
+                    CAST(:document_ids AS integer[]),
+                    CAST(:lows AS integer[]),
+                    CAST(:highs AS integer[])
+                ) AS r(document_id, low, high)
+                JOIN document_chunks AS c
+                  ON c.document_id = r.document_id
+                 AND c.chunk_index BETWEEN r.low AND r.high
+                ORDER BY c.document_id, c.chunk_index
+                """
+            ),
             {
-                "id": row.id,
-                "content": row.content,
-                "score": float(row.score),
-                "chunk_metadata": row.chunk_metadata,
-                "source": row.chunk_metadata.get("source")
-                if row.chunk_metadata
-                else None,
-            }
+                "document_ids": [document_id for document_id, _, _ in ranges],
+                "lows": [low for _, low, _ in ranges],
+                "highs": [high for _, _, high in ranges],
+            },
+        )
+
+        # 按文档内连续的 chunk_index 切分为段落
+        passages: List[List] = []
+        for row in result:
+            last = passages[-1][-1] if passages else None
+            if (
+                last is not None
+                and last.document_id == row.document_id
+                and last.chunk_index + 1 == row.chunk_index
+            ):
+                passages[-1].append(row)
+            else:
+                passages.append([row])
+
+        best_hits = {hit["id"]: hit for hit in hits}
+        merged: List[dict] = []
+        for rows in passages:
+            matched = [best_hits[row.id] for row in rows if row.id in best_hits]
+            if not matched:
+                continue
+            best = max(matched, key=lambda hit: hit["score"])
+            content = rows[0].content
+            for previous, row in zip(rows, rows[1:]):
+                content += row.content[overlap_length(previous.content, row.content):]
+            merged.append(
+                {
+                    **best,
+                    "content": content,
+                    "chunk_index": rows[0].chunk_index,
+                    "chunk_ids": [row.id for row in rows],
+                    "chunk_range": [rows[0].chunk_index, rows[-1].chunk_index],
+                }
+            )
+
+        # 范围内的片段在扩展前被删除时，保留原结果
+        covered = {chunk_id for passage in merged for chunk_id in passage["chunk_ids"]}
+        merged.extend(hit for hit in hits if hit["id"] not in covered)
+        merged.sort(key=lambda hit: hit["score"], reverse=True)
+        return merged
+
+    async def resolve_sections(self, db: AsyncSession, hits: List[dict]) -> List[dict]:
+        """把结果替换为其所属的父级段落（一次查询），同一段落的多个结果合并
+
+        段落的 score 为其中最相关片段的相似度，按 score 从高到低返回；没有段落的片段原样保留。
+        """
+        if not hits:
+            return hits
+
+        result = await db.execute(
+            text(
+                """
+                SELECT c.id AS chunk_id, s.id, s.section_index, s.content
+                FROM document_chunks AS c
+                JOIN document_sections AS s ON s.id = c.section_id
+                WHERE c.id = ANY(:chunk_ids)
+                """
+            ),
+            {"chunk_ids": [hit["id"] for hit in hits]},
+        )
+        sections = {row.chunk_id: row for row in result}
+
+        merged: Dict[int, dict] = {}
+        resolved: List[dict] = []
+        for hit in hits:
+            section = sections.get(hit["id"])
+            if section is None:
+                resolved.append(hit)
+                continue
+            passage = merged.get(section.id)
+            if passage is None:
+                passage = merged[section.id] = {
+                    **hit,
+                    "content": section.content,
+                    "chunk_index": None,
+                    "section_id": section.id,
+                    "section_index": section.section_index,
+                    "chunk_ids": [],
+                }
+                resolved.append(passage)
+            else:
+                passage["score"] = max(passage["score"], hit["score"])
+            passage["chunk_ids"].append(hit["id"])
+
+        resolved.sort(key=lambda hit: hit["score"], reverse=True)
+        return resolved
+
+    async def _hybrid_search(
+        self,
+        db: AsyncSession,
+        embedding_task: "asyncio.Future[List[float]]",
+        tsquery: str,
+        candidates: int,
+        scope: SearchScope,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        with_embeddings: bool = False,
+    ) -> List[dict]:
+        """关键词检索和向量检索各取 candidates 个候选，按 RRF 融合排序
+
+        两路检索在请求的会话上依次执行，不额外占用连接；关键词检索与查询向量生成同时进行。
+        """
+        started = time.perf_counter()
+        rows = await self._lexical_search(db, tsquery, candidates, scope)
+        metrics.SEARCH_SECONDS_LEXICAL.observe(time.perf_counter() - started)
+
+        query_embedding = await embedding_task
+        started = time.perf_counter()
+        vector_hits = await self.vector_store.search(
+            db, query_embedding, candidates, scope, ef_search, probes, with_embeddings
+        )
+        metrics.SEARCH_SECONDS_VECTOR.observe(time.perf_counter() - started)
+
+        lexical_hits = [
+            chunk_hit(
+                row,
+                cosine_similarity(query_embedding, row.embedding),
+                row.embedding if with_embeddings else None,
+            )
             for row in rows
         ]
+        return reciprocal_rank_fusion(
+            {"vector": vector_hits, "lexical": lexical_hits}, settings.RRF_K
+        )
+
+    async def _lexical_search(
+        self, db: AsyncSession, tsquery: str, limit: int, scope: SearchScope
+    ):
+        """关键词检索（GIN 索引），按 ts_rank 排序，同时取出向量用于计算相似度
+
+        最多对 LEXICAL_MAX_MATCHES 个匹配片段计算 ts_rank，查询词较宽泛时不会对大半张表打分；
+        只为排序后的结果读取内容和向量。
+        """
+        scope_sql, scope_params = scope.where()
+        statement = text(
+            f"""
+            WITH matched AS (
+                SELECT id, search_vector
+                FROM document_chunks
+                WHERE search_vector @@ CAST(:tsquery AS tsquery)
+                  AND embedding IS NOT NULL{scope_sql}
+                LIMIT :max_matches
+            ), ranked AS (
+                SELECT id, ts_rank(search_vector, CAST(:tsquery AS tsquery), 1) AS rank
+                FROM matched
+                ORDER BY rank DESC, id
+                LIMIT :limit
+            )
+            SELECT c.id, c.document_id, c.content, c.chunk_index, c.chunk_metadata, c.embedding
+            FROM ranked
+            JOIN document_chunks AS c ON c.id = ranked.id
+            ORDER BY ranked.rank DESC, c.id
+            """
+        ).columns(embedding=Vector(1536))
+        result = await db.execute(
+            statement,
+            {
+                "tsquery": tsquery,
+                "limit": limit,
+                "max_matches": settings.LEXICAL_MAX_MATCHES,
+                **scope_params,
+            },
+        )
+        return result.fetchall()
 
     def _build_prompt(self, query: str, contexts: List[dict]):
         """构建 Prompt"""
+        started = time.perf_counter()
+        try:
+            return self._format_prompt(query, contexts)
+        finally:
+            metrics.PROMPT_BUILD_SECONDS.observe(time.perf_counter() - started)
+
+    def _format_prompt(self, query: str, contexts: List[dict]):
+        """过滤相关内容、按 token 预算打包上下文并填入模板"""
         # 获取 Prompt 模板
         prompt_with_context = settings.RAG_PROMPT_WITH_CONTEXT or prompts.RAG_PROMPT_WITH_CONTEXT
         prompt_without_context = settings.RAG_PROMPT_WITHOUT_CONTEXT or prompts.RAG_PROMPT_WITHOUT_CONTEXT
         
-        # ⚠️ 修复：确保 contexts 是字典列表
-        print(f"🔍 [RAG] contexts 类型：{type(contexts)}, 长度：{len(contexts)}")
-        if contexts:
-            print(f"🔍 [RAG] 第一个元素类型：{type(contexts[0])}")
-        
         # ⚠️ 修复：安全地过滤相关内容
         threshold = settings.SIMILARITY_THRESHOLD
         relevant_contexts = []
@@ -179,49 +941,79 @@ class RAGService:
                 elif isinstance(c, str):
                     relevant_contexts.append({"content": c, "score": 1.0})
             except Exception as e:
-                print(f"⚠️ [RAG] 处理 context 失败：{e}")
+                logger.warning("处理 context 失败：%s", e)
                 continue
-        
-        # ⚠️ 日志输出
-        print(f"🔍 [RAG] 检索到 {len(contexts)} 条内容")
-        print(f"🔍 [RAG] 相关内容 {len(relevant_contexts)} 条（阈值：{threshold}）")
-        
-        for i, c in enumerate(relevant_contexts[:3]):  # 只显示前 3 条
-            print(f"   [{i}] 相似度：{c.get('score', 0):.3f}")
-            print(f"       内容：{c.get('content', '')[:100]}...")
-        
+
+        logger.debug(
+            "检索到 %d 条内容，相关内容 %d 条（阈值：%s）", len(contexts), len(relevant_contexts), threshold
+        )
+        if relevant_contexts and verbose(logger):
+            # 只记录前 3 条
+            logger.debug(
+                "相关内容明细",
+                extra={
+                    "contexts": [
+                        {"score": round(c.get("score", 0), 3), "content": c.get("content", "")[:100]}
+                        for c in relevant_contexts[:3]
+                    ]
+                },
+            )
+
         if relevant_contexts:
-            # 有相关内容
-            context_text = "\n\n".join([c.get("content", str(c)) for c in relevant_contexts])
-            
-            # 限制上下文长度
-            if len(context_text) > settings.MAX_CONTEXT_LENGTH:
-                context_text = context_text[:settings.MAX_CONTEXT_LENGTH] + "..."
-            
-            print(f"✅ [RAG] 使用文档内容回答，上下文长度：{len(context_text)}")
+            # 有相关内容：去掉相邻片段的重叠，按相似度放入完整片段直到 token 预算用完
+            packed = pack_contexts(relevant_contexts, settings.MAX_CONTEXT_TOKENS)
+            context_text = packed.text
+
+            logger.debug(
+                "使用文档内容回答，上下文 %d tokens（%d 个片段，跳过 %d 个，去重叠 %d 字符）",
+                packed.tokens,
+                len(packed.chunks),
+                packed.skipped,
+                packed.overlap_chars,
+            )
             return prompt_with_context.format(
                 context_text=context_text,
                 query=query
             )
         else:
             # 无相关内容
-            print(f"⚠️ [RAG] 无相关内容，使用通用知识")
+            logger.debug("无相关内容，使用通用知识")
             return prompt_without_context.format(query=query)
         
+    def _astream_llm(self, prompt: str):
+        """LLM 流式输出（SDK 为同步接口，在 LLM 线程池中执行，分片经有界队列转为异步流）"""
+        return stream_in_thread(
+            lambda: self.llm.stream(prompt),
+            self._llm_executor,
+            settings.LLM_STREAM_BUFFER_SIZE,
+        )
+
     async def chat_stream(self, query: str, contexts: List[dict]):
         """流式聊天生成器"""
         # 构建 Prompt
         prompt = self._build_prompt(query, contexts)
         
-        print(f"🔍 [RAG] 流式生成，上下文数量：{len(contexts)}")
-        print(f"🔍 [RAG] Prompt 长度：{len(prompt)}")
-        
+        logger.debug("流式生成，上下文数量：%d，Prompt 长度：%d", len(contexts), len(prompt))
+
+        started = time.perf_counter()
+        waiting_first = True
         try:
-            for chunk in self.llm.stream(prompt):
+            async for chunk in self._astream_llm(prompt):
+                if waiting_first:
+                    metrics.FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+                    waiting_first = False
                 yield chunk
         except Exception as e:
-            print(f"❌ [RAG] 流式生成失败：{e}")
+            metrics.GENERATION_ERRORS_STREAM.inc()
+            logger.error("流式生成失败：%s", e)
             raise
+        metrics.GENERATION_SECONDS_STREAM.observe(time.perf_counter() - started)
+
+    @staticmethod
+    def record_generation_rate(answer: str, seconds: float) -> None:
+        """记录生成速度（回答生成完成后调用一次）"""
+        if answer and seconds > 0:
+            metrics.GENERATION_TOKENS_PER_SECOND.observe(token_length(answer) / seconds)
 
     async def generate_answer(
             self,
@@ -233,9 +1025,17 @@ class RAGService:
             prompt = self._build_prompt(query, contexts)
             
             if stream:
-                return self.llm.stream(prompt)
+                return self._astream_llm(prompt)
             else:
-                response = await self.llm.ainvoke(prompt)
+                started = time.perf_counter()
+                try:
+                    response = await self.llm.ainvoke(prompt)
+                except Exception:
+                    metrics.GENERATION_ERRORS_INVOKE.inc()
+                    raise
+                seconds = time.perf_counter() - started
+                metrics.GENERATION_SECONDS_INVOKE.observe(seconds)
+                self.record_generation_rate(response, seconds)
                 return response
 
 
@@ -0,0 +1,73 @@
+"""
+同步迭代器转异步流
+
+DashScope SDK 只提供同步的流式接口，在协程中直接 for 循环会阻塞事件循环，同一进程内的
+流式对话只能依次执行。stream_in_thread 在线程池中驱动同步迭代器，分片经有界队列交给协程：
+- 队列满（客户端读得慢）时生产线程阻塞等待，不会无限缓存
+- 协程退出（客户端断开）时通知生产线程停止并关闭迭代器
+- 迭代器抛出的异常在协程中重新抛出
+"""
+import asyncio
+import concurrent.futures
+import threading
+from concurrent.futures import Executor
+from typing import AsyncIterator, Callable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+# 队列满时生产线程检查消费端是否已退出的间隔（秒）
+_PUT_POLL_INTERVAL = 0.1
+
+
+async def stream_in_thread(
+    factory: Callable[[], Iterator[T]],
+    executor: Optional[Executor] = None,
+    maxsize: int = 64,
+) -> AsyncIterator[T]:
+    """在 executor 中运行 factory() 返回的同步迭代器，逐个产出其元素"""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        """生产线程中放入队列（队列满时阻塞），消费端已退出时返回 False"""
+        try:
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        except RuntimeError:  # 事件循环已关闭
+            return False
+        while True:
+            try:
+                future.result(timeout=_PUT_POLL_INTERVAL)
+                return True
+            except concurrent.futures.TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return False
+
+    def produce() -> None:
+        iterator = None
+        try:
+            iterator = factory()
+            for item in iterator:
+                if stop.is_set() or not put((item, None)):
+                    return
+            put((_DONE, None))
+        except BaseException as e:
+            put((_DONE, e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    loop.run_in_executor(executor, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,459 @@
+"""
+向量存储
+
+片段内容、元数据和关键词索引始终保存在 document_chunks，向量检索由可替换的 VectorStore 完成：
+- pgvector（默认）：向量随片段行写入 document_chunks，检索使用 HNSW / IVFFlat、压缩存储或降维索引
+- numpy：float32 向量保存在只追加的内存映射 .npy 文件中，另有一张 id 对照表；
+  检索用矩阵乘法 + argpartition 精确求 top-k，启动时直接映射文件，无需加载或建索引。
+  只适合单节点部署（单个 API 进程，文档处理工作协程运行在进程内）和检索基准测试。
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.core.projection import active_projection
+from app.db.session import async_session_maker
+from app.db.vector_index import apply_search_params, search_storage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SearchScope:
+    """检索范围，作为过滤条件下推到 SQL"""
+
+    owner_id: Optional[int] = None
+    document_ids: Optional[List[int]] = None
+
+    @property
+    def filtered(self) -> bool:
+        return self.owner_id is not None or bool(self.document_ids)
+
+    def where(self) -> Tuple[str, dict]:
+        """返回追加到 WHERE 的条件（以 AND 开头）和绑定参数"""
+        clauses, params = [], {}
+        if self.owner_id is not None:
+            clauses.append("owner_id = :owner_id")
+            params["owner_id"] = self.owner_id
+        if self.document_ids:
+            clauses.append("document_id = ANY(:document_ids)")
+            params["document_ids"] = list(self.document_ids)
+        return "".join(f" AND {clause}" for clause in clauses), params
+
+
+def chunk_hit(row, score: float, embedding=None) -> dict:
+    """片段行转换为检索结果"""
+    hit = {
+        "id": row.id,
+        "document_id": row.document_id,
+        "content": row.content,
+        "score": score,
+        "chunk_index": row.chunk_index,
+        "chunk_metadata": row.chunk_metadata,
+        "source": row.chunk_metadata.get("source")
+        if row.chunk_metadata
+        else None,
+    }
+    if embedding is not None:
+        hit["embedding"] = embedding
+    return hit
+
+
+class VectorStore(ABC):
+    """向量存储接口"""
+
+    # 向量是否单独保存；为 False 时向量随片段行写入 document_chunks，add / delete 无需处理
+    stores_vectors = False
+
+    async def start(self) -> None:
+        """启动时调用（加载 / 与数据库同步）"""
+
+    async def add(
+        self,
+        chunk_ids: Sequence[int],
+        document_id: int,
+        owner_id: Optional[int],
+        embeddings: Sequence[Sequence[float]],
+    ) -> None:
+        """写入片段向量（片段已提交到 document_chunks 之后调用）"""
+
+    async def delete(self, chunk_ids: Sequence[int]) -> None:
+        """删除片段向量"""
+
+    async def delete_documents(self, document_ids: Sequence[int]) -> None:
+        """删除文档的全部片段向量"""
+
+    @abstractmethod
+    async def search(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        limit: int,
+        scope: SearchScope,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        with_embeddings: bool = False,
+    ) -> List[dict]:
+        """向量检索，按余弦相似度从高到低返回（with_embeddings 时结果附带片段向量）"""
+
+
+class PgVectorStore(VectorStore):
+    """pgvector 向量检索"""
+
+    async def search(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        limit: int,
+        scope: SearchScope,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        with_embeddings: bool = False,
+    ) -> List[dict]:
+        """向量检索
+
+        启用降维索引或压缩存储时，先在对应索引上取出候选，再用原始向量精确重排。
+        """
+        embedding_str = json.dumps(query_embedding)
+        params = {"embedding": embedding_str, "top_k": limit}
+        storage = search_storage()
+        projection = await active_projection() if settings.PROJECTION_ENABLED else None
+
+        first_pass: Optional[Tuple[str, str]] = None  # (候选列, 排序表达式)
+        method = None
+        candidates = limit
+        if projection is not None:
+            first_pass = (projection.column, f"{projection.column} <=> CAST(:reduced AS vector)")
+            params["reduced"] = json.dumps(projection.project(query_embedding).tolist())
+            method = "hnsw"
+            candidates = max(limit, settings.PROJECTION_RERANK_CANDIDATES)
+        elif storage is not None:
+            query_vector = storage.from_vector("CAST(:embedding AS vector)")
+            first_pass = (storage.column, f"{storage.column} {storage.operator} {query_vector}")
+            candidates = max(limit, settings.QUANTIZED_RERANK_CANDIDATES)
+        params["candidates"] = candidates
+
+        # 设置 ANN 检索参数（仅对当前事务生效）
+        await apply_search_params(
+            db,
+            candidates,
+            ef_search=ef_search,
+            probes=probes,
+            filtered=scope.filtered,
+            method=method,
+        )
+        scope_sql, scope_params = scope.where()
+        params.update(scope_params)
+
+        if first_pass is None:
+            # 按余弦距离排序，才能命中 HNSW / IVFFlat 索引
+            query_str = f"""
+                    SELECT
+                        id, document_id, content, chunk_index, chunk_metadata,
+                        {"embedding," if with_embeddings else ""}
+                        embedding <=> CAST(:embedding AS vector) as distance
+                    FROM document_chunks
+                    WHERE embedding IS NOT NULL{scope_sql}
+                    ORDER BY embedding <=> CAST(:embedding AS vector)
+                    LIMIT :top_k
+                    """
+        else:
+            column, order_by = first_pass
+            query_str = f"""
+                    SELECT
+                        id, document_id, content, chunk_index, chunk_metadata,
+                        {"embedding," if with_embeddings else ""}
+                        embedding <=> CAST(:embedding AS vector) as distance
+                    FROM (
+                        SELECT id, document_id, content, chunk_index, chunk_metadata, embedding
+                        FROM document_chunks
+                        WHERE {column} IS NOT NULL{scope_sql}
+                        ORDER BY {order_by}
+                        LIMIT :candidates
+                    ) AS candidates
+                    ORDER BY distance
+                    LIMIT :top_k
+                    """
+        statement = text(query_str)
+        if with_embeddings:
+            statement = statement.columns(embedding=Vector(1536))
+
+        result = await db.execute(statement, params)
+
+        # IVFFlat 迭代扫描的结果只是大致有序
+        rows = sorted(result.fetchall(), key=lambda row: row.distance)
+        return [
+            chunk_hit(
+                row,
+                1 - float(row.distance),
+                row.embedding if with_embeddings else None,
+            )
+            for row in rows
+        ]
+
+
+# id 对照表：片段 id、所属文档、所有者（无所有者为 -1）、是否有效（删除只做标记）
+RECORD_DTYPE = np.dtype(
+    [("id", "<i8"), ("document_id", "<i4"), ("owner_id", "<i4"), ("alive", "?")]
+)
+INITIAL_CAPACITY = 1024
+# 启动同步时每批加载的片段数
+SYNC_BATCH_SIZE = 1000
+
+
+class NumpyVectorStore(VectorStore):
+    """内存映射 .npy 向量存储，精确检索"""
+
+    stores_vectors = True
+
+    def __init__(self, path: str, dim: int = 1536) -> None:
+        self.path = path
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._count = 0
+        self._vectors: Optional[np.ndarray] = None  # (capacity, dim)，已归一化
+        self._records: Optional[np.ndarray] = None  # (capacity,) RECORD_DTYPE
+        self._open()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _open(self) -> None:
+        """映射已有文件（不读入内存），不存在时创建"""
+        os.makedirs(self.path, exist_ok=True)
+        state_file = self._file("state.json")
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                state = json.load(f)
+            self._count = state["count"]
+            self._vectors = np.load(self._file("embeddings.npy"), mmap_mode="r+")
+            self._records = np.load(self._file("records.npy"), mmap_mode="r+")
+        else:
+            self._allocate(INITIAL_CAPACITY)
+            self._save_state()
+
+    def _allocate(self, capacity: int) -> None:
+        """按新容量创建文件并复制已有数据（容量翻倍增长，均摊开销很小）"""
+        vectors = open_memmap(
+            self._file("embeddings.npy.tmp"), mode="w+", dtype=np.float32, shape=(capacity, self.dim)
+        )
+        records = open_memmap(
+            self._file("records.npy.tmp"), mode="w+", dtype=RECORD_DTYPE, shape=(capacity,)
+        )
+        if self._count:
+            vectors[:self._count] = self._vectors[:self._count]
+            records[:self._count] = self._records[:self._count]
+        vectors.flush()
+        records.flush()
+        os.replace(self._file("embeddings.npy.tmp"), self._file("embeddings.npy"))
+        os.replace(self._file("records.npy.tmp"), self._file("records.npy"))
+        self._vectors, self._records = vectors, records
+
+    def _save_state(self) -> None:
+        tmp = self._file("state.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"count": self._count, "dim": self.dim}, f)
+        os.replace(tmp, self._file("state.json"))
+
+    def __len__(self) -> int:
+        """有效向量数"""
+        with self._lock:
+            return int(self._records["alive"][:self._count].sum())
+
+    def add_sync(
+        self,
+        chunk_ids: Sequence[int],
+        document_ids: Sequence[int],
+        owner_ids: Sequence[Optional[int]],
+        embeddings: Sequence[Sequence[float]],
+    ) -> None:
+        """追加向量：先写数据再更新计数，中途崩溃不会留下半条记录"""
+        if not len(chunk_ids):
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(chunk_ids), self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+
+        with self._lock:
+            start, end = self._count, self._count + len(chunk_ids)
+            if end > len(self._records):
+                self._allocate(max(end, len(self._records) * 2))
+            self._vectors[start:end] = vectors
+            records = self._records[start:end]
+            records["id"] = chunk_ids
+            records["document_id"] = document_ids
+            records["owner_id"] = [-1 if o is None else o for o in owner_ids]
+            records["alive"] = True
+            self._vectors.flush()
+            self._records.flush()
+            self._count = end
+            self._save_state()
+
+    def _mark_deleted(self, field: str, values: Sequence[int]) -> None:
+        if not len(values):
+            return
+        with self._lock:
+            records = self._records[:self._count]
+            mask = records["alive"] & np.isin(records[field], np.asarray(values))
+            records["alive"][mask] = False
+            self._records.flush()
+
+    def top_k(
+        self,
+        query_embedding: Sequence[float],
+        k: int,
+        scope: Optional[SearchScope] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """精确 top-k，返回 (片段 id, 余弦相似度, 行号)，按相似度降序"""
+        with self._lock:
+            count = self._count
+            vectors = self._vectors[:count]
+            records = self._records[:count]
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        mask = records["alive"].copy()
+        if scope is not None and scope.owner_id is not None:
+            mask &= records["owner_id"] == scope.owner_id
+        if scope is not None and scope.document_ids:
+            mask &= np.isin(records["document_id"], np.asarray(scope.document_ids))
+        rows = np.flatnonzero(mask)
+        if not len(rows) or k <= 0:
+            empty = np.empty(0)
+            return empty.astype(np.int64), empty.astype(np.float32), empty.astype(np.int64)
+
+        # 范围较小时只计算范围内的向量
+        if len(rows) < count // 2:
+            scores = vectors[rows] @ query
+        else:
+            scores = (vectors @ query)[rows]
+
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return records["id"][rows[top]], scores[top], rows[top]
+
+    async def start(self) -> None:
+        """与 document_chunks 对齐：补齐缺失的向量、标记已删除的片段"""
+        async with async_session_maker() as db:
+            result = await db.execute(
+                text("SELECT id FROM document_chunks WHERE embedding IS NOT NULL")
+            )
+            db_ids = np.asarray(result.scalars().all(), dtype=np.int64)
+
+            with self._lock:
+                records = self._records[:self._count]
+                stored_ids = records["id"][records["alive"]]
+            stale = np.setdiff1d(stored_ids, db_ids)
+            missing = np.setdiff1d(db_ids, stored_ids)
+
+            self._mark_deleted("id", stale.tolist())
+            for start in range(0, len(missing), SYNC_BATCH_SIZE):
+                batch = missing[start:start + SYNC_BATCH_SIZE].tolist()
+                result = await db.execute(
+                    text(
+                        """
+                        SELECT c.id, c.document_id, coalesce(c.owner_id, d.owner_id) AS owner_id,
+                               c.embedding
+                        FROM document_chunks AS c
+                        JOIN documents AS d ON d.id = c.document_id
+                        WHERE c.id = ANY(:ids)
+                        ORDER BY c.id
+                        """
+                    ).columns(embedding=Vector(1536)),
+                    {"ids": batch},
+                )
+                rows = result.fetchall()
+                await asyncio.to_thread(
+                    self.add_sync,
+                    [row.id for row in rows],
+                    [row.document_id for row in rows],
+                    [row.owner_id for row in rows],
+                    [row.embedding for row in rows],
+                )
+
+        logger.info(
+            "NumPy 向量存储已加载：%d 条（补齐 %d，移除 %d）", len(self), len(missing), len(stale)
+        )
+
+    async def add(
+        self,
+        chunk_ids: Sequence[int],
+        document_id: int,
+        owner_id: Optional[int],
+        embeddings: Sequence[Sequence[float]],
+    ) -> None:
+        await asyncio.to_thread(
+            self.add_sync,
+            chunk_ids,
+            [document_id] * len(chunk_ids),
+            [owner_id] * len(chunk_ids),
+            embeddings,
+        )
+
+    async def delete(self, chunk_ids: Sequence[int]) -> None:
+        self._mark_deleted("id", chunk_ids)
+
+    async def delete_documents(self, document_ids: Sequence[int]) -> None:
+        self._mark_deleted("document_id", document_ids)
+
+    async def search(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        limit: int,
+        scope: SearchScope,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        with_embeddings: bool = False,
+    ) -> List[dict]:
+        """精确检索（ef_search / probes 不适用），再从 document_chunks 读取片段内容"""
+        ids, scores, rows = await asyncio.to_thread(self.top_k, query_embedding, limit, scope)
+        if not len(ids):
+            return []
+
+        result = await db.execute(
+            text(
+                """
+                SELECT id, document_id, content, chunk_index, chunk_metadata
+                FROM document_chunks
+                WHERE id = ANY(:ids)
+                """
+            ),
+            {"ids": ids.tolist()},
+        )
+        by_id: Dict[int, object] = {row.id: row for row in result}
+        return [
+            chunk_hit(
+                by_id[chunk_id],
+                float(score),
+                self._vectors[row] if with_embeddings else None,
+            )
+            for chunk_id, score, row in zip(ids.tolist(), scores, rows)
+            if chunk_id in by_id
+        ]
+
+
+def create_vector_store() -> VectorStore:
+    """按 VECTOR_STORE_BACKEND 创建向量存储"""
+    backend = settings.VECTOR_STORE_BACKEND.lower()
+    if backend == "pgvector":
+        return PgVectorStore()
+    if backend == "numpy":
+        return NumpyVectorStore(settings.NUMPY_STORE_PATH)
+    raise ValueError(f"不支持的向量存储: {settings.VECTOR_STORE_BACKEND}")
@@ -0,0 +1,114 @@
+"""
+批量写入
+
+通过 asyncpg 的二进制 COPY 协议写入大量行，避免逐行构造 ORM 对象和 INSERT 往返。
+各字段先用 encode_* 编码为 PostgreSQL 二进制格式，None 表示 NULL。
+
+update_in_batches 按 id 顺序分批改写已有行（回填新增列），每批单独提交。
+"""
+import json
+import struct
+from typing import AsyncIterator, Iterable, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+# 二进制 COPY 文件头（签名 + flags + 扩展区长度）与结束标记
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_COPY_TRAILER = struct.pack("!h", -1)
+_NULL = struct.pack("!i", -1)
+
+
+def encode_int4(value: int) -> bytes:
+    return struct.pack("!i", value)
+
+
+def encode_int8(value: int) -> bytes:
+    return struct.pack("!q", value)
+
+
+def encode_text(value: str) -> bytes:
+    return value.encode("utf-8")
+
+
+def encode_json(value) -> bytes:
+    # json 类型的二进制格式即 UTF-8 文本
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def encode_vector(value: Sequence[float]) -> bytes:
+    # pgvector 二进制格式：int16 维度 + int16 保留位 + float4[维度]
+    return struct.pack(f"!HH{len(value)}f", len(value), 0, *value)
+
+
+def encode_halfvec(value: Sequence[float]) -> bytes:
+    # pgvector halfvec：int16 维度 + int16 保留位 + float2[维度]
+    return struct.pack("!HH", len(value), 0) + np.asarray(value, dtype=">f2").tobytes()
+
+
+def encode_binary_quantized(value: Sequence[float]) -> bytes:
+    # 与 pgvector binary_quantize 一致：大于 0 记为 1；bit 二进制格式为 int32 位数 + 按高位在前打包的字节
+    bits = np.asarray(value, dtype=np.float32) > 0
+    return struct.pack("!i", len(bits)) + np.packbits(bits).tobytes()
+
+
+def _encode_row(fields: Sequence[Optional[bytes]]) -> bytes:
+    parts = [struct.pack("!h", len(fields))]
+    for field in fields:
+        if field is None:
+            parts.append(_NULL)
+        else:
+            parts.append(struct.pack("!i", len(field)))
+            parts.append(field)
+    return b"".join(parts)
+
+
+async def _copy_stream(rows: Iterable[Sequence[Optional[bytes]]]) -> AsyncIterator[bytes]:
+    yield _COPY_HEADER
+    for row in rows:
+        yield _encode_row(row)
+    yield _COPY_TRAILER
+
+
+async def copy_rows(
+    db: AsyncSession,
+    table: str,
+    columns: List[str],
+    rows: Iterable[Sequence[Optional[bytes]]],
+) -> None:
+    """二进制 COPY 写入，行按需编码、流式发送（在会话的事务中执行，由调用方提交）"""
+    conn = await db.connection()
+    raw = await conn.get_raw_connection()
+    driver = raw.driver_connection
+    if not driver.is_in_transaction():
+        # asyncpg 适配器在执行第一条语句时才发送 BEGIN；直接在驱动连接上 COPY 会自成一个事务并立即提交，
+        # 先执行一条语句，让 COPY 属于会话的事务，随会话提交或回滚
+        await conn.execute(text("SELECT 1"))
+
+    # 在会话事务中作为保存点执行
+    async with driver.transaction():
+        await driver.copy_to_table(
+            table,
+            source=_copy_stream(rows),
+            columns=columns,
+            format="binary",
+        )
+
+
+async def update_in_batches(engine: AsyncEngine, statement: str, batch_size: int) -> int:
+    """分批执行 UPDATE，每批单独提交，返回改写的行数
+
+    statement 按 id 顺序改写 id > :last_id 的至多 :limit 行，并 RETURNING id。
+    """
+    total = 0
+    last_id = 0
+    while True:
+        async with engine.begin() as conn:
+            result = await conn.execute(text(statement), {"last_id": last_id, "limit": batch_size})
+            ids = result.scalars().all()
+        if not ids:
+            break
+        total += len(ids)
+        last_id = max(ids)
+    return total
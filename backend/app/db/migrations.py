@@ -0,0 +1,173 @@
+"""
+数据库结构迁移
+
+create_all 只会创建缺失的表，已有表上新增的列 / 索引在这里用幂等语句补齐，
+由 init_db 在每次启动时执行。
+
+已有数据的回填（run_backfills）不在 init_db 的事务中执行：启动完成后在后台用单独的连接
+按 id 顺序分批改写，每批单独提交，不会长时间持有行锁或阻塞启动。回填完成前新增的列
+可能为空，读取方需要兼容。
+"""
+import asyncio
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.core.lexical import to_tsvector_text
+from app.db.bulk import update_in_batches
+from app.db.vector_index import backfill_vector_storage
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = [
+    # 文档内容哈希（上传去重）
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS ix_documents_content_hash ON documents (content_hash)",
+    # 片段内容哈希（增量重建索引，已有数据由 backfill_chunk_hashes 回填）
+    "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_document_id ON document_chunks (document_id)",
+    "ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS kind VARCHAR(20) DEFAULT 'ingest'",
+    "ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMPTZ",
+    # 关键词检索列与 GIN 索引（已有数据由 backfill_lexical_terms 回填）
+    "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS lexical_terms TEXT",
+    """
+    ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (CAST(coalesce(lexical_terms, '') AS tsvector)) STORED
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS ix_document_chunks_search_vector
+    ON document_chunks USING gin (search_vector)
+    """,
+    # 片段冗余文档所有者（按用户过滤检索，已有数据由 backfill_chunk_owners 回填）
+    "ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS owner_id INTEGER",
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_owner_id ON document_chunks (owner_id)",
+    # 按 (文档, 位置) 取相邻片段
+    """
+    CREATE INDEX IF NOT EXISTS ix_document_chunks_document_id_chunk_index
+    ON document_chunks (document_id, chunk_index)
+    """,
+    # 父级段落（document_sections 表由 create_all 创建）
+    """
+    ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS section_id INTEGER
+    REFERENCES document_sections (id) ON DELETE SET NULL
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_section_id ON document_chunks (section_id)",
+    # 语料版本（单行）
+    "INSERT INTO corpus_state (id, generation) VALUES (1, 0) ON CONFLICT (id) DO NOTHING",
+]
+
+# 回填时每批处理的片段数
+BACKFILL_BATCH_SIZE = 1000
+
+
+async def run_migrations(conn: AsyncConnection) -> None:
+    """按顺序执行迁移语句"""
+    for statement in MIGRATIONS:
+        await conn.execute(text(statement))
+
+
+async def run_backfills(engine: AsyncEngine) -> None:
+    """回填已有数据（启动后在后台执行，失败时下次启动继续）"""
+    try:
+        await backfill_vector_storage(engine)
+        await backfill_chunk_owners(engine)
+        await backfill_chunk_hashes(engine)
+        await backfill_lexical_terms(engine)
+    except Exception:
+        logger.exception("数据回填失败，下次启动时继续")
+
+
+async def backfill_chunk_owners(engine: AsyncEngine) -> int:
+    """为已有片段冗余文档所有者"""
+    total = await update_in_batches(
+        engine,
+        """
+        UPDATE document_chunks AS c
+        SET owner_id = d.owner_id
+        FROM documents AS d
+        WHERE c.document_id = d.id
+          AND c.id IN (
+              SELECT c2.id FROM document_chunks AS c2
+              JOIN documents AS d2 ON d2.id = c2.document_id
+              WHERE c2.id > :last_id AND c2.owner_id IS NULL AND d2.owner_id IS NOT NULL
+              ORDER BY c2.id
+              LIMIT :limit
+              FOR UPDATE OF c2 SKIP LOCKED
+          )
+        RETURNING c.id
+        """,
+        BACKFILL_BATCH_SIZE,
+    )
+    if total:
+        logger.info("已为 %d 个片段回填所有者", total)
+    return total
+
+
+async def backfill_chunk_hashes(engine: AsyncEngine) -> int:
+    """为已有片段计算内容哈希"""
+    total = await update_in_batches(
+        engine,
+        """
+        UPDATE document_chunks
+        SET content_hash = encode(sha256(convert_to(content, 'UTF8')), 'hex')
+        WHERE id IN (
+            SELECT id FROM document_chunks
+            WHERE id > :last_id AND content_hash IS NULL
+            ORDER BY id
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id
+        """,
+        BACKFILL_BATCH_SIZE,
+    )
+    if total:
+        logger.info("已为 %d 个片段计算内容哈希", total)
+    return total
+
+
+async def backfill_lexical_terms(engine: AsyncEngine) -> int:
+    """为已有片段生成关键词检索分词（分词在应用层完成，每批单独提交）
+
+    SKIP LOCKED：多个进程同时启动时各自处理不同的行，也不会等待正在写入的片段。
+    """
+    total = 0
+    last_id = 0
+    while True:
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                text(
+                    """
+                    SELECT id, content FROM document_chunks
+                    WHERE id > :last_id AND lexical_terms IS NULL
+                    ORDER BY id
+                    LIMIT :limit
+                    FOR UPDATE SKIP LOCKED
+                    """
+                ),
+                {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE},
+            )
+            rows = result.fetchall()
+            if not rows:
+                break
+
+            # 分词是 CPU 密集操作，放到线程中执行，不阻塞事件循环
+            terms = await asyncio.to_thread(lambda: [to_tsvector_text(row.content) for row in rows])
+            await conn.execute(
+                text(
+                    """
+                    UPDATE document_chunks AS c
+                    SET lexical_terms = v.terms
+                    FROM unnest(CAST(:ids AS integer[]), CAST(:terms AS text[])) AS v(id, terms)
+                    WHERE c.id = v.id
+                    """
+                ),
+                {"ids": [row.id for row in rows], "terms": terms},
+            )
+        total += len(rows)
+        last_id = rows[-1].id
+
+    if total:
+        logger.info("已为 %d 个片段生成关键词索引", total)
+    return total
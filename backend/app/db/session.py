@@ -1,3 +1,5 @@
+import logging
+
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy import text
 from app.config import settings
@@ -5,11 +7,11 @@ from app.config import settings
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
+logger = logging.getLogger(__name__)
 
 # 创建异步引擎
 engine = create_async_engine(
     settings.DATABASE_URL,
-    echo=settings.ENVIRONMENT == "development",  # 开发环境打印 SQL
     pool_pre_ping=True,  # 连接前检查
 )
 
@@ -39,9 +41,11 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
 
 
 from app.models.document import Document, DocumentChunk
+from app.db.migrations import run_migrations
+from app.db.vector_index import ensure_vector_index, ensure_vector_storage
 
 async def init_db():
-    """初始化数据库"""
+    """初始化数据库（失败时抛出异常，应用不会在表结构不完整的情况下启动）"""
     try:
         async with engine.begin() as conn:
             # 启用 pgvector 扩展
@@ -49,8 +53,17 @@ async def init_db():
             
             # 创建所有表
             await conn.run_sync(Base.metadata.create_all)
-            
-        print("数据库初始化完成 - pgvector 扩展已启用")
-        print("数据表已创建：documents, document_chunks")
-    except Exception as e:
-        print(f"数据库初始化警告：{e}")
\ No newline at end of file
+
+            # 补齐已有表的新增列 / 索引
+            await run_migrations(conn)
+
+        # 压缩向量列（单独的短事务，已有数据在启动后回填）
+        await ensure_vector_storage(engine)
+
+        # 创建 / 重建向量索引（CONCURRENTLY，不能在上面的事务中执行）
+        await ensure_vector_index(engine)
+
+        logger.info("数据库初始化完成 - pgvector 扩展已启用，数据表已创建")
+    except Exception:
+        logger.exception("数据库初始化失败")
+        raise
\ No newline at end of file
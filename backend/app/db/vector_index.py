@@ -0,0 +1,383 @@
+"""
+向量索引管理
+
+document_chunks.embedding 上的 ANN 索引（HNSW / IVFFlat）由 init_db 在建表事务提交后按配置
+创建，配置变化（索引类型或构建参数）时自动重建。索引用 CREATE INDEX CONCURRENTLY 构建，
+不阻塞写入；重建时先建新索引再替换旧索引，期间检索仍可使用旧索引。多个进程同时启动时
+由 advisory lock 保证只有一个进程维护索引。
+
+IVFFlat 的聚类中心在建索引时由已有数据训练，空表上建的索引召回率很差：
+- 行数不足 IVFFLAT_MIN_ROWS 时不建索引（小数据量下精确检索足够快）
+- IVFFLAT_LISTS=0 时 lists 按行数自动确定（100 万行以内 rows/1000，以上 sqrt(rows)），
+  实际 lists 与数据量偏差超过一倍时重建；文档处理完成后按 IVFFLAT_CHECK_INTERVAL 定期检查
+
+带过滤条件的检索：ANN 索引先取出 ef_search / probes 范围内的候选再过滤，过滤条件
+选择性高时结果会不足 LIMIT。pgvector 0.8+ 支持迭代扫描（iterative_scan），在结果
+不足时继续扫描索引；更低版本只能依赖规划器对小范围数据改走 B-tree 索引精确排序。
+
+压缩存储（VECTOR_STORAGE_MODE，需要 pgvector 0.7+）：
+- full：索引建在原始 vector 列上
+- halfvec：额外保存半精度向量，索引体积减半
+- binary：额外保存符号位二进制码，按汉明距离检索，索引体积约为 1/32
+压缩模式下 ANN 索引建在压缩列上，先取出 QUANTIZED_RERANK_CANDIDATES 个候选，
+再用原始向量精确重排。压缩列由 ensure_vector_storage 在启动时创建，已有数据由
+backfill_vector_storage 在后台分批回填，回填完成前检索仍使用原始向量。
+"""
+import asyncio
+import logging
+import math
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from app.config import settings
+from app.db.bulk import encode_binary_quantized, encode_halfvec, update_in_batches
+
+logger = logging.getLogger(__name__)
+
+INDEX_METHODS = ("hnsw", "ivfflat")
+
+# 回填压缩列时每批处理的行数
+STORAGE_BACKFILL_BATCH_SIZE = 1000
+# 有行被其他进程锁定时，再次检查的间隔（秒）
+STORAGE_BACKFILL_RETRY_INTERVAL = 1.0
+
+# 维护向量索引的 advisory lock
+INDEX_LOCK_KEY = 7_305_011
+
+# 由 ensure_vector_index 根据 pgvector 版本设置
+_iterative_scan_supported = False
+# 压缩列回填完成后由 backfill_vector_storage 设置
+_storage_ready = False
+
+
+@dataclass(frozen=True)
+class CompactStorage:
+    """压缩向量存储方式"""
+
+    column: str
+    sql_type: str
+    opclass: str
+    operator: str  # 与 opclass 对应的距离运算符
+    expression: str  # 由 vector 表达式生成压缩值，{} 为占位符
+    encode: Callable[[Sequence[float]], bytes]  # COPY 二进制编码
+
+    def from_vector(self, vector_sql: str) -> str:
+        return self.expression.format(vector_sql)
+
+
+STORAGE_MODES: Dict[str, CompactStorage] = {
+    "halfvec": CompactStorage(
+        column="embedding_half",
+        sql_type="halfvec(1536)",
+        opclass="halfvec_cosine_ops",
+        operator="<=>",
+        expression="CAST({} AS halfvec(1536))",
+        encode=encode_halfvec,
+    ),
+    "binary": CompactStorage(
+        column="embedding_bit",
+        sql_type="bit(1536)",
+        opclass="bit_hamming_ops",
+        operator="<~>",
+        expression="CAST(binary_quantize({}) AS bit(1536))",
+        encode=encode_binary_quantized,
+    ),
+}
+
+
+def search_storage() -> Optional[CompactStorage]:
+    """检索使用的压缩存储：压缩列回填完成前返回 None，检索仍使用原始向量"""
+    return compact_storage() if _storage_ready else None
+
+
+def compact_storage() -> Optional[CompactStorage]:
+    """当前配置的压缩存储方式，full 时返回 None"""
+    mode = settings.VECTOR_STORAGE_MODE.lower()
+    if mode == "full":
+        return None
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"不支持的向量存储方式: {settings.VECTOR_STORAGE_MODE}")
+    return STORAGE_MODES[mode]
+
+
+def _index_name(method: str, column: str = "embedding") -> str:
+    return f"ix_document_chunks_{column}_{method}"
+
+
+def ivfflat_lists(rows: int) -> int:
+    """IVFFlat 的 lists：配置值，或按行数自动确定"""
+    if settings.IVFFLAT_LISTS > 0:
+        return settings.IVFFLAT_LISTS
+    if rows <= 1_000_000:
+        return max(rows // 1000, 1)
+    return int(math.sqrt(rows))
+
+
+def options_fit(method: str, current: Dict[str, int], expected: Dict[str, int]) -> bool:
+    """已有索引的构建参数是否仍然合适（自动 lists 允许一倍以内的偏差）"""
+    if current.keys() != expected.keys():
+        return False
+    if method == "ivfflat" and settings.IVFFLAT_LISTS <= 0:
+        return expected["lists"] / 2 <= current["lists"] <= expected["lists"] * 2
+    return current == expected
+
+
+async def _build_options(
+    conn: AsyncConnection, method: str, column: str
+) -> Optional[Dict[str, int]]:
+    """索引构建参数，数据不足以训练 IVFFlat 时返回 None"""
+    if method == "hnsw":
+        return {
+            "m": settings.HNSW_M,
+            "ef_construction": settings.HNSW_EF_CONSTRUCTION,
+        }
+    result = await conn.execute(
+        text(f"SELECT count(*) FROM document_chunks WHERE {column} IS NOT NULL")
+    )
+    rows = result.scalar() or 0
+    if rows < settings.IVFFLAT_MIN_ROWS:
+        return None
+    return {"lists": ivfflat_lists(rows)}
+
+
+def _parse_reloptions(reloptions: Optional[Sequence[str]]) -> Dict[str, int]:
+    options = {}
+    for item in reloptions or []:
+        key, _, value = item.partition("=")
+        try:
+            options[key] = int(value)
+        except ValueError:
+            options[key] = -1
+    return options
+
+
+async def _pgvector_version(conn: AsyncConnection) -> Tuple[int, ...]:
+    """已安装的 pgvector 版本（主版本, 次版本）"""
+    result = await conn.execute(
+        text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    )
+    version = result.scalar()
+    if not version:
+        return (0, 0)
+    try:
+        return tuple(int(p) for p in version.split(".")[:2])
+    except ValueError:
+        return (0, 0)
+
+
+async def ensure_vector_storage(engine: AsyncEngine) -> None:
+    """按配置创建压缩向量列，删除不再使用的压缩列（数据由 backfill_vector_storage 回填）
+
+    ALTER TABLE 需要 ACCESS EXCLUSIVE 锁，只在列确实需要增删时执行，并放在单独的短事务中。
+    """
+    storage = compact_storage()
+    async with engine.begin() as conn:
+        if storage is not None and await _pgvector_version(conn) < (0, 7):
+            raise RuntimeError(
+                f"VECTOR_STORAGE_MODE={settings.VECTOR_STORAGE_MODE} 需要 pgvector 0.7.0 及以上版本"
+            )
+
+        result = await conn.execute(
+            text(
+                """
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = current_schema()
+                  AND table_name = 'document_chunks'
+                  AND column_name = ANY(:columns)
+                """
+            ),
+            {"columns": [mode.column for mode in STORAGE_MODES.values()]},
+        )
+        existing = set(result.scalars().all())
+
+        for other in STORAGE_MODES.values():
+            if other is not storage and other.column in existing:
+                await conn.execute(text(f"ALTER TABLE document_chunks DROP COLUMN {other.column}"))
+                logger.info("已删除不再使用的向量压缩列：%s", other.column)
+
+        if storage is not None and storage.column not in existing:
+            await conn.execute(
+                text(f"ALTER TABLE document_chunks ADD COLUMN {storage.column} {storage.sql_type}")
+            )
+
+
+async def _storage_incomplete(engine: AsyncEngine, storage: CompactStorage) -> bool:
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            text(
+                f"""
+                SELECT EXISTS (
+                    SELECT 1 FROM document_chunks
+                    WHERE {storage.column} IS NULL AND embedding IS NOT NULL
+                )
+                """
+            )
+        )
+        return bool(result.scalar())
+
+
+async def backfill_vector_storage(engine: AsyncEngine) -> int:
+    """分批回填压缩列，每批单独提交；全部回填后检索才改用压缩列
+
+    其他进程同时回填时，被它们锁定的行会被跳过，因此结束前确认没有遗漏，有则继续回填。
+    """
+    global _storage_ready
+
+    storage = compact_storage()
+    if storage is None:
+        return 0
+
+    total = 0
+    while True:
+        total += await update_in_batches(
+            engine,
+            f"""
+            UPDATE document_chunks
+            SET {storage.column} = {storage.from_vector("embedding")}
+            WHERE id IN (
+                SELECT id FROM document_chunks
+                WHERE id > :last_id AND {storage.column} IS NULL AND embedding IS NOT NULL
+                ORDER BY id
+                LIMIT :limit
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id
+            """,
+            STORAGE_BACKFILL_BATCH_SIZE,
+        )
+        if not await _storage_incomplete(engine, storage):
+            break
+        await asyncio.sleep(STORAGE_BACKFILL_RETRY_INTERVAL)
+
+    _storage_ready = True
+    if total:
+        logger.info("向量压缩列已回填：%s，共 %d 行", storage.column, total)
+    return total
+
+
+async def ensure_vector_index(engine: AsyncEngine) -> None:
+    """创建或重建向量索引，使其与配置和数据量一致（在事务之外执行）"""
+    global _iterative_scan_supported
+
+    method = settings.VECTOR_INDEX_TYPE.lower()
+    if method not in INDEX_METHODS and method != "none":
+        raise ValueError(f"不支持的向量索引类型: {settings.VECTOR_INDEX_TYPE}")
+
+    async with engine.connect() as conn:
+        # CREATE / DROP INDEX CONCURRENTLY 不能在事务块中执行
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        _iterative_scan_supported = await _pgvector_version(conn) >= (0, 8)
+
+        result = await conn.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": INDEX_LOCK_KEY}
+        )
+        if not result.scalar():
+            logger.info("其他进程正在维护向量索引，跳过")
+            return
+        try:
+            await _ensure_vector_index(conn, method)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INDEX_LOCK_KEY})
+
+
+async def _ensure_vector_index(conn: AsyncConnection, method: str) -> None:
+    storage = compact_storage()
+    column = storage.column if storage else "embedding"
+    opclass = storage.opclass if storage else "vector_cosine_ops"
+
+    # 删除不再使用的索引（其他索引类型或其他存储列上的索引）
+    for other_column in ["embedding"] + [m.column for m in STORAGE_MODES.values()]:
+        for other in INDEX_METHODS:
+            if (other, other_column) != (method, column):
+                await conn.execute(
+                    text(f"DROP INDEX CONCURRENTLY IF EXISTS {_index_name(other, other_column)}")
+                )
+
+    if method == "none":
+        return
+
+    name = _index_name(method, column)
+    staging = f"{name}_new"
+    # 上次重建中断留下的索引
+    await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {staging}"))
+
+    options = await _build_options(conn, method, column)
+    if options is None:
+        logger.info(
+            "向量数据不足 %d 行，暂不创建 IVFFlat 索引", settings.IVFFLAT_MIN_ROWS
+        )
+        return
+
+    result = await conn.execute(
+        text(
+            """
+            SELECT c.reloptions, i.indisvalid
+            FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relname = :name
+            """
+        ),
+        {"name": name},
+    )
+    row = result.first()
+
+    target = name
+    if row is not None:
+        if not row.indisvalid:
+            # CONCURRENTLY 构建失败留下的无效索引
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY {name}"))
+        elif options_fit(method, _parse_reloptions(row.reloptions), options):
+            return
+        else:
+            # 构建参数变化或 lists 不再适合数据量：先建新索引，旧索引在此期间继续可用
+            target = staging
+
+    with_clause = ", ".join(f"{key} = {int(value)}" for key, value in options.items())
+    await conn.execute(
+        text(
+            f"CREATE INDEX CONCURRENTLY {target} ON document_chunks "
+            f"USING {method} ({column} {opclass}) WITH ({with_clause})"
+        )
+    )
+    if target != name:
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY {name}"))
+        await conn.execute(text(f"ALTER INDEX {target} RENAME TO {name}"))
+    logger.info("向量索引已创建：%s (%s)", name, with_clause)
+
+
+async def apply_search_params(
+    db: AsyncSession,
+    limit: int,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    filtered: bool = False,
+    method: Optional[str] = None,
+) -> None:
+    """设置本次事务的检索参数（召回率 / 延迟权衡）
+
+    filtered 表示查询带有过滤条件，支持时开启迭代扫描以保证返回足够的结果。
+    method 为本次检索实际使用的索引类型，默认为 VECTOR_INDEX_TYPE。
+    """
+    method = (method or settings.VECTOR_INDEX_TYPE).lower()
+    if method == "hnsw":
+        # HNSW 最多返回 ef_search 条结果，不能小于 LIMIT
+        params = {"hnsw.ef_search": str(int(max(ef_search or settings.HNSW_EF_SEARCH, limit)))}
+        if filtered and _iterative_scan_supported:
+            params["hnsw.iterative_scan"] = "strict_order"
+    elif method == "ivfflat":
+        params = {"ivfflat.probes": str(int(probes or settings.IVFFLAT_PROBES))}
+        if filtered and _iterative_scan_supported:
+            # IVFFlat 只支持 relaxed_order，调用方需按距离重新排序
+            params["ivfflat.iterative_scan"] = "relaxed_order"
+    else:
+        return
+
+    # SET LOCAL 不支持绑定参数，使用 set_config(..., is_local => true)，一次往返设置全部参数
+    calls = ", ".join(f"set_config(:name{i}, :value{i}, true)" for i in range(len(params)))
+    bind = {}
+    for i, (name, value) in enumerate(params.items()):
+        bind[f"name{i}"] = name
+        bind[f"value{i}"] = value
+    await db.execute(text(f"SELECT {calls}"), bind)
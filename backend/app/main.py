@@ -1,10 +1,22 @@
+import asyncio
+import logging
+
 from fastapi import FastAPI, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from contextlib import asynccontextmanager
 
 from app.config import settings
-from app.db.session import init_db
+from app.core.body_limit import MULTIPART_OVERHEAD, BodySizeLimitMiddleware
+from app.core.log import RequestContextMiddleware, setup_logging
+from app.db.migrations import run_backfills
+from app.db.session import engine, init_db
+from app.core.rag_service import rag_service
+from app.core.ingestion import ingestion_pool
+from app.core.admission import llm_admission
+from app.core.answer_cache import answer_cache
+from app.core import metrics
+from app.core.log import dropped_records
 
 from scalar_fastapi import get_scalar_api_reference, Layout, Theme
 
@@ -15,6 +27,9 @@ from app.api.v1 import auth, documents, chat
 
 from app.models.user import User  # Adjust the import path as needed
 
+setup_logging()
+logger = logging.getLogger(__name__)
+
 
 # API 元数据配置 (类似 Knife4j 文档说明)
 metadata = {
@@ -66,16 +81,27 @@ metadata = {
 # 生命周期管理
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("🚀 应用启动中...")
-    print(f"📍 当前环境: {settings.ENVIRONMENT}")
+    logger.info("应用启动中，当前环境：%s", settings.ENVIRONMENT)
 
     await init_db()
 
-    print("✅ 数据库初始化完成")
+    logger.info("数据库初始化完成")
+
+    # 回填已有数据（后台分批提交，不阻塞启动）
+    backfill_task = asyncio.create_task(run_backfills(engine))
+
+    await rag_service.vector_store.start()
+
+    # 启动文档处理工作协程
+    if settings.INGESTION_WORKERS > 0:
+        ingestion_pool.start()
 
     yield
 
-    print("👋 应用关闭")
+    backfill_task.cancel()
+    await ingestion_pool.stop()
+    rag_service.shutdown()
+    logger.info("应用关闭")
 
 
 
@@ -114,6 +140,12 @@ async def scalar_docs(request: Request) -> HTMLResponse:
 
 
 
+# 请求体大小限制：在接收时计数，超出的上传不会被完整接收和写入临时文件
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_body_size=settings.MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+)
+
 # CORS 配置
 app.add_middleware(
     CORSMiddleware,
@@ -122,6 +154,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 请求 ID 与日志采样（最外层，CORS 响应同样带上 X-Request-ID）
+app.add_middleware(RequestContextMiddleware)
 
 
 
@@ -145,6 +179,75 @@ async def health_check():
     }
 
 
+@app.get("/api/v1/cache-stats", tags=["系统"])
+async def cache_stats():
+    """缓存命中统计（当前进程）"""
+    return {
+        "embedding_cache": rag_service.embedding_cache.stats(),
+        "query_embedding_cache": rag_service.query_embedding_cache.stats(),
+    }
+
+
+@app.get("/api/v1/admission-stats", tags=["系统"])
+async def admission_stats():
+    """LLM 生成准入统计：并发、排队深度、等待时间、拒绝次数（当前进程）"""
+    return llm_admission.stats()
+
+
+def _cache_stats() -> dict:
+    return {
+        "embedding": rag_service.embedding_cache.stats(),
+        "query_embedding": rag_service.query_embedding_cache.stats(),
+        "retrieval": rag_service.retrieval_cache.stats(),
+        "answer": answer_cache.stats(),
+    }
+
+
+# 已有的进程内统计在抓取时读取
+metrics.CallbackMetric(
+    "rag_cache_hits",
+    "缓存命中次数",
+    "counter",
+    lambda: [({"cache": name}, stats["hits"]) for name, stats in _cache_stats().items()],
+)
+metrics.CallbackMetric(
+    "rag_cache_misses",
+    "缓存未命中次数",
+    "counter",
+    lambda: [({"cache": name}, stats["misses"]) for name, stats in _cache_stats().items()],
+)
+metrics.CallbackMetric(
+    "rag_cache_entries",
+    "缓存条目数",
+    "gauge",
+    lambda: [({"cache": name}, stats["size"]) for name, stats in _cache_stats().items() if "size" in stats],
+)
+metrics.CallbackMetric(
+    "rag_llm_active", "正在进行的 LLM 生成数", "gauge", lambda: [({}, llm_admission.active)]
+)
+metrics.CallbackMetric(
+    "rag_llm_queued", "排队等待生成名额的请求数", "gauge", lambda: [({}, llm_admission.queued)]
+)
+metrics.CallbackMetric(
+    "rag_llm_admitted", "获准生成的请求数", "counter", lambda: [({}, llm_admission.admitted)]
+)
+metrics.CallbackMetric(
+    "rag_llm_rejected",
+    "未获准入的请求数",
+    "counter",
+    lambda: [({"reason": reason}, count) for reason, count in llm_admission.rejected.items()],
+)
+metrics.CallbackMetric(
+    "rag_log_dropped_records", "日志队列满被丢弃的记录数", "counter", lambda: [({}, dropped_records())]
+)
+
+
+@app.get("/metrics", tags=["系统"], response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus 指标（文本格式，当前进程）"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/api/v1/test-db", tags=["系统"])
 async def test_database():
     """测试数据库连接"""
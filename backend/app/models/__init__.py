@@ -1,5 +1,18 @@
 from app.models.user import User
-from app.models.document import Document, DocumentChunk
+from app.models.document import CorpusState, Document, DocumentChunk, DocumentSection, IngestionJob
 from app.models.chat import ChatSession, ChatMessage
+from app.models.cache import EmbeddingCacheEntry
+from app.models.projection import VectorProjection
 
-__all__ = ["User", "Document", "DocumentChunk", "ChatSession", "ChatMessage"]
\ No newline at end of file
+__all__ = [
+    "User",
+    "Document",
+    "DocumentChunk",
+    "DocumentSection",
+    "IngestionJob",
+    "CorpusState",
+    "ChatSession",
+    "ChatMessage",
+    "EmbeddingCacheEntry",
+    "VectorProjection",
+]
\ No newline at end of file
@@ -0,0 +1,17 @@
+# app/models/cache.py
+from datetime import datetime
+from sqlalchemy import String, DateTime
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql import func
+from pgvector.sqlalchemy import Vector
+from app.db.session import Base
+
+
+class EmbeddingCacheEntry(Base):
+    """片段向量缓存表，键为 (Embedding 模型, 文本 SHA-256)"""
+    __tablename__ = "embedding_cache"
+
+    model: Mapped[str] = mapped_column(String(100), primary_key=True)
+    text_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    embedding = mapped_column(Vector(1536), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
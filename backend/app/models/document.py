@@ -2,7 +2,8 @@
 from __future__ import annotations  # 避免循环导入
 from datetime import datetime
 from typing import List, Optional
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, JSON
+from sqlalchemy import BigInteger, Column, Computed, Integer, String, DateTime, Text, ForeignKey, JSON
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 from pgvector.sqlalchemy import Vector
@@ -22,6 +23,7 @@ class Document(Base):
     file_path: Mapped[str] = mapped_column(String(500), nullable=False)
     file_size: Mapped[int] = mapped_column(Integer, nullable=False)
     file_type: Mapped[str] = mapped_column(String(50), nullable=False)
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, index=True)  # SHA-256
     status: Mapped[str] = mapped_column(String(50), default="processing")
     error_message: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
 
@@ -38,18 +40,102 @@ class Document(Base):
         cascade="all, delete-orphan"
     )
 
+    # 关联父级段落
+    sections: Mapped[List["DocumentSection"]] = relationship(
+        "DocumentSection",
+        back_populates="document",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    # 关联处理任务
+    jobs: Mapped[List["IngestionJob"]] = relationship(
+        "IngestionJob",
+        back_populates="document",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
 
 class DocumentChunk(Base):
     """文档块表（向量存储）"""
     __tablename__ = "document_chunks"
 
     id = Column(Integer, primary_key=True, index=True)
-    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False, index=True)
+    # 冗余自 documents.owner_id，检索时按用户过滤无需关联 documents
+    owner_id = Column(Integer, nullable=True, index=True)
+    # 所属父级段落（检索命中片段后返回整个段落作为上下文）
+    section_id = Column(
+        Integer, ForeignKey("document_sections.id", ondelete="SET NULL"), nullable=True, index=True
+    )
     content = Column(Text, nullable=False)
+    content_hash = Column(String(64), nullable=True)  # SHA-256，用于增量重建索引
     embedding = Column(Vector(1536), nullable=True)
     chunk_index = Column(Integer, nullable=False)
     chunk_metadata = Column(JSON, nullable=True)
+    # 关键词检索：应用层分词后的 tsvector 文本，由生成列转换为 tsvector（GIN 索引）
+    lexical_terms = Column(Text, nullable=True)
+    search_vector = Column(
+        TSVECTOR,
+        Computed("CAST(coalesce(lexical_terms, '') AS tsvector)", persisted=True),
+    )
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # 关联文档
-    document = relationship("Document", back_populates="chunks")
\ No newline at end of file
+    document = relationship("Document", back_populates="chunks")
+
+
+class DocumentSection(Base):
+    """父级段落表：按页 / 标题切分的较大段落，不做向量化，只作为检索结果的上下文"""
+    __tablename__ = "document_sections"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    document_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    section_index: Mapped[int] = mapped_column(Integer, nullable=False)
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    section_metadata: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+    # 关联文档
+    document: Mapped["Document"] = relationship("Document", back_populates="sections")
+
+
+class IngestionJob(Base):
+    """文档处理任务表（后台队列）"""
+    __tablename__ = "ingestion_jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    document_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    kind: Mapped[str] = mapped_column(String(20), default="ingest")  # ingest / reindex
+    status: Mapped[str] = mapped_column(String(50), default="pending", index=True)  # pending / running / completed / failed
+    stage: Mapped[str] = mapped_column(String(50), default="queued")  # queued / loading / splitting / embedding / storing / completed
+    total_chunks: Mapped[int] = mapped_column(Integer, default=0)
+    processed_chunks: Mapped[int] = mapped_column(Integer, default=0)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    worker_id: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+    error_message: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    next_attempt_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)  # 失败重试的最早时间
+
+    # 关联文档
+    document: Mapped["Document"] = relationship("Document", back_populates="jobs")
+
+
+class CorpusState(Base):
+    """语料版本（单行）：片段增删改后递增，检索缓存以此判断是否过期"""
+    __tablename__ = "corpus_state"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    generation: Mapped[int] = mapped_column(BigInteger, default=0, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
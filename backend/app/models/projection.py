@@ -0,0 +1,31 @@
+# app/models/projection.py
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import Boolean, DateTime, Float, Integer, LargeBinary, String
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql import func
+from app.db.session import Base
+
+
+class VectorProjection(Base):
+    """向量降维投影（由 python -m app.core.projection 拟合）"""
+    __tablename__ = "vector_projections"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    method: Mapped[str] = mapped_column(String(20), default="pca")
+    source_dim: Mapped[int] = mapped_column(Integer)
+    dim: Mapped[int] = mapped_column(Integer)
+    sample_size: Mapped[int] = mapped_column(Integer)
+    explained_variance: Mapped[float] = mapped_column(Float)  # 保留的方差占比
+    recall: Mapped[Optional[float]] = mapped_column(Float, nullable=True)  # 两阶段检索 recall@k
+    recall_k: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # float32 数组的原始字节：均值 (source_dim,)、投影矩阵 (dim, source_dim)
+    mean: Mapped[bytes] = mapped_column(LargeBinary)
+    components: Mapped[bytes] = mapped_column(LargeBinary)
+    is_active: Mapped[bool] = mapped_column(Boolean, default=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+    @property
+    def column(self) -> str:
+        """document_chunks 上保存降维向量的列"""
+        return f"embedding_reduced_{self.id}"
@@ -2,6 +2,7 @@ from app.schemas.document import (
     DocumentUploadResponse,
     DocumentListResponse,
     DocumentDetailResponse,
+    IngestionJobResponse,
     ChunkSearchRequest,
     ChunkSearchResult,
     ChatMessage,
@@ -31,6 +32,7 @@ __all__ = [
     "DocumentUploadResponse",
     "DocumentListResponse",
     "DocumentDetailResponse",
+    "IngestionJobResponse",
     "ChunkSearchRequest",
     "ChunkSearchResult",
     "ChatMessage",
@@ -49,6 +49,23 @@ class ChatRequest(BaseModel):
     top_k: int = Field(default=3, ge=1, le=20) 
     stream: bool = Field(default=True) # 可选，默认检索 top 3
     session_id: Optional[int] = None  # ⚠️ 添加这行
+    # ANN 检索参数：越大召回越高、延迟越高（不传则使用配置默认值）
+    ef_search: Optional[int] = Field(default=None, ge=1, le=1000)
+    probes: Optional[int] = Field(default=None, ge=1, le=1000)
+    # 是否启用向量 + 关键词混合检索（不传则使用配置默认值）
+    hybrid: Optional[bool] = None
+    # MMR 多样性重排（不传则使用配置默认值）
+    mmr: Optional[bool] = None
+    mmr_lambda: Optional[float] = Field(default=None, ge=0, le=1)
+    mmr_candidates: Optional[int] = Field(default=None, ge=1, le=200)
+    # 只在指定文档中检索
+    document_ids: Optional[List[int]] = Field(default=None, min_length=1, max_length=100)
+    # 每个检索结果前后各扩展的相邻片段数（不传则使用配置默认值）
+    neighbours: Optional[int] = Field(default=None, ge=0, le=5)
+    # 返回检索结果所属的父级段落（不传则使用配置默认值）
+    parents: Optional[bool] = None
+    # 是否使用语义答案缓存（重新生成时传 false）
+    use_cache: bool = True
 
 class ChatSessionUpdate(BaseModel):
     """更新对话"""
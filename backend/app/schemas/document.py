@@ -11,6 +11,7 @@ class DocumentUploadResponse(BaseModel):
     file_type: str
     status: str
     message: str
+    job_id: Optional[int] = None
 
 
 class DocumentListResponse(BaseModel):
@@ -39,6 +40,25 @@ class DocumentDetailResponse(BaseModel):
     chunk_count: int = 0
 
 
+class IngestionJobResponse(BaseModel):
+    """文档处理任务状态"""
+    id: int
+    document_id: int
+    status: str
+    stage: str
+    total_chunks: int = 0
+    processed_chunks: int = 0
+    progress: float = 0.0
+    elapsed_seconds: Optional[float] = None
+    chunks_per_second: Optional[float] = None
+    attempts: int = 0
+    error_message: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    next_attempt_at: Optional[datetime] = None  # 失败后等待重试时的下次处理时间
+
+
 class ChunkSearchRequest(BaseModel):
     """向量搜索请求"""
     query: str = Field(..., min_length=1, description="搜索查询")
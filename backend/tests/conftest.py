@@ -0,0 +1,5 @@
+import os
+
+# app.config 在导入时读取配置；纯函数测试不连接数据库，也不调用 DashScope
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://postgres@localhost/rag_test")
+os.environ.setdefault("DASHSCOPE_API_KEY", "test")
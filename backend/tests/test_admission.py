@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+
+from app.core import metrics
+from app.core.admission import AdmissionController, AdmissionRejected
+
+
+def _controller(**kwargs):
+    options = dict(limit=1, max_queue=10, max_wait=5.0, max_queued_per_user=2)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_admits_immediately_under_limit():
+    async def run():
+        controller = _controller(limit=2)
+        first = await controller.acquire("a")
+        second = await controller.acquire("b")
+        assert controller.active == 2 and controller.queued == 0
+        first.release()
+        first.release()  # 重复释放无效
+        assert controller.active == 1
+        second.release()
+        assert controller.active == 0
+
+    asyncio.run(run())
+
+
+def test_user_queue_full_rejected_with_429():
+    async def run():
+        controller = _controller(max_queued_per_user=1)
+        slot = await controller.acquire("a")
+        waiting = asyncio.ensure_future(controller.acquire("a"))
+        await _settle()
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await controller.acquire("a")
+        assert excinfo.value.status_code == 429
+        assert controller.rejected["user_queue_full"] == 1
+        # 其他用户仍可排队
+        other = asyncio.ensure_future(controller.acquire("b"))
+        await _settle()
+        assert controller.queued == 2
+        slot.release()
+        (await waiting).release()
+        (await other).release()
+        assert controller.active == 0 and controller.queued == 0
+
+    asyncio.run(run())
+
+
+def test_queue_full_rejected_with_503():
+    async def run():
+        controller = _controller(max_queue=1)
+        slot = await controller.acquire("a")
+        waiting = asyncio.ensure_future(controller.acquire("b"))
+        await _settle()
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await controller.acquire("c")
+        assert excinfo.value.status_code == 503
+        assert controller.rejected["queue_full"] == 1
+        slot.release()
+        (await waiting).release()
+
+    asyncio.run(run())
+
+
+def test_wait_timeout_rejected_with_503():
+    async def run():
+        controller = _controller(max_wait=0.01)
+        slot = await controller.acquire("a")
+        with pytest.raises(AdmissionRejected) as excinfo:
+            await controller.acquire("b")
+        assert excinfo.value.status_code == 503
+        assert controller.rejected["timeout"] == 1
+        # 超时的请求已移出队列
+        assert controller.queued == 0
+        slot.release()
+        assert controller.active == 0
+
+    asyncio.run(run())
+
+
+def test_release_round_robins_between_users():
+    async def run():
+        controller = _controller(max_queued_per_user=3)
+        order = []
+        slots = {"holder": await controller.acquire("a")}
+
+        async def request(user, n):
+            slots[f"{user}{n}"] = await controller.acquire(user)
+            order.append(f"{user}{n}")
+
+        # 用户 a 先排了 3 个请求，用户 b 之后排 1 个
+        tasks = [asyncio.ensure_future(request("a", n)) for n in range(1, 4)]
+        await _settle()
+        tasks.append(asyncio.ensure_future(request("b", 1)))
+        await _settle()
+        assert controller.queued == 4
+
+        # 每次释放当前持有的名额，下一个请求获准
+        holder = "holder"
+        for _ in range(4):
+            slots[holder].release()
+            await _settle()
+            holder = order[-1]
+        slots[holder].release()
+        await asyncio.gather(*tasks)
+
+        # b 不必等 a 的请求全部完成
+        assert order == ["a1", "b1", "a2", "a3"]
+        assert controller.active == 0 and controller.queued == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_hands_slot_back():
+    async def run():
+        controller = _controller()
+        slot = await controller.acquire("a")
+        waiting = asyncio.ensure_future(controller.acquire("b"))
+        await _settle()
+        waiting.cancel()
+        await _settle()
+        assert controller.queued == 0
+        slot.release()
+        assert controller.active == 0
+
+    asyncio.run(run())
+
+
+def test_queue_wait_observed_in_histogram():
+    def observed():
+        return sum(metrics.LLM_QUEUE_WAIT_SECONDS._default.counts)
+
+    async def run():
+        controller = _controller()
+        slot = await controller.acquire("a")
+        waiting = asyncio.ensure_future(controller.acquire("b"))
+        await asyncio.sleep(0.02)
+        slot.release()
+        (await waiting).release()
+        return controller
+
+    before = observed()
+    controller = asyncio.run(run())
+    # 无需排队的请求记为 0，排队的请求记录实际等待时间
+    assert observed() == before + 2
+    assert controller.stats()["wait_seconds_max"] >= 0.02
@@ -0,0 +1,106 @@
+from app.core import answer_cache as answer_cache_module
+from app.core.answer_cache import SemanticAnswerCache
+
+
+def _cache(**kwargs):
+    options = dict(maxsize=4, ttl=60.0, max_distance=0.1)
+    options.update(kwargs)
+    return SemanticAnswerCache(**options)
+
+
+def test_hit_within_distance_and_miss_beyond():
+    cache = _cache()
+    cache.store("kb", [1.0, 0.0], "回答", [{"source": "a.txt"}])
+
+    # 余弦距离约 0.005，命中
+    hit = cache.lookup("kb", [1.0, 0.1])
+    assert hit.answer == "回答"
+    assert hit.sources == [{"source": "a.txt"}]
+    assert hit.chunks == ["回答"]
+    assert 0.99 < hit.similarity < 1.0
+
+    # 余弦距离约 0.29，未命中
+    assert cache.lookup("kb", [1.0, 0.8]) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_namespaces_are_isolated():
+    cache = _cache()
+    cache.store("user-1", [1.0, 0.0], "一", [])
+    assert cache.lookup("user-2", [1.0, 0.0]) is None
+    cache.store("user-2", [1.0, 0.0], "二", [])
+    assert cache.lookup("user-1", [1.0, 0.0]).answer == "一"
+    assert cache.lookup("user-2", [1.0, 0.0]).answer == "二"
+
+
+def test_invalidate_and_generation_change_clear_cache():
+    cache = _cache()
+    cache.store("kb", [1.0, 0.0], "回答", [])
+    cache.invalidate()
+    assert len(cache) == 0
+    assert cache.lookup("kb", [1.0, 0.0]) is None
+
+    cache.sync_generation(1)
+    cache.store("kb", [1.0, 0.0], "回答", [])
+    # 语料版本不变时保留
+    cache.sync_generation(1)
+    assert cache.lookup("kb", [1.0, 0.0]) is not None
+    cache.sync_generation(2)
+    assert cache.lookup("kb", [1.0, 0.0]) is None
+
+
+def test_store_with_stale_generation_is_ignored():
+    cache = _cache()
+    generation = cache.generation
+    # 生成回答期间语料发生变化
+    cache.invalidate()
+    cache.store("kb", [1.0, 0.0], "旧回答", [], generation=generation)
+    assert len(cache) == 0
+    cache.store("kb", [1.0, 0.0], "新回答", [], generation=cache.generation)
+    assert cache.lookup("kb", [1.0, 0.0]).answer == "新回答"
+
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(answer_cache_module.time, "monotonic", lambda: now[0])
+    cache = _cache(maxsize=2)
+
+    cache.store("kb", [1.0, 0.0], "甲", [])
+    now[0] += 1
+    cache.store("kb", [0.0, 1.0], "乙", [])
+    now[0] += 1
+    # 访问“甲”后，“乙”成为最久未使用的条目
+    assert cache.lookup("kb", [1.0, 0.0]).answer == "甲"
+    now[0] += 1
+    cache.store("kb", [-1.0, 0.0], "丙", [])
+
+    assert len(cache) == 2
+    assert cache.lookup("kb", [0.0, 1.0]) is None
+    assert cache.lookup("kb", [1.0, 0.0]).answer == "甲"
+    assert cache.lookup("kb", [-1.0, 0.0]).answer == "丙"
+
+
+def test_expired_entries_miss_and_free_their_slot(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(answer_cache_module.time, "monotonic", lambda: now[0])
+    cache = _cache(maxsize=2, ttl=10.0)
+
+    cache.store("kb", [1.0, 0.0], "甲", [])
+    now[0] += 5
+    cache.store("kb", [0.0, 1.0], "乙", [])
+    now[0] += 6
+    assert cache.lookup("kb", [1.0, 0.0]) is None
+    assert cache.lookup("kb", [0.0, 1.0]).answer == "乙"
+
+    # 过期条目的槽位优先复用，未过期的条目保留
+    cache.store("kb", [-1.0, 0.0], "丙", [])
+    assert cache.lookup("kb", [0.0, 1.0]).answer == "乙"
+    assert cache.lookup("kb", [-1.0, 0.0]).answer == "丙"
+
+
+def test_disabled_cache_stores_nothing():
+    cache = _cache(maxsize=0)
+    cache.store("kb", [1.0, 0.0], "回答", [])
+    assert cache.lookup("kb", [1.0, 0.0]) is None
+    assert cache.stats()["hit_rate"] == 0.0
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.cache import TTLCache
+from app.core.rag_service import rag_service
+
+
+class _BlockingEmbeddings:
+    """同步阻塞的 Embedding 客户端，记录同时进行的调用数"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+
+    def embed_documents(self, texts):
+        self._call()
+        return [[float(len(t))] for t in texts]
+
+    def embed_query(self, text):
+        self._call()
+        return [float(len(text))]
+
+
+def _patch(monkeypatch, workers, delay=0.05):
+    embeddings = _BlockingEmbeddings(delay)
+    monkeypatch.setattr(rag_service, "embeddings", embeddings)
+    monkeypatch.setattr(rag_service, "_embedding_executor", ThreadPoolExecutor(workers))
+    monkeypatch.setattr(rag_service, "query_embedding_cache", TTLCache(maxsize=100, ttl=60))
+    return embeddings
+
+
+async def _ticks_while(coro):
+    """执行 coro 期间事件循环仍能调度其他协程的次数"""
+    ticks = 0
+    done = False
+
+    async def ticker():
+        nonlocal ticks
+        while not done:
+            ticks += 1
+            await asyncio.sleep(0.005)
+
+    task = asyncio.ensure_future(ticker())
+    try:
+        result = await coro
+    finally:
+        done = True
+        await task
+    return result, ticks
+
+
+def test_embedding_calls_do_not_block_event_loop(monkeypatch):
+    embeddings = _patch(monkeypatch, workers=4)
+
+    async def run():
+        return await _ticks_while(
+            asyncio.gather(*(rag_service.aembed_texts([f"文本{i}"]) for i in range(4)))
+        )
+
+    started = time.perf_counter()
+    results, ticks = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+
+    assert results == [[[3.0]]] * 4
+    assert embeddings.peak == 4
+    # 4 个各 50ms 的调用并发执行，期间事件循环持续运行
+    assert elapsed < 4 * embeddings.delay
+    assert ticks >= 5
+
+
+def test_concurrency_bounded_by_executor(monkeypatch):
+    embeddings = _patch(monkeypatch, workers=2, delay=0.02)
+
+    async def run():
+        return await asyncio.gather(*(rag_service.aembed_query(f"问题 {i}") for i in range(6)))
+
+    results = asyncio.run(run())
+    assert len(results) == 6
+    assert embeddings.calls == 6
+    assert embeddings.peak == 2
+
+
+def test_identical_queries_share_one_call(monkeypatch):
+    embeddings = _patch(monkeypatch, workers=4)
+
+    async def run():
+        # 归一化后相同的查询只请求一次
+        return await asyncio.gather(
+            rag_service.aembed_query("Hello  World"),
+            rag_service.aembed_query("hello world"),
+            rag_service.aembed_query("ＨＥＬＬＯ world"),
+        )
+
+    results = asyncio.run(run())
+    assert results[0] == results[1] == results[2]
+    assert embeddings.calls == 1
@@ -0,0 +1,56 @@
+import asyncio
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from app.core.body_limit import BodySizeLimitMiddleware
+
+
+async def _echo_app(scope, receive, send):
+    request = Request(scope, receive)
+    try:
+        body = await request.body()
+    except Exception:
+        response = JSONResponse({"detail": "bad body"}, status_code=400)
+    else:
+        response = JSONResponse({"size": len(body)})
+    await response(scope, receive, send)
+
+
+def _call(limit, chunks, content_length=None):
+    headers = []
+    if content_length is not None:
+        headers.append((b"content-length", str(content_length).encode()))
+    scope = {"type": "http", "method": "POST", "path": "/", "headers": headers}
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+    state = {"read": 0}
+    sent = []
+
+    async def receive():
+        state["read"] += 1
+        return messages[state["read"] - 1]
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(BodySizeLimitMiddleware(_echo_app, limit)(scope, receive, send))
+    return sent[0]["status"], state["read"]
+
+
+def test_within_limit_passes_through():
+    status, read = _call(10, [b"12345", b"67890"], content_length=10)
+    assert (status, read) == (200, 2)
+
+
+def test_content_length_over_limit_rejected_without_reading():
+    status, read = _call(10, [b"x" * 11], content_length=11)
+    assert (status, read) == (413, 0)
+
+
+def test_streamed_body_stops_at_limit():
+    # 没有 Content-Length：超过上限的那一块之后不再接收
+    status, read = _call(10, [b"x" * 6, b"x" * 6, b"x" * 6, b"x" * 6])
+    assert (status, read) == (413, 2)
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import os
+import struct
+
+import pytest
+
+from app.db.bulk import (
+    _COPY_HEADER,
+    _COPY_TRAILER,
+    _copy_stream,
+    _encode_row,
+    encode_int4,
+    encode_int8,
+    encode_json,
+    encode_text,
+    encode_vector,
+)
+
+
+def test_integers_are_big_endian():
+    assert encode_int4(1) == b"\x00\x00\x00\x01"
+    assert encode_int4(-2) == b"\xff\xff\xff\xfe"
+    assert encode_int8(2**40) == b"\x00\x00\x01\x00\x00\x00\x00\x00"
+
+
+def test_text_and_json_are_utf8():
+    assert encode_text("退款") == "退款".encode("utf-8")
+    data = encode_json({"source": "手册.pdf", "page": 3})
+    assert json.loads(data.decode("utf-8")) == {"source": "手册.pdf", "page": 3}
+    assert "手册".encode("utf-8") in data  # 不转义为 \u
+
+
+def test_vector_header_and_float4_payload():
+    data = encode_vector([1.0, -0.5, 0.25])
+    assert struct.unpack("!HH", data[:4]) == (3, 0)
+    assert struct.unpack("!3f", data[4:]) == (1.0, -0.5, 0.25)
+    assert data[4:8] == b"\x3f\x80\x00\x00"
+
+
+def test_row_encoding_with_null():
+    row = _encode_row([encode_int4(7), None, encode_text("ab")])
+    assert row == (
+        struct.pack("!h", 3)
+        + struct.pack("!i", 4) + b"\x00\x00\x00\x07"
+        + struct.pack("!i", -1)
+        + struct.pack("!i", 2) + b"ab"
+    )
+
+
+def test_copy_stream_framing():
+    async def collect():
+        return [part async for part in _copy_stream([[encode_int4(1)], [None]])]
+
+    parts = asyncio.run(collect())
+    assert parts[0] == _COPY_HEADER
+    assert parts[0].startswith(b"PGCOPY\n\xff\r\n\x00") and len(parts[0]) == 19
+    assert parts[1:-1] == [_encode_row([encode_int4(1)]), _encode_row([None])]
+    assert parts[-1] == _COPY_TRAILER == b"\xff\xff"
+
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="未设置 TEST_DATABASE_URL")
+def test_copy_rows_round_trip():
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    from app.db.bulk import copy_rows
+
+    async def run():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(
+                    text("CREATE TEMP TABLE t (a int4, b int8, s text, j json, v vector(3))")
+                )
+                await copy_rows(
+                    AsyncSession(bind=conn),
+                    "t",
+                    ["a", "b", "s", "j", "v"],
+                    [
+                        [
+                            encode_int4(-7),
+                            encode_int8(2**40),
+                            encode_text("退款"),
+                            encode_json({"page": 3}),
+                            encode_vector([1.0, -0.5, 0.25]),
+                        ],
+                        [encode_int4(1), None, None, None, None],
+                    ],
+                )
+                result = await conn.execute(
+                    text("SELECT a, b, s, j::text AS j, v::text AS v FROM t ORDER BY a")
+                )
+                rows = [tuple(row) for row in result]
+                await conn.rollback()
+                return rows
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(run()) == [
+        (-7, 2**40, "退款", '{"page": 3}', "[1,-0.5,0.25]"),
+        (1, None, None, None, None),
+    ]
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="未设置 TEST_DATABASE_URL")
+def test_copy_rows_rolls_back_with_session():
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    from app.db.bulk import copy_rows
+
+    async def run():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(text("CREATE TABLE IF NOT EXISTS copy_rollback_test (a int4)"))
+                await conn.execute(text("TRUNCATE copy_rollback_test"))
+                await conn.commit()
+            async with AsyncSession(engine) as db:
+                # COPY 是会话中的第一条语句
+                await copy_rows(db, "copy_rollback_test", ["a"], [[encode_int4(1)]])
+                await db.rollback()
+            async with engine.connect() as conn:
+                count = (await conn.execute(text("SELECT count(*) FROM copy_rollback_test"))).scalar()
+                await conn.execute(text("DROP TABLE copy_rollback_test"))
+                await conn.commit()
+            return count
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(run()) == 0
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from app.core.cache import TTLCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("app.core.cache.time.monotonic", lambda: now[0])
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # a 变为最近使用
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    now[0] = 11
+    assert cache.get("a") is None
+    assert len(cache) == 1  # 过期的 a 已删除，c 仍占位直到被读取
+
+
+def test_concurrent_misses_load_once():
+    async def main():
+        cache = TTLCache(maxsize=10, ttl=60)
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "value"
+
+        results = await asyncio.gather(*(cache.get_or_load("k", loader) for _ in range(5)))
+        assert results == ["value"] * 5
+        assert calls == 1
+        assert await cache.get_or_load("k", loader) == "value"
+        return cache
+
+    cache = run(main())
+    # 等待进行中的加载计为未命中，不计为命中
+    assert (cache.hits, cache.misses, cache.coalesced) == (1, 5, 4)
+
+
+def test_cancelled_loader_does_not_fail_waiters():
+    async def main():
+        cache = TTLCache(maxsize=10, ttl=60)
+        started = asyncio.Event()
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            started.set()
+            await asyncio.sleep(0.05)
+            return calls
+
+        owner = asyncio.create_task(cache.get_or_load("k", loader))
+        await started.wait()
+        waiters = [asyncio.create_task(cache.get_or_load("k", loader)) for _ in range(3)]
+        await asyncio.sleep(0)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        results = await asyncio.gather(*waiters)
+        # 其中一个等待者重新加载，其余等待者共享结果
+        assert results == [2, 2, 2]
+        assert calls == 2
+
+    run(main())
+
+
+def test_loader_error_is_shared_and_not_cached():
+    async def main():
+        cache = TTLCache(maxsize=10, ttl=60)
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(
+            *(cache.get_or_load("k", failing) for _ in range(3)), return_exceptions=True
+        )
+        assert all(isinstance(r, ValueError) for r in results)
+
+        async def ok():
+            return 1
+
+        assert await cache.get_or_load("k", ok) == 1
+
+    run(main())
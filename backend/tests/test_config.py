@@ -0,0 +1,27 @@
+import logging
+
+from app.config import Settings, _warn_deprecated_settings
+
+
+def test_max_context_length_is_deprecated_alias(monkeypatch, caplog):
+    monkeypatch.delenv("MAX_CONTEXT_TOKENS", raising=False)
+    monkeypatch.setenv("MAX_CONTEXT_LENGTH", "3000")
+
+    with caplog.at_level(logging.WARNING, logger="app.config"):
+        _warn_deprecated_settings()
+
+    assert Settings().MAX_CONTEXT_TOKENS == 3000
+    assert "MAX_CONTEXT_LENGTH" in caplog.text
+
+
+def test_new_name_takes_precedence(monkeypatch):
+    monkeypatch.setenv("MAX_CONTEXT_LENGTH", "3000")
+    monkeypatch.setenv("MAX_CONTEXT_TOKENS", "1500")
+    assert Settings().MAX_CONTEXT_TOKENS == 1500
+
+
+def test_no_warning_without_old_name(monkeypatch, caplog):
+    monkeypatch.delenv("MAX_CONTEXT_LENGTH", raising=False)
+    with caplog.at_level(logging.WARNING, logger="app.config"):
+        _warn_deprecated_settings()
+    assert "MAX_CONTEXT_LENGTH" not in caplog.text
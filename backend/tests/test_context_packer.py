@@ -0,0 +1,75 @@
+import random
+
+from app.core.context_packer import (
+    MIN_OVERLAP,
+    count_tokens,
+    overlap_length,
+    pack_contexts,
+    token_length,
+)
+
+WORDS = ["退款", "流程", "订单", "error", "E1024", "配置", "服务", "，", "。", "timeout", "用户"]
+
+
+def _text(rng, n):
+    return "".join(rng.choice(WORDS) for _ in range(n))
+
+
+def _split_with_overlap(text, size, overlap):
+    chunks, start = [], 0
+    while start < len(text):
+        chunks.append(text[start:start + size])
+        if start + size >= len(text):
+            break
+        start += size - overlap
+    return chunks
+
+
+def test_overlap_length():
+    shared = "共享的重叠内容至少十个字"
+    assert overlap_length("前一个片段" + shared, shared + "后一个片段") == len(shared)
+    # 短于 MIN_OVERLAP 的相同部分不算重叠
+    assert overlap_length("abcdefgh", "fgh123") == 0
+    assert overlap_length("x" * MIN_OVERLAP, "y" * 20) == 0
+
+
+def test_budget_never_exceeded():
+    rng = random.Random(0)
+    for _ in range(200):
+        contexts = [
+            {
+                "content": _text(rng, rng.randint(1, 60)),
+                "score": rng.random(),
+                "document_id": rng.randint(1, 3),
+                "chunk_index": rng.randint(0, 6),
+            }
+            for _ in range(rng.randint(1, 12))
+        ]
+        budget = rng.randint(0, 300)
+        packed = pack_contexts(contexts, budget)
+        assert packed.tokens <= budget
+        assert token_length(packed.text) <= budget
+
+
+def test_adjacent_chunks_keep_overlap_once():
+    rng = random.Random(1)
+    text = _text(rng, 120)
+    chunks = _split_with_overlap(text, 80, 20)
+    contexts = [
+        {"content": chunk, "score": 1.0 - i * 0.1, "document_id": 1, "chunk_index": i}
+        for i, chunk in enumerate(chunks)
+    ]
+    packed = pack_contexts(contexts, 10_000)
+    assert packed.text.replace("\n\n", "") == text
+    assert packed.overlap_chars == 20 * (len(chunks) - 1)
+    assert packed.skipped == 0
+
+
+def test_skips_chunks_that_do_not_fit():
+    contexts = [
+        {"content": "高相关" * 50, "score": 0.9, "document_id": 1, "chunk_index": 0},
+        {"content": "低相关片段", "score": 0.5, "document_id": 2, "chunk_index": 0},
+    ]
+    packed = pack_contexts(contexts, count_tokens("低相关片段"))
+    assert packed.text == "低相关片段"
+    assert packed.skipped == 1
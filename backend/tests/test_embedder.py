@@ -0,0 +1,111 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from requests.exceptions import HTTPError
+
+from app.core.embedder import AdaptiveBatchEmbedder, is_throttled
+
+
+def _throttle_error():
+    return HTTPError("HTTP error occurred: status_code: 429", response=SimpleNamespace(status_code=429))
+
+
+def _embedder(embed_batch, **kwargs):
+    options = dict(
+        max_batch_size=16,
+        min_batch_size=2,
+        max_concurrency=8,
+        target_latency=10.0,
+        max_retries=3,
+    )
+    options.update(kwargs)
+    return AdaptiveBatchEmbedder(embed_batch, **options)
+
+
+def test_is_throttled_uses_status_code_only():
+    assert is_throttled(_throttle_error())
+    assert not is_throttled(HTTPError("status_code: 500", response=SimpleNamespace(status_code=500)))
+    # 消息中包含 429（例如文本长度、请求 id）不算限流
+    assert not is_throttled(ValueError("input length 429 exceeds limit"))
+
+
+def test_throttling_shrinks_concurrency_and_batch_size(monkeypatch):
+    monkeypatch.setattr(asyncio, "sleep", _no_sleep)
+    state = {"calls": 0, "after_throttle": None, "sizes": []}
+
+    async def embed_batch(texts):
+        state["calls"] += 1
+        await _no_sleep(0)
+        # 前 4 个请求被限流
+        if state["calls"] <= 4:
+            raise _throttle_error()
+        if state["after_throttle"] is None:
+            state["after_throttle"] = (embedder.concurrency, embedder.batch_size)
+        state["sizes"].append(len(texts))
+        return [[float(len(t))] for t in texts]
+
+    embedder = _embedder(embed_batch)
+    texts = [str(i) for i in range(100)]
+    concurrency, batch_size = embedder.concurrency, embedder.batch_size
+
+    result = asyncio.run(embedder.embed(texts))
+
+    assert result == [[float(len(t))] for t in texts]
+    assert embedder.stats()["throttled"] == 4
+    throttled_concurrency, throttled_batch_size = state["after_throttle"]
+    assert throttled_concurrency < concurrency
+    assert throttled_batch_size < batch_size
+    # 限流后新发出的批次变小
+    assert min(state["sizes"]) < batch_size
+
+
+def test_throttling_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(asyncio, "sleep", _no_sleep)
+
+    async def embed_batch(texts):
+        raise _throttle_error()
+
+    embedder = _embedder(embed_batch, max_retries=2)
+    with pytest.raises(HTTPError):
+        asyncio.run(embedder.embed(["a", "b"]))
+    # 重试 2 次：16 → 8 → 4
+    assert embedder.stats()["throttled"] == 2
+    assert embedder.stats()["concurrency"] == 1
+    assert embedder.stats()["batch_size"] == 4
+
+
+def test_other_errors_are_not_retried():
+    calls = []
+
+    async def embed_batch(texts):
+        calls.append(texts)
+        raise HTTPError("status_code: 500", response=SimpleNamespace(status_code=500))
+
+    with pytest.raises(HTTPError):
+        asyncio.run(_embedder(embed_batch, max_concurrency=1).embed(["a"]))
+    assert len(calls) == 1
+
+
+def test_dashscope_client_does_not_retry_throttling():
+    from app.core.rag_service import rag_service
+
+    calls = []
+
+    def call(**kwargs):
+        calls.append(kwargs["input"])
+        return SimpleNamespace(status_code=429, code="Throttling.RateQuota", message="rate limited")
+
+    embeddings = rag_service.embeddings.model_copy(update={"client": SimpleNamespace(call=call)})
+    with pytest.raises(HTTPError) as excinfo:
+        embeddings.embed_documents(["a", "b"])
+    # 限流错误直接交给 AdaptiveBatchEmbedder，客户端不自行重试
+    assert len(calls) == 1
+    assert is_throttled(excinfo.value)
+
+
+_real_sleep = asyncio.sleep
+
+
+async def _no_sleep(delay, *args, **kwargs):
+    await _real_sleep(0)
@@ -0,0 +1,109 @@
+import asyncio
+import os
+
+import pytest
+
+from app.core.embedding_cache import EmbeddingCache, text_hash
+
+
+class _MemoryCache(EmbeddingCache):
+    """把 embedding_cache 表换成进程内字典（键同样是 (模型, 文本哈希)）"""
+
+    def __init__(self, model, store):
+        super().__init__(model)
+        self.store = store
+
+    async def get_many(self, db, hashes):
+        return {h: self.store[(self.model, h)] for h in hashes if (self.model, h) in self.store}
+
+    async def put_many(self, db, items):
+        for h, embedding in items.items():
+            self.store.setdefault((self.model, h), embedding)
+
+
+class _Embedder:
+    def __init__(self):
+        self.requests = []
+
+    async def __call__(self, texts):
+        self.requests.append(list(texts))
+        return [[float(len(t)), float(len(self.requests))] for t in texts]
+
+
+def test_text_hash_is_sha256_hex():
+    assert text_hash("abc") == "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"
+
+
+def test_only_misses_are_embedded_and_order_is_kept():
+    store = {}
+    cache = _MemoryCache("text-embedding-v2", store)
+    embed = _Embedder()
+
+    first = asyncio.run(cache.embed(None, ["甲", "乙乙", "甲"], embed))
+    # 同一批中的重复文本只请求一次
+    assert embed.requests == [["甲", "乙乙"]]
+    assert first == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert (cache.hits, cache.misses) == (0, 3)
+
+    second = asyncio.run(cache.embed(None, ["丙丙丙", "乙乙", "甲"], embed))
+    assert embed.requests[1:] == [["丙丙丙"]]
+    # 命中的向量来自第一次请求，按输入顺序合并
+    assert second == [[3.0, 2.0], [2.0, 1.0], [1.0, 1.0]]
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert cache.stats()["hit_rate"] == 2 / 6
+
+
+def test_all_hits_skip_the_api():
+    store = {}
+    cache = _MemoryCache("text-embedding-v2", store)
+    embed = _Embedder()
+    asyncio.run(cache.embed(None, ["a", "b"], embed))
+    asyncio.run(cache.embed(None, ["b", "a"], embed))
+    assert len(embed.requests) == 1
+
+
+def test_entries_are_scoped_by_model():
+    store = {}
+    embed = _Embedder()
+    asyncio.run(_MemoryCache("text-embedding-v2", store).embed(None, ["a"], embed))
+    other = _MemoryCache("text-embedding-v3", store)
+    asyncio.run(other.embed(None, ["a"], embed))
+    # 换了模型的向量不能复用
+    assert len(embed.requests) == 2
+    assert other.stats() == {"model": "text-embedding-v3", "hits": 0, "misses": 1, "hit_rate": 0.0}
+
+
+# 以下测试需要数据库：TEST_DATABASE_URL 指向可写的测试库，全部操作在事务中回滚
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="未设置 TEST_DATABASE_URL")
+def test_cache_table_round_trip():
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    from app.db.session import Base
+
+    vector = [0.5] * 1536
+
+    async def run():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        try:
+            async with engine.connect() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                db = AsyncSession(bind=conn)
+                cache = EmbeddingCache("test-model")
+                key = text_hash("缓存测试")
+                await cache.put_many(db, {key: vector})
+                # 重复写入同一个键不报错
+                await cache.put_many(db, {key: vector})
+                found = await cache.get_many(db, [key, text_hash("不存在")])
+                missing_model = await EmbeddingCache("other-model").get_many(db, [key])
+                await conn.rollback()
+                return found, missing_model, key
+        finally:
+            await engine.dispose()
+
+    found, missing_model, key = asyncio.run(run())
+    assert list(found) == [key]
+    assert found[key] == vector
+    assert missing_model == {}
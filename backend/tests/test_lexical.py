@@ -0,0 +1,56 @@
+from app.core.lexical import _quote, to_tsquery_text, to_tsvector_text, tokenize
+
+
+def test_tokenize_cjk_bigrams_and_words():
+    assert tokenize("检索增强") == ["检索", "索增", "增强"]
+    assert tokenize("字") == ["字"]
+    assert tokenize("产品编号 AB-0003") == ["产品", "品编", "编号", "ab-0003", "ab", "0003"]
+
+
+def test_tokenize_normalizes_full_width():
+    assert tokenize("ＡＢＣ１２３") == ["abc123"]
+
+
+def test_tokenize_drops_overlong_tokens():
+    assert tokenize("x" * 65) == []
+
+
+def test_tsvector_positions_follow_token_order():
+    assert to_tsvector_text("检索增强 检索") == "'检索':1,4 '索增':2 '增强':3"
+
+
+def test_quote_escapes_quotes_and_backslashes():
+    assert _quote("it's") == "'it''s'"
+    assert _quote("a\\b") == "'a\\\\b'"
+
+
+def test_query_pairs_adjacent_bigrams_as_phrases():
+    assert to_tsquery_text("检索增强") == "('检索' <-> '索增') | ('索增' <-> '增强')"
+
+
+def test_query_drops_stop_bigrams():
+    assert to_tsquery_text("如何退款") == "'退款'"
+    assert to_tsquery_text("我的订单在哪里") == "'订单'"
+    assert to_tsquery_text("什么是RAG？") == "'rag'"
+    assert to_tsquery_text("what is the API") == "'api'"
+
+
+def test_query_keeps_identifiers_whole():
+    assert to_tsquery_text("错误码 E1001") == "('错误' <-> '误码') | 'e1001'"
+    assert to_tsquery_text("AB-0003") == "'ab-0003'"
+
+
+def test_query_uses_single_characters_only_as_fallback():
+    assert to_tsquery_text("第5章 概述") == "'概述'"
+    assert to_tsquery_text("第5章") == "'第' | '5' | '章'"
+
+
+def test_query_without_terms_is_empty():
+    assert to_tsquery_text("的") == ""
+    assert to_tsquery_text("？！") == ""
+
+
+def test_query_terms_are_deduplicated_and_capped():
+    assert to_tsquery_text("退款 退款") == "'退款'"
+    query = " ".join(f"w{i:03d}" for i in range(100))
+    assert to_tsquery_text(query).count("|") == 63
@@ -0,0 +1,47 @@
+import random
+
+from app.core.rag_service import merge_chunk_ranges
+
+
+def _hit(document_id, chunk_index):
+    return {"document_id": document_id, "chunk_index": chunk_index}
+
+
+def test_overlapping_ranges_merge():
+    hits = [_hit(1, 5), _hit(1, 7)]
+    assert merge_chunk_ranges(hits, 1) == [(1, 4, 8)]
+
+
+def test_touching_ranges_merge_and_gaps_do_not():
+    assert merge_chunk_ranges([_hit(1, 2), _hit(1, 5)], 1) == [(1, 1, 6)]
+    assert merge_chunk_ranges([_hit(1, 2), _hit(1, 6)], 1) == [(1, 1, 3), (1, 5, 7)]
+
+
+def test_documents_kept_separate_and_clamped_at_zero():
+    hits = [_hit(2, 0), _hit(1, 3), _hit(2, 1)]
+    assert merge_chunk_ranges(hits, 2) == [(1, 1, 5), (2, 0, 3)]
+
+
+def test_window_zero_and_duplicates():
+    assert merge_chunk_ranges([_hit(1, 4), _hit(1, 4), _hit(1, 5)], 0) == [(1, 4, 5)]
+    assert merge_chunk_ranges([], 2) == []
+
+
+def test_ranges_cover_exactly_the_expanded_hits():
+    rng = random.Random(0)
+    for _ in range(200):
+        window = rng.randint(0, 3)
+        hits = [_hit(rng.randint(1, 3), rng.randint(0, 30)) for _ in range(rng.randint(1, 10))]
+        ranges = merge_chunk_ranges(hits, window)
+
+        expected = {
+            (h["document_id"], i)
+            for h in hits
+            for i in range(max(h["chunk_index"] - window, 0), h["chunk_index"] + window + 1)
+        }
+        covered = [(d, i) for d, low, high in ranges for i in range(low, high + 1)]
+        assert len(covered) == len(set(covered))  # 范围之间不重叠
+        assert set(covered) == expected
+        # 同一文档的相邻范围之间至少隔一个片段（否则应合并）
+        for (d1, _, high), (d2, low, _) in zip(ranges, ranges[1:]):
+            assert d1 < d2 or low > high + 1
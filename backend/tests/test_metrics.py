@@ -0,0 +1,36 @@
+import asyncio
+
+from app.core import metrics
+
+
+def test_bound_children_share_labels():
+    before = sum(metrics.INGESTION_STAGE_LOAD.counts)
+    metrics.INGESTION_STAGE_SECONDS.labels("load").observe(0.5)
+    assert sum(metrics.INGESTION_STAGE_LOAD.counts) == before + 1
+    assert metrics.CHAT_REQUESTS.labels("stream", "true") is metrics.CHAT_REQUESTS_STREAM_CACHED
+
+
+def test_http_server_serves_metrics():
+    async def scrape(path):
+        server = await metrics.start_http_server(0, "127.0.0.1")
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return response.decode()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    metrics.INGESTION_JOBS_COMPLETED.inc()
+    response = asyncio.run(scrape("/metrics"))
+    head, body = response.split("\r\n\r\n", 1)
+    assert head.startswith("HTTP/1.1 200")
+    assert f"Content-Type: {metrics.CONTENT_TYPE}" in head
+    assert 'rag_ingestion_jobs_total{status="completed"}' in body
+    assert body == metrics.render()
+
+    assert asyncio.run(scrape("/other")).startswith("HTTP/1.1 404")
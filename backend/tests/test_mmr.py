@@ -0,0 +1,34 @@
+import numpy as np
+
+from app.core.mmr import mmr_select
+
+
+def _relevance_order(query, candidates):
+    candidates = candidates / np.linalg.norm(candidates, axis=1, keepdims=True)
+    return np.argsort(-(candidates @ (query / np.linalg.norm(query))), kind="stable").tolist()
+
+
+def test_lambda_one_is_relevance_order():
+    rng = np.random.default_rng(0)
+    query = rng.standard_normal(32)
+    candidates = rng.standard_normal((20, 32))
+    assert mmr_select(query, candidates, 8, lambda_mult=1.0) == _relevance_order(query, candidates)[:8]
+
+
+def test_duplicates_are_skipped():
+    query = np.array([1.0, 0.0, 0.0])
+    candidates = np.array(
+        [
+            [1.0, 0.1, 0.0],
+            [1.0, 0.1, 0.0],  # 与第一个完全相同
+            [0.7, 0.0, 0.7],
+        ]
+    )
+    assert mmr_select(query, candidates, 2, lambda_mult=1.0) == [0, 1]
+    assert mmr_select(query, candidates, 2, lambda_mult=0.5) == [0, 2]
+
+
+def test_k_bounds():
+    candidates = np.eye(3)
+    assert mmr_select([1.0, 0.0, 0.0], candidates, 0) == []
+    assert sorted(mmr_select([1.0, 0.0, 0.0], candidates, 10)) == [0, 1, 2]
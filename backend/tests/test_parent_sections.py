@@ -0,0 +1,75 @@
+import asyncio
+from types import SimpleNamespace
+
+from langchain_core.documents import Document
+
+from app.core.rag_service import rag_service
+
+
+def test_children_stay_inside_their_section():
+    paragraphs = [f"第{i}段。" + "这是一段用于测试的文字，" * 30 for i in range(20)]
+    documents = [
+        Document(page_content="\n\n".join(paragraphs[:10]), metadata={"page": 1}),
+        Document(page_content="\n\n".join(paragraphs[10:]), metadata={"page": 2}),
+    ]
+
+    sections, chunks = rag_service.split_sections(documents)
+
+    assert len(sections) > 2
+    assert len(chunks) > len(sections)
+    indexes = [chunk.metadata["section_index"] for chunk in chunks]
+    assert indexes == sorted(indexes)
+    assert set(indexes) == set(range(len(sections)))
+    for chunk in chunks:
+        section = sections[chunk.metadata["section_index"]]
+        assert chunk.page_content in section.page_content
+        # 段落不跨页，子片段保留页码
+        assert chunk.metadata["page"] == section.metadata["page"]
+
+
+class _Db:
+    """只返回预设 (片段 → 段落) 映射的会话"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    async def execute(self, statement, params):
+        self.calls.append(params)
+        return [row for row in self.rows if row.chunk_id in params["chunk_ids"]]
+
+
+def _section(chunk_id, section_id):
+    return SimpleNamespace(
+        chunk_id=chunk_id, id=section_id, section_index=section_id, content=f"段落{section_id}"
+    )
+
+
+def _hit(chunk_id, score):
+    return {"id": chunk_id, "content": f"片段{chunk_id}", "chunk_index": chunk_id, "score": score}
+
+
+def test_hits_are_merged_per_section():
+    db = _Db([_section(1, 10), _section(2, 10), _section(3, 20)])
+    hits = [_hit(1, 0.7), _hit(3, 0.8), _hit(2, 0.9), _hit(4, 0.75)]
+
+    resolved = asyncio.run(rag_service.resolve_sections(db, hits))
+
+    # 一次查询取出全部段落
+    assert db.calls == [{"chunk_ids": [1, 3, 2, 4]}]
+    assert [hit.get("section_id") for hit in resolved] == [10, 20, None]
+    first, second, unresolved = resolved
+    # 段落的 score 取其中最相关片段的相似度
+    assert first["score"] == 0.9
+    assert first["content"] == "段落10"
+    assert first["chunk_ids"] == [1, 2]
+    assert first["chunk_index"] is None
+    assert second["chunk_ids"] == [3]
+    # 没有段落的片段原样保留
+    assert unresolved == _hit(4, 0.75)
+
+
+def test_empty_hits_skip_the_query():
+    db = _Db([])
+    assert asyncio.run(rag_service.resolve_sections(db, [])) == []
+    assert db.calls == []
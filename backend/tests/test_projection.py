@@ -0,0 +1,49 @@
+import numpy as np
+
+from app.core.projection import Projection, fit_pca
+from app.models.projection import VectorProjection
+
+
+def _samples(n=500, source_dim=12, seed=0):
+    # 方差集中在前 3 个方向，其余为小噪声
+    rng = np.random.default_rng(seed)
+    basis = np.linalg.qr(rng.standard_normal((source_dim, source_dim)))[0]
+    scales = np.array([10.0, 5.0, 3.0] + [0.01] * (source_dim - 3))
+    return (rng.standard_normal((n, source_dim)) * scales) @ basis.T + 2.0, basis
+
+
+def test_fit_pca_recovers_principal_subspace():
+    samples, basis = _samples()
+    mean, components, explained = fit_pca(samples, 3)
+    assert components.shape == (3, 12)
+    np.testing.assert_allclose(mean, samples.mean(axis=0), atol=1e-4)
+    np.testing.assert_allclose(components @ components.T, np.eye(3), atol=1e-4)
+    # 投影矩阵张成的子空间与真实主方向一致
+    overlap = np.linalg.svd(components @ basis[:, :3])[1]
+    np.testing.assert_allclose(overlap, np.ones(3), atol=1e-3)
+    assert explained > 0.99
+
+
+def test_projection_round_trip_through_model():
+    samples, _ = _samples()
+    mean, components, explained = fit_pca(samples, 3)
+    model = VectorProjection(
+        id=7,
+        method="pca",
+        source_dim=12,
+        dim=3,
+        sample_size=len(samples),
+        explained_variance=explained,
+        mean=mean.tobytes(),
+        components=components.tobytes(),
+    )
+    projection = Projection.from_model(model)
+    assert projection.column == "embedding_reduced_7"
+
+    reduced = projection.project(samples)
+    assert reduced.shape == (len(samples), 3)
+    np.testing.assert_allclose(reduced, (samples - mean) @ components.T, rtol=1e-4, atol=1e-3)
+    np.testing.assert_allclose(projection.project(samples[0]), reduced[0], rtol=1e-4, atol=1e-3)
+    # 投影后的点积近似原始中心化点积（丢弃的方向只有噪声）
+    centered = samples - mean
+    np.testing.assert_allclose(reduced[:20] @ reduced[0], centered[:20] @ centered[0], rtol=0.01, atol=0.5)
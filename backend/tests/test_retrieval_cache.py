@@ -0,0 +1,93 @@
+import asyncio
+
+from app.core import rag_service as rag_service_module
+from app.core.cache import TTLCache
+from app.core.rag_service import rag_service
+
+
+def _patch(monkeypatch):
+    state = {"calls": [], "generation": 1}
+
+    async def search(db, query, top_k, *args):
+        state["calls"].append((query, top_k))
+        await asyncio.sleep(0.01)
+        return [{"content": f"{query}-{i}", "score": 1.0 - i / 10} for i in range(top_k)]
+
+    async def corpus_generation():
+        return state["generation"]
+
+    monkeypatch.setattr(rag_service, "_search", search)
+    monkeypatch.setattr(rag_service, "retrieval_cache", TTLCache(maxsize=10, ttl=60))
+    monkeypatch.setattr(rag_service_module, "corpus_generation", corpus_generation)
+    return state
+
+
+def _search(query, top_k=2):
+    return rag_service.search_similar(
+        None, query, top_k=top_k, hybrid=False, mmr=False, neighbours=0, parents=False
+    )
+
+
+def test_repeated_query_is_served_from_cache(monkeypatch):
+    state = _patch(monkeypatch)
+
+    async def run():
+        first = await _search("退款政策")
+        # 归一化后相同的查询命中同一条缓存
+        second = await _search("  退款政策 ")
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second
+    assert len(state["calls"]) == 1
+    assert rag_service.retrieval_cache.hits == 1
+
+
+def test_concurrent_misses_load_once(monkeypatch):
+    state = _patch(monkeypatch)
+
+    async def run():
+        return await asyncio.gather(*(_search("退款政策") for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert all(result == results[0] for result in results)
+    assert len(state["calls"]) == 1
+
+
+def test_corpus_change_and_parameters_are_part_of_key(monkeypatch):
+    state = _patch(monkeypatch)
+
+    async def run():
+        await _search("退款政策")
+        await _search("退款政策", top_k=3)
+        # 文档变更后语料版本递增，旧结果不再使用
+        state["generation"] += 1
+        await _search("退款政策")
+
+    asyncio.run(run())
+    assert state["calls"] == [("退款政策", 2), ("退款政策", 3), ("退款政策", 2)]
+
+
+def test_returned_hits_are_copies(monkeypatch):
+    _patch(monkeypatch)
+
+    async def run():
+        hits = await _search("退款政策")
+        hits[0]["content"] = "已修改"
+        hits[0]["extra"] = True
+        return await _search("退款政策")
+
+    hits = asyncio.run(run())
+    assert hits[0] == {"content": "退款政策-0", "score": 1.0}
+
+
+def test_disabled_cache_always_searches(monkeypatch):
+    state = _patch(monkeypatch)
+    monkeypatch.setattr(rag_service, "retrieval_cache", TTLCache(maxsize=0, ttl=60))
+
+    async def run():
+        await _search("退款政策")
+        await _search("退款政策")
+
+    asyncio.run(run())
+    assert len(state["calls"]) == 2
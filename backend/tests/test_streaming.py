@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.core.streaming import stream_in_thread
+
+
+def _blocking_stream(n, delay=0.0):
+    for i in range(n):
+        time.sleep(delay)
+        yield i
+
+
+async def _collect(stream):
+    return [item async for item in stream]
+
+
+def test_items_arrive_in_order():
+    result = asyncio.run(_collect(stream_in_thread(lambda: _blocking_stream(200), maxsize=4)))
+    assert result == list(range(200))
+
+
+def test_blocking_streams_run_concurrently():
+    executor = ThreadPoolExecutor(2)
+
+    async def run():
+        return await asyncio.gather(
+            _collect(stream_in_thread(lambda: _blocking_stream(5, 0.04), executor)),
+            _collect(stream_in_thread(lambda: _blocking_stream(5, 0.04), executor)),
+        )
+
+    started = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    executor.shutdown()
+
+    assert results == [list(range(5))] * 2
+    # 两路流各 200ms，并行执行而不是依次执行
+    assert elapsed < 0.3
+
+
+def test_iterator_error_is_raised_in_consumer():
+    def failing():
+        yield 1
+        raise ValueError("模型调用失败")
+
+    async def run():
+        received = []
+        with pytest.raises(ValueError, match="模型调用失败"):
+            async for item in stream_in_thread(failing):
+                received.append(item)
+        return received
+
+    assert asyncio.run(run()) == [1]
+
+
+def test_slow_consumer_bounds_the_producer():
+    produced = []
+
+    def stream():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    async def run():
+        received = []
+        async for item in stream_in_thread(stream, maxsize=2):
+            received.append(item)
+            await asyncio.sleep(0.01)
+            # 生产线程最多领先队列容量（外加一个正在放入的元素）
+            assert len(produced) - len(received) <= 4
+        return received
+
+    assert asyncio.run(run()) == list(range(100))
+
+
+def test_consumer_exit_closes_iterator():
+    closed = threading.Event()
+    produced = []
+
+    def stream():
+        try:
+            for i in range(1000):
+                produced.append(i)
+                yield i
+        finally:
+            closed.set()
+
+    async def run():
+        agen = stream_in_thread(stream, maxsize=2)
+        async for item in agen:
+            if item == 2:
+                break
+        # 客户端断开：关闭异步生成器
+        await agen.aclose()
+        return await asyncio.to_thread(closed.wait, 2)
+
+    assert asyncio.run(run())
+    assert len(produced) < 1000
@@ -0,0 +1,29 @@
+from app.config import settings
+from app.db.vector_index import ivfflat_lists, options_fit
+
+
+def test_ivfflat_lists_auto(monkeypatch):
+    monkeypatch.setattr(settings, "IVFFLAT_LISTS", 0)
+    assert ivfflat_lists(500) == 1
+    assert ivfflat_lists(50_000) == 50
+    assert ivfflat_lists(4_000_000) == 2000
+
+
+def test_ivfflat_lists_configured(monkeypatch):
+    monkeypatch.setattr(settings, "IVFFLAT_LISTS", 100)
+    assert ivfflat_lists(500) == 100
+
+
+def test_auto_lists_rebuilt_when_data_outgrows_index(monkeypatch):
+    monkeypatch.setattr(settings, "IVFFLAT_LISTS", 0)
+    assert options_fit("ivfflat", {"lists": 10}, {"lists": 15})
+    assert options_fit("ivfflat", {"lists": 10}, {"lists": 20})
+    assert not options_fit("ivfflat", {"lists": 10}, {"lists": 21})
+    assert not options_fit("ivfflat", {"lists": 10}, {"lists": 4})
+
+
+def test_configured_options_must_match(monkeypatch):
+    monkeypatch.setattr(settings, "IVFFLAT_LISTS", 100)
+    assert options_fit("ivfflat", {"lists": 100}, {"lists": 100})
+    assert not options_fit("ivfflat", {"lists": 50}, {"lists": 100})
+    assert not options_fit("hnsw", {"m": 16}, {"m": 16, "ef_construction": 64})
@@ -0,0 +1,201 @@
+import asyncio
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from app.db.bulk import encode_binary_quantized, encode_halfvec
+
+
+def test_halfvec_header_and_big_endian_float16():
+    data = encode_halfvec([1.0, -2.0, 0.5])
+    assert struct.unpack("!HH", data[:4]) == (3, 0)
+    assert len(data) == 4 + 3 * 2
+    # float16 网络字节序：1.0 = 0x3c00
+    assert data[4:6] == b"\x3c\x00"
+    assert np.frombuffer(data[4:], dtype=">f2").tolist() == [1.0, -2.0, 0.5]
+
+
+def test_halfvec_round_trip_precision():
+    values = np.random.default_rng(0).standard_normal(1536).astype(np.float32)
+    data = encode_halfvec(values)
+    assert struct.unpack("!HH", data[:4]) == (1536, 0)
+    decoded = np.frombuffer(data[4:], dtype=">f2").astype(np.float32)
+    np.testing.assert_array_equal(decoded, values.astype(np.float16).astype(np.float32))
+
+
+def test_binary_quantized_bit_length_and_msb_first():
+    # 9 位：第 1 位和第 9 位为 1，各占一个字节的最高位
+    data = encode_binary_quantized([0.3, -1, -1, -1, -1, -1, -1, -1, 2.0])
+    assert struct.unpack("!i", data[:4]) == (9,)
+    assert data[4:] == b"\x80\x80"
+
+
+def test_binary_quantized_matches_binary_quantize():
+    # binary_quantize：大于 0 为 1，0 和负数为 0
+    values = [0.0, 1e-6, -1e-6, 5.0, 0.0, 0.0, 0.0, 1.0]
+    data = encode_binary_quantized(values)
+    assert data[4:] == bytes([0b01010001])
+    bits = np.unpackbits(np.frombuffer(data[4:], dtype=np.uint8))[: len(values)]
+    assert bits.tolist() == [1 if v > 0 else 0 for v in values]
+
+
+def test_binary_quantized_1536_dimensions():
+    values = np.random.default_rng(1).standard_normal(1536)
+    data = encode_binary_quantized(values)
+    assert struct.unpack("!i", data[:4]) == (1536,)
+    assert len(data) == 4 + 1536 // 8
+
+
+# 以下测试需要 pgvector 0.7+ 的数据库：TEST_DATABASE_URL 指向可写的测试库
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+async def _with_test_connection(check):
+    # 全部操作在事务中回滚
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from app.db.vector_index import _pgvector_version
+
+    engine = create_async_engine(TEST_DATABASE_URL)
+    try:
+        async with engine.connect() as conn:
+            if await _pgvector_version(conn) < (0, 7):
+                return "pgvector < 0.7"
+            transaction = await conn.begin()
+            try:
+                await check(conn)
+            finally:
+                await transaction.rollback()
+    finally:
+        await engine.dispose()
+    return None
+
+
+def _run_db_test(check):
+    if not TEST_DATABASE_URL:
+        pytest.skip("未设置 TEST_DATABASE_URL")
+    reason = asyncio.run(_with_test_connection(check))
+    if reason:
+        pytest.skip(reason)
+
+
+def test_encoders_round_trip_through_copy():
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    from app.db.bulk import copy_rows
+
+    values = [0.25, -1.5, 0.0, 3.0, -0.125, 2.0, 1.0, -4.0, 0.5]
+    literal = "[" + ",".join(str(v) for v in values) + "]"
+
+    async def check(conn):
+        await conn.execute(text("CREATE TEMP TABLE t (h halfvec(9), b bit(9))"))
+        await copy_rows(
+            AsyncSession(bind=conn),
+            "t",
+            ["h", "b"],
+            [[encode_halfvec(values), encode_binary_quantized(values)]],
+        )
+        row = (
+            await conn.execute(
+                text(
+                    "SELECT h = CAST(CAST(:v AS vector) AS halfvec(9)) AS h_ok, "
+                    "b = binary_quantize(CAST(:v AS vector)) AS b_ok FROM t"
+                ),
+                {"v": literal},
+            )
+        ).one()
+        assert row.h_ok and row.b_ok
+
+    _run_db_test(check)
+
+
+def test_storage_mode_switch_backfills_and_drops(monkeypatch):
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from app.config import settings
+    from app.db import vector_index
+    from app.db.session import Base
+
+    if not TEST_DATABASE_URL:
+        pytest.skip("未设置 TEST_DATABASE_URL")
+
+    embedding = "[" + ",".join("1" if i % 3 else "-1" for i in range(1536)) + "]"
+
+    async def scalar(engine, sql):
+        async with engine.connect() as conn:
+            return (await conn.execute(text(sql))).scalar()
+
+    # 结构变更和回填都会提交，不能放在回滚的事务中：测试数据写入测试库，结束时删除
+    async def run():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        try:
+            async with engine.connect() as conn:
+                if await vector_index._pgvector_version(conn) < (0, 7):
+                    return "pgvector < 0.7"
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                document_id = (
+                    await conn.execute(
+                        text(
+                            "INSERT INTO documents (filename, file_path, file_type, file_size, status) "
+                            "VALUES ('t.txt', 't.txt', 'txt', 1, 'completed') RETURNING id"
+                        )
+                    )
+                ).scalar()
+                await conn.execute(
+                    text(
+                        "INSERT INTO document_chunks (document_id, chunk_index, content, embedding) "
+                        "VALUES (:d, 0, 'x', CAST(:e AS vector))"
+                    ),
+                    {"d": document_id, "e": embedding},
+                )
+            try:
+                monkeypatch.setattr(vector_index, "_storage_ready", False)
+                monkeypatch.setattr(settings, "VECTOR_STORAGE_MODE", "halfvec")
+                await vector_index.ensure_vector_storage(engine)
+                # 回填完成前检索不使用压缩列
+                assert vector_index.search_storage() is None
+                assert await vector_index.backfill_vector_storage(engine) >= 1
+                assert vector_index.search_storage() is vector_index.STORAGE_MODES["halfvec"]
+                assert await scalar(
+                    engine,
+                    f"SELECT embedding_half IS NOT NULL FROM document_chunks WHERE document_id = {document_id}",
+                )
+
+                monkeypatch.setattr(settings, "VECTOR_STORAGE_MODE", "binary")
+                await vector_index.ensure_vector_storage(engine)
+                await vector_index.backfill_vector_storage(engine)
+                async with engine.connect() as conn:
+                    columns = (
+                        await conn.execute(
+                            text(
+                                "SELECT column_name FROM information_schema.columns "
+                                "WHERE table_name = 'document_chunks' AND column_name LIKE 'embedding_%'"
+                            )
+                        )
+                    ).scalars().all()
+                assert columns == ["embedding_bit"]
+                assert await scalar(
+                    engine,
+                    "SELECT embedding_bit = binary_quantize(embedding) FROM document_chunks "
+                    f"WHERE document_id = {document_id}",
+                )
+            finally:
+                monkeypatch.setattr(settings, "VECTOR_STORAGE_MODE", "full")
+                await vector_index.ensure_vector_storage(engine)
+                async with engine.begin() as conn:
+                    await conn.execute(
+                        text("DELETE FROM document_chunks WHERE document_id = :d"), {"d": document_id}
+                    )
+                    await conn.execute(text("DELETE FROM documents WHERE id = :d"), {"d": document_id})
+        finally:
+            await engine.dispose()
+        return None
+
+    reason = asyncio.run(run())
+    if reason:
+        pytest.skip(reason)
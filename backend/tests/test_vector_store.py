@@ -0,0 +1,56 @@
+import asyncio
+
+import numpy as np
+
+from app.core.vector_store import NumpyVectorStore, SearchScope
+
+DIM = 16
+
+
+def _brute_force(vectors, query, k):
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = vectors @ (query / np.linalg.norm(query))
+    top = np.argsort(-scores, kind="stable")[:k]
+    return top, scores[top]
+
+
+def _store(tmp_path, n, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, DIM)).astype(np.float32)
+    store = NumpyVectorStore(str(tmp_path), dim=DIM)
+    ids = list(range(100, 100 + n))
+    store.add_sync(ids, [i % 5 for i in range(n)], [i % 2 for i in range(n)], vectors)
+    return store, vectors, np.asarray(ids), rng
+
+
+def test_top_k_matches_brute_force(tmp_path):
+    # 超过初始容量，覆盖扩容
+    store, vectors, ids, rng = _store(tmp_path, 1500)
+    for _ in range(5):
+        query = rng.standard_normal(DIM)
+        chunk_ids, scores, _ = store.top_k(query, 10)
+        expected, expected_scores = _brute_force(vectors, query, 10)
+        assert chunk_ids.tolist() == ids[expected].tolist()
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5, atol=1e-6)
+
+
+def test_top_k_with_scope_and_deletes(tmp_path):
+    store, vectors, ids, rng = _store(tmp_path, 300)
+    asyncio.run(store.delete([int(i) for i in ids[:50]]))
+    query = rng.standard_normal(DIM)
+
+    chunk_ids, _, _ = store.top_k(query, 8, SearchScope(owner_id=1, document_ids=[2, 3]))
+    rows = np.array(
+        [i for i in range(50, 300) if i % 2 == 1 and i % 5 in (2, 3)]
+    )
+    expected, _ = _brute_force(vectors[rows], query, 8)
+    assert chunk_ids.tolist() == ids[rows[expected]].tolist()
+
+
+def test_reopen_keeps_vectors(tmp_path):
+    store, vectors, ids, rng = _store(tmp_path, 40)
+    query = rng.standard_normal(DIM)
+    before = store.top_k(query, 5)[0].tolist()
+    reopened = NumpyVectorStore(str(tmp_path), dim=DIM)
+    assert len(reopened) == 40
+    assert reopened.top_k(query, 5)[0].tolist() == before